@@ -2,9 +2,11 @@
 Application factory and initialization for the Flask application.
 
 This module sets up the Flask application using the factory pattern. It initializes
-extensions such as SQLAlchemy, Flask-Migrate, and Flask-Login, and registers blueprints
-for routing. The configuration can be dynamically loaded based on the provided
-configuration class.
+extensions such as SQLAlchemy, Flask-Migrate, Flask-Login and Flask-SocketIO (with the
+async mode from `SOCKETIO_ASYNC_MODE` and the message queue from
+`SOCKETIO_MESSAGE_QUEUE`, if any), and registers blueprints
+for routing along with the maintenance CLI commands. The configuration can be
+dynamically loaded based on the provided configuration class.
 """
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
@@ -13,13 +15,14 @@ from flask_migrate import Migrate
 from .config import DevelopmentConfig
 from flask_wtf import CSRFProtect
 from flask_socketio import SocketIO
+from .pubsub import client_manager
 
 db = SQLAlchemy()
 migrate = Migrate()
 login_manager = LoginManager()
 login_manager.login_view = 'main.login'  
 csrf = CSRFProtect()
-socketio =SocketIO(async_mode='threading')
+socketio = SocketIO()
 
 def create_app(config_class=None):
     """
@@ -42,16 +45,42 @@ def create_app(config_class=None):
     else:
         app.config.from_object(DevelopmentConfig)
 
+    # Importing the routes registers their Socket.IO handlers; this must happen
+    # before `socketio.init_app` so the handlers are attached to every app's server.
+    from .routes import main as main_blueprint
+
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     csrf.init_app(app)
-    socketio.init_app(app)
+    socketio.init_app(
+        app,
+        async_mode=app.config.get('SOCKETIO_ASYNC_MODE', 'threading'),
+        client_manager=client_manager(
+            app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+            app.config.get('SOCKETIO_CHANNEL', 'flask-socketio')
+        )
+    )
     
     login_manager.login_view = 'main.login'
     login_manager.login_message_category = 'info'
     
-    from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint, url_prefix='/')
 
+    from .writebehind import init_message_writer
+    init_message_writer(app)
+
+    from .presence import init_presence
+    init_presence(app)
+
+    # Importing the module connects its `calendar_changed` listener.
+    from . import calendar_push  # noqa: F401
+
+    from .commands import (archive_messages_command, compact_event_changes_command, rebuild_busy_hours_command,
+                           socketio_broker_command)
+    app.cli.add_command(rebuild_busy_hours_command)
+    app.cli.add_command(socketio_broker_command)
+    app.cli.add_command(archive_messages_command)
+    app.cli.add_command(compact_event_changes_command)
+
     return app
@@ -0,0 +1,85 @@
+"""
+Busyness analytics over rolling windows of whole weeks.
+
+For a user's calendar over the last 4, 12 or 52 weeks, reports busy hours per
+weekday, per hour of the day and per week. The figures are computed from a
+single busy bitmap (see `app.availability`), so no Python loop runs over the
+events once they are loaded.
+
+Results are cached in-process per (user, calendar version, privacy level,
+window, day). Since the version moves with every committed change, entries
+never outlive the calendar they were computed from, even when another process
+made the change. The entries for a user are also dropped as soon as a change
+to one of their events is committed here, through the `calendar_changed`
+signal, to free the memory early.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from . import availability
+from .events import EventRepository, calendar_changed, changed_user_ids
+
+WINDOWS = (4, 12, 52)
+CACHE_SIZE = 1024
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def invalidate(user_id):
+    """
+    Drop every cached result for the given user.
+    """
+    with _lock:
+        for key in [key for key in _cache if key[0] == user_id]:
+            del _cache[key]
+
+
+@calendar_changed.connect
+def _invalidate_changed_calendars(sender, changes):
+    for user_id in changed_user_ids(changes):
+        invalidate(user_id)
+
+
+def busyness(user, weeks, today, privacy_level=None):
+    """
+    Return busy hours for `user` over the `weeks` weeks ending with `today`.
+
+    Args:
+        user (User): The user whose calendar is analysed.
+        weeks (int): Length of the rolling window, one of `WINDOWS`.
+        today (date): The last day included in the window.
+        privacy_level (str): If set, only count events with this privacy level.
+
+    Returns:
+        dict: JSON-ready totals per weekday (Monday first), per hour of the day
+        and per week (oldest first).
+    """
+    key = (user.id, user.calendar_version, privacy_level, weeks, today)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    window_end = datetime.combine(today + timedelta(days=1), datetime.min.time())
+    window_start = window_end - timedelta(weeks=weeks)
+    intervals = EventRepository(user, privacy_level).intervals(window_start, window_end)
+    bitmap = availability.busy_bitmap(intervals, window_start, window_end)
+    daily = availability.daily_hours(bitmap)
+
+    result = {
+        'weeks': weeks,
+        'start': window_start.strftime('%Y-%m-%d'),
+        'end': today.strftime('%Y-%m-%d'),
+        'total_hours': float(daily.sum()),
+        'weekday_hours': availability.weekday_hours(bitmap, window_start).tolist(),
+        'hour_of_day_hours': availability.hour_of_day_hours(bitmap).tolist(),
+        'weekly_hours': daily.reshape(weeks, 7).sum(axis=1).tolist(),
+    }
+    with _lock:
+        _cache[key] = result
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -0,0 +1,143 @@
+"""
+Cold storage for old chat messages.
+
+`archive_messages` (run with `flask archive-messages`) moves the messages
+older than a cutoff out of the `message` table into `MessageArchive`
+segments: up to `SEGMENT_SIZE` consecutive messages of one conversation,
+stored as zlib-compressed JSON. The latest message of each conversation stays
+in the hot table, since the inbox points at it. Archived messages are no
+longer found by the full-text search.
+
+`archived_page` reads the segments back, so `app.messages.conversation_page`
+can carry on into the archive when a client pages past the hot messages.
+Archived messages are returned as `ArchivedMessage` tuples, which serialize
+and make cursors like `Message` rows.
+"""
+
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, delete, or_, select, tuple_
+
+from . import db
+from .models import ConversationSummary, Message, MessageArchive, User
+
+SEGMENT_SIZE = 500
+
+ArchivedMessage = namedtuple(
+    'ArchivedMessage', ['id', 'sender_id', 'recipient_id', 'content', 'timestamp', 'read', 'sender', 'recipient']
+)
+
+
+def _encode(messages):
+    rows = [[m.id, m.sender_id, m.recipient_id, m.content, m.timestamp.isoformat(), bool(m.read)] for m in messages]
+    return zlib.compress(json.dumps(rows).encode())
+
+
+def _decode(data, users):
+    return [
+        ArchivedMessage(message_id, sender_id, recipient_id, content, datetime.fromisoformat(timestamp), read,
+                        users[sender_id], users[recipient_id])
+        for message_id, sender_id, recipient_id, content, timestamp, read in json.loads(zlib.decompress(data))
+    ]
+
+
+def _between(user_low, user_high):
+    return or_(
+        and_(Message.sender_id == user_low, Message.recipient_id == user_high),
+        and_(Message.sender_id == user_high, Message.recipient_id == user_low),
+    )
+
+
+def archive_conversation(user_low, user_high, older_than, segment_size=SEGMENT_SIZE):
+    """
+    Move the conversation's messages older than `older_than` into archive segments, one committed segment at a time.
+
+    Returns:
+        int: The number of messages archived.
+    """
+    latest = db.session.scalar(
+        select(ConversationSummary.last_message_id)
+        .where(ConversationSummary.user_id == user_low, ConversationSummary.peer_id == user_high)
+    )
+    archived = 0
+    while True:
+        query = Message.query.filter(_between(user_low, user_high), Message.timestamp < older_than)
+        if latest is not None:
+            query = query.filter(Message.id != latest)
+        messages = query.order_by(Message.timestamp, Message.id).limit(segment_size).all()
+        if not messages:
+            return archived
+        first, last = messages[0], messages[-1]
+        db.session.add(MessageArchive(
+            user_low=user_low, user_high=user_high,
+            first_timestamp=first.timestamp, first_id=first.id,
+            last_timestamp=last.timestamp, last_id=last.id,
+            message_count=len(messages), data=_encode(messages),
+        ))
+        db.session.execute(delete(Message).where(Message.id.in_([m.id for m in messages])))
+        db.session.commit()
+        archived += len(messages)
+
+
+def archive_messages(older_than, segment_size=SEGMENT_SIZE):
+    """
+    Archive the messages of every conversation older than `older_than`.
+
+    Returns:
+        int: The number of messages archived.
+    """
+    rows = db.session.execute(
+        select(Message.sender_id, Message.recipient_id).where(Message.timestamp < older_than).distinct()
+    )
+    pairs = {(min(sender_id, recipient_id), max(sender_id, recipient_id)) for sender_id, recipient_id in rows}
+    return sum(archive_conversation(low, high, older_than, segment_size) for low, high in sorted(pairs))
+
+
+def archived_page(user_id, peer_id, before=None, after=None, limit=50):
+    """
+    Read up to `limit` archived messages of a conversation next to a cursor.
+
+    Args:
+        before (tuple): A decoded cursor; read the messages just older than it, newest first.
+        after (tuple): A decoded cursor; read the messages just newer than it, oldest first.
+            Takes precedence over `before`. With neither, the newest archived messages are read.
+
+    Returns:
+        list: `ArchivedMessage` tuples, in the order described above.
+    """
+    user_low, user_high = sorted((user_id, peer_id))
+    pair = (MessageArchive.user_low == user_low, MessageArchive.user_high == user_high)
+    if after is not None:
+        segments = select(MessageArchive).where(
+            *pair, tuple_(MessageArchive.last_timestamp, MessageArchive.last_id) > tuple_(*after)
+        ).order_by(MessageArchive.last_timestamp, MessageArchive.last_id)
+        keep = lambda m: (m.timestamp, m.id) > after
+    else:
+        segments = select(MessageArchive).where(*pair).order_by(
+            MessageArchive.first_timestamp.desc(), MessageArchive.first_id.desc()
+        )
+        if before is not None:
+            segments = segments.where(tuple_(MessageArchive.first_timestamp, MessageArchive.first_id) < tuple_(*before))
+        keep = lambda m: before is None or (m.timestamp, m.id) < before
+
+    # Most conversations have no segments next to the cursor: the segment query
+    # is then the only one, and the participants are loaded once there is one to decode.
+    users = None
+    messages = []
+    result = db.session.scalars(segments.execution_options(yield_per=1))
+    try:
+        for segment in result:
+            if users is None:
+                users = {user.id: user for user in db.session.scalars(
+                    select(User).where(User.id.in_((user_low, user_high)))
+                )}
+            rows = [m for m in _decode(segment.data, users) if keep(m)]
+            messages.extend(rows if after is not None else reversed(rows))
+            if len(messages) >= limit:
+                break
+    finally:
+        result.close()
+    return messages[:limit]
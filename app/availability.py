@@ -0,0 +1,154 @@
+"""
+Group availability: find the times when a set of users are all free.
+
+Calendars are represented as busy bitmaps: NumPy boolean arrays with one entry
+per fixed-width slot (15 minutes by default) from the start of a window, where
+a slot is busy if any event overlaps it. Bitmaps can be combined with
+`union`/`intersection`, scanned for free runs, and summed per day, weekday or
+hour of the day, all without Python-level loops over events.
+
+All participants' events are loaded with a single query and marked into one
+bitmap, and the free runs left in the requested window are ranked. Friends'
+calendars are read with the same privacy rule as the shared calendar: only
+their events marked 'friends' count as busy, while the viewer's own events all count.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import and_, or_, select
+
+from . import db
+from .models import Event, User
+
+MAX_PARTICIPANTS = 100
+MAX_WINDOW_DAYS = 62
+MAX_RESULTS = 50
+SLOT = timedelta(minutes=15)
+
+
+def load_busy_intervals(viewer, friend_ids, window_start, window_end):
+    """
+    Load the busy intervals of the viewer and their friends overlapping the window.
+
+    Returns:
+        list: (start, end) tuples, clipped to the window, in no particular order.
+    """
+    users = User.query.filter(User.id.in_([viewer.id, *friend_ids])).all()
+    lookback = timedelta(seconds=max((u.max_event_seconds or 0) for u in users))
+    visible = or_(
+        Event.user_id == viewer.id,
+        and_(Event.user_id.in_(friend_ids), Event.privacy_level == 'friends')
+    )
+    rows = db.session.execute(select(Event.start_time, Event.end_time).where(
+        visible,
+        Event.start_time >= window_start - lookback,
+        Event.start_time < window_end,
+        Event.end_time > window_start
+    ))
+    return [(max(start, window_start), min(end, window_end)) for start, end in rows]
+
+
+def busy_bitmap(intervals, window_start, window_end, slot=SLOT):
+    """
+    Mark (start, end) intervals into a boolean array of slots covering the window.
+
+    Slot i covers [window_start + i * slot, window_start + (i + 1) * slot) and is
+    busy if any interval overlaps it. Intervals outside the window are clipped,
+    and intervals that end before they start mark no slots.
+    """
+    n_slots = -(-(window_end - window_start) // slot)
+    if not intervals:
+        return np.zeros(n_slots, dtype=bool)
+    offsets = np.fromiter(
+        ((moment - window_start).total_seconds() for interval in intervals for moment in interval),
+        dtype=np.float64, count=2 * len(intervals)
+    ) / slot.total_seconds()
+    first = np.clip(np.floor(offsets[0::2]), 0, n_slots).astype(np.intp)
+    last = np.clip(np.ceil(offsets[1::2]), 0, n_slots).astype(np.intp)
+    # An inverted interval would put its -1 before its +1 and cancel out overlapping ones.
+    last = np.maximum(last, first)
+    delta = np.bincount(first, minlength=n_slots + 1) - np.bincount(last, minlength=n_slots + 1)
+    return np.cumsum(delta[:-1]) > 0
+
+
+def union(bitmaps):
+    """
+    Slots that are busy in any of the bitmaps.
+    """
+    return np.logical_or.reduce(list(bitmaps))
+
+
+def intersection(bitmaps):
+    """
+    Slots that are busy in all of the bitmaps.
+    """
+    return np.logical_and.reduce(list(bitmaps))
+
+
+def free_runs(bitmap, min_slots=1):
+    """
+    Find the runs of free slots at least `min_slots` long.
+
+    Returns:
+        tuple: Arrays of run start indices and (exclusive) run end indices.
+    """
+    free = np.concatenate(([False], ~bitmap, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(free))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = ends - starts >= min_slots
+    return starts[keep], ends[keep]
+
+
+def daily_hours(bitmap, slot=SLOT):
+    """
+    Busy hours per day for a bitmap whose window starts at midnight.
+    """
+    per_day = timedelta(days=1) // slot
+    padded = np.resize(bitmap, -(-len(bitmap) // per_day) * per_day)
+    padded[len(bitmap):] = False
+    return padded.reshape(-1, per_day).sum(axis=1) * (slot / timedelta(hours=1))
+
+
+def weekday_hours(bitmap, window_start, slot=SLOT):
+    """
+    Busy hours per weekday (Monday first) for a bitmap whose window starts at midnight.
+    """
+    days = daily_hours(bitmap, slot)
+    weekdays = (np.arange(len(days)) + window_start.weekday()) % 7
+    return np.bincount(weekdays, weights=days, minlength=7)
+
+
+def hour_of_day_hours(bitmap, slot=SLOT):
+    """
+    Busy hours per hour of the day (0-23) for a bitmap whose window starts at midnight.
+    """
+    per_hour = timedelta(hours=1) // slot
+    per_day = 24 * per_hour
+    padded = np.resize(bitmap, -(-len(bitmap) // per_day) * per_day)
+    padded[len(bitmap):] = False
+    return padded.reshape(-1, 24, per_hour).sum(axis=(0, 2)) * (slot / timedelta(hours=1))
+
+
+def free_windows(busy, window_start, window_end, slot, min_length):
+    """
+    Return the common free windows left between the busy intervals.
+
+    Free time is aligned to the slot grid anchored at `window_start`, and windows
+    shorter than `min_length` are dropped. Results are ranked longest first,
+    then earliest first.
+
+    Args:
+        busy (list): (start, end) tuples for every participant.
+        window_start (datetime): Start of the search window.
+        window_end (datetime): End of the search window.
+        slot (timedelta): Slot granularity the windows are aligned to.
+        min_length (timedelta): Minimum length of a free window.
+
+    Returns:
+        list: (start, end) tuples of free windows.
+    """
+    bitmap = busy_bitmap(busy, window_start, window_end, slot)
+    starts, ends = free_runs(bitmap, -(-min_length // slot))
+    order = np.lexsort((starts, starts - ends))
+    return [(window_start + int(starts[i]) * slot, window_start + int(ends[i]) * slot) for i in order]
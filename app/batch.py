@@ -0,0 +1,161 @@
+"""
+Bulk changes to calendar events.
+
+`apply_operations` backs `POST /api/events/batch`, which creates, updates and
+deletes up to `MAX_BATCH_OPERATIONS` events in one request. Every operation is
+checked with the `EventForm` rules before anything is written, and the events
+to update or delete are loaded and checked against their creator with a
+single query. The batch is applied all or nothing: the new events go in with
+one bulk INSERT returning their ids in order, updates and deletes are flushed
+together, and the derived calendar data is recorded with `record_change`
+before a single commit, so listeners see one `calendar_changed` signal for the
+whole batch.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from . import db
+from .events import EventSnapshot, record_change, snapshot
+from .forms import EventForm
+from .models import Event
+
+MAX_BATCH_OPERATIONS = 500
+
+FIELDS = ('title', 'description', 'start_time', 'end_time', 'privacy_level')
+
+
+def parse_fields(fields):
+    """
+    Convert the JSON values of an operation, or of an event update, to Python ones.
+
+    Returns:
+        tuple: The converted fields and a dict of errors per field.
+    """
+    values, errors = {}, {}
+    for name in FIELDS:
+        if name not in fields:
+            continue
+        value = fields[name]
+        if name in ('start_time', 'end_time'):
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                errors[name] = ['Not a valid datetime value.']
+                continue
+            if value.tzinfo is not None:
+                errors[name] = ['Must be a local time without a UTC offset.']
+                continue
+        elif value is not None and not isinstance(value, str):
+            errors[name] = ['Must be a string.']
+            continue
+        values[name] = value
+    return values, errors
+
+
+def event_fields(event):
+    """
+    Return the current `EventForm` fields of an event, to merge a partial update into.
+    """
+    values = {name: getattr(event, name) for name in FIELDS}
+    values['privacy_level'] = values['privacy_level'] or 'private'
+    return values
+
+
+def validate_event(values):
+    """
+    Check the complete fields of an event against the `EventForm` rules.
+
+    Returns:
+        dict: Error messages per field, empty if the event is valid.
+    """
+    form = EventForm(formdata=None, data=values, meta={'csrf': False})
+    form.validate()
+    return form.errors
+
+
+def apply_operations(user, operations):
+    """
+    Validate and apply a batch of event operations for `user` in one transaction.
+
+    Args:
+        user (User): The user making the changes; events are created on their
+            calendar, and they may only change events they created.
+        operations (list): Dicts with an `op` of 'create', 'update' or 'delete',
+            the `id` of the event for updates and deletes, and the fields of
+            `EventForm` (datetimes in ISO 8601) for creates and updates.
+
+    Returns:
+        tuple: Whether the batch was applied, and one result dict per operation,
+            with a `status` and the event `id`, or the `errors` that stopped the batch.
+    """
+    ids = {op.get('id') for op in operations if isinstance(op, dict) and isinstance(op.get('id'), int)}
+    events = {event.id: event for event in Event.query.filter(Event.id.in_(ids))} if ids else {}
+
+    planned, results = [], []
+    pending, deleted = {}, set()
+    for op in operations:
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind not in ('create', 'update', 'delete'):
+            results.append({'status': 'error', 'errors': {'op': ["Must be 'create', 'update' or 'delete'."]}})
+            continue
+        if kind == 'create':
+            values, errors = parse_fields(op)
+            values = dict({'description': None, 'privacy_level': 'private'}, **values)
+            errors = errors or validate_event(values)
+            results.append({'status': 'error', 'errors': errors} if errors else {'status': 'created'})
+            planned.append((kind, None, values))
+            continue
+
+        event = events.get(op.get('id')) if isinstance(op.get('id'), int) else None
+        if event is None or event.id in deleted:
+            results.append({'status': 'error', 'id': op.get('id'), 'errors': {'id': ['Event not found.']}})
+            continue
+        if event.created_by != user.id:
+            results.append({'status': 'error', 'id': event.id, 'errors': {'id': ['Permission denied.']}})
+            continue
+        if kind == 'delete':
+            deleted.add(event.id)
+            results.append({'status': 'deleted', 'id': event.id})
+            planned.append((kind, event, None))
+            continue
+        values, errors = parse_fields(op)
+        merged = dict(pending.get(event.id) or event_fields(event), **values)
+        errors = errors or validate_event(merged)
+        if not errors:
+            pending[event.id] = merged
+        results.append({'status': 'error', 'id': event.id, 'errors': errors} if errors
+                       else {'status': 'updated', 'id': event.id})
+        planned.append((kind, event, merged))
+
+    if any(result['status'] == 'error' for result in results):
+        return False, results
+
+    creates = [values for kind, _, values in planned if kind == 'create']
+    if creates:
+        rows = [dict(values, user_id=user.id, created_by=user.id) for values in creates]
+        # SQLite has no way to order a multi-row RETURNING, so there SQLAlchemy inserts
+        # row by row, still in this one transaction; other databases get one statement.
+        new_ids = db.session.scalars(insert(Event).returning(Event.id, sort_by_parameter_order=True), rows).all()
+        for row, event_id in zip(rows, new_ids):
+            record_change(None, EventSnapshot(event_id, user.id, row['start_time'], row['end_time'],
+                                              row['privacy_level'], row['title'], row['description']))
+        created = iter(new_ids)
+        for result in results:
+            if result['status'] == 'created':
+                result['id'] = next(created)
+
+    for kind, event, values in planned:
+        if kind == 'create':
+            continue
+        before = snapshot(event)
+        if kind == 'delete':
+            db.session.delete(event)
+            record_change(before, None)
+        else:
+            for name, value in values.items():
+                setattr(event, name, value)
+            record_change(before, snapshot(event))
+    db.session.commit()
+    return True, results
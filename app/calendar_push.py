@@ -0,0 +1,116 @@
+"""
+Live calendar updates over Socket.IO.
+
+When a transaction that changed events commits, the `calendar_changed` signal
+(see `app.events`) is turned into one `calendar_changed` Socket.IO event per
+affected calendar. It goes to the owner's personal room (`user_room`), so
+every open dashboard of theirs can patch its heatmap and day list in place
+instead of fetching them again. Changes to events shared with friends
+(`privacy_level == 'friends'`) also go to the personal rooms of the owner's
+accepted friends, limited to what friends may see: an event made private is
+a deletion for them, and an event made shared an insertion.
+
+The event carries `{"user_id": owner, "changes": [...]}`, each change being
+`{"op", "event_id", "event", "days", "hours"}`: `event` is the event's fields
+(None once deleted), `days` the 'YYYY-MM-DD' days it now covers, and `hours`
+the change of busy hours per day, to add to the heatmap.
+"""
+
+import logging
+
+from sqlalchemy import select
+
+from . import db, socketio
+from .events import calendar_changed, split_by_day
+from .models import Friendship
+from .presence import user_room
+
+logger = logging.getLogger(__name__)
+
+
+def _shared(snapshot):
+    return snapshot if snapshot is not None and snapshot.privacy_level == 'friends' else None
+
+
+def describe_change(before, after):
+    """
+    Return the compact JSON-ready form of a change, or None if the event is absent on both sides.
+    """
+    if before is None and after is None:
+        return None
+    hours = {}
+    for snapshot, sign in ((before, -1), (after, 1)):
+        if snapshot is not None:
+            for day, day_hours in split_by_day(snapshot.start_time, snapshot.end_time):
+                hours[day.isoformat()] = hours.get(day.isoformat(), 0) + sign * day_hours
+    event = None
+    if after is not None:
+        event = {
+            'id': after.id,
+            'title': after.title,
+            'start_time': after.start_time.isoformat(),
+            'end_time': after.end_time.isoformat(),
+            'description': after.description
+        }
+    return {
+        'op': 'insert' if before is None else 'delete' if after is None else 'update',
+        'event_id': (after or before).id,
+        'event': event,
+        'days': [day.isoformat() for day, _ in split_by_day(after.start_time, after.end_time)] if after else [],
+        'hours': {day: round(delta, 6) for day, delta in hours.items() if abs(delta) > 1e-6}
+    }
+
+
+def group_by_calendar(changes):
+    """
+    Split (before, after) snapshot pairs by the calendar they belong to.
+
+    Returns:
+        dict: Lists of (before, after) pairs keyed by owner id; an event moved
+            to another user is a deletion for one and an insertion for the other.
+    """
+    calendars = {}
+    for before, after in changes:
+        if before is not None and after is not None and before.user_id != after.user_id:
+            calendars.setdefault(before.user_id, []).append((before, None))
+            calendars.setdefault(after.user_id, []).append((None, after))
+        else:
+            calendars.setdefault((after or before).user_id, []).append((before, after))
+    return calendars
+
+
+def push_calendar_changes(changes):
+    """
+    Emit `calendar_changed` to the owners of the changed calendars, and to their friends for shared events.
+    """
+    shared = {}
+    for user_id, pairs in group_by_calendar(changes).items():
+        described = [describe_change(before, after) for before, after in pairs]
+        socketio.emit('calendar_changed', {'user_id': user_id, 'changes': described}, to=user_room(user_id))
+        visible = [change for change in (describe_change(_shared(b), _shared(a)) for b, a in pairs) if change]
+        if visible:
+            shared[user_id] = visible
+    if not shared:
+        return
+
+    # The session cannot run SQL after its commit, so friends are read on a connection of their own.
+    friends = {}
+    with db.engine.connect() as connection:
+        rows = connection.execute(
+            select(Friendship.user_id, Friendship.friend_id)
+            .where(Friendship.user_id.in_(shared), Friendship.status == 'accepted')
+        )
+        for user_id, friend_id in rows:
+            friends.setdefault(user_id, []).append(user_room(friend_id))
+    for user_id, visible in shared.items():
+        if friends.get(user_id):
+            socketio.emit('calendar_changed', {'user_id': user_id, 'changes': visible}, to=friends[user_id])
+
+
+@calendar_changed.connect
+def _push_committed_changes(sender, changes):
+    # The changes are already committed, so a failed push must not fail the request.
+    try:
+        push_calendar_changes(changes)
+    except Exception:
+        logger.exception('Cannot push calendar changes')
@@ -0,0 +1,100 @@
+"""
+Command-line maintenance tasks for the Flask application.
+
+The commands are registered on the application in `create_app` and are run
+through the Flask CLI, for example `flask rebuild-busy-hours`.
+"""
+
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+
+from .archive import SEGMENT_SIZE, archive_messages
+from .events import aggregate_daily_hours, rebuild_busy_hours
+from .models import Event, DailyBusyHours
+from .pubsub import UnixSocketBroker, socket_path
+from .sync import compact_event_changes
+
+
+@click.command('rebuild-busy-hours')
+@click.option('--user-id', type=int, default=None, help='Only rebuild the rollup for this user.')
+@click.option('--check', is_flag=True, help='Report differences against the events table without writing.')
+def rebuild_busy_hours_command(user_id, check):
+    """
+    Recompute the daily_busy_hours rollup from the events table.
+    """
+    if not check:
+        rows = rebuild_busy_hours(user_id)
+        click.echo(f'Rebuilt daily_busy_hours: {rows} rows.')
+        return
+
+    criteria = []
+    rollup = DailyBusyHours.query
+    if user_id is not None:
+        criteria.append(Event.user_id == user_id)
+        rollup = rollup.filter(DailyBusyHours.user_id == user_id)
+
+    expected = aggregate_daily_hours(*criteria)
+    stored = {(row.user_id, row.day, row.privacy_level): row.hours for row in rollup}
+    mismatches = [
+        key for key in expected.keys() | stored.keys()
+        if abs(expected.get(key, 0) - stored.get(key, 0)) > 1e-6
+    ]
+    for uid, day, level in sorted(mismatches):
+        click.echo(f'user {uid} {day} {level}: stored {stored.get((uid, day, level), 0):.4f}, '
+                   f'expected {expected.get((uid, day, level), 0):.4f}')
+    click.echo(f'{len(mismatches)} mismatched rows.')
+
+
+@click.command('socketio-broker')
+@click.option('--url', default=None, help='unix:///path URL to listen on (defaults to SOCKETIO_MESSAGE_QUEUE).')
+def socketio_broker_command(url):
+    """
+    Run the Socket.IO message broker used by the unix:// message queue.
+    """
+    url = url or current_app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    try:
+        path = socket_path(url or '')
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+    with UnixSocketBroker(path) as broker:
+        click.echo(f'Socket.IO broker listening on {path}')
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+@click.command('archive-messages')
+@click.option('--days', type=int, default=None,
+              help='Archive messages older than this many days (defaults to CHAT_ARCHIVE_AFTER_DAYS).')
+@click.option('--segment-size', type=int, default=SEGMENT_SIZE, show_default=True,
+              help='Most messages per compressed segment.')
+def archive_messages_command(days, segment_size):
+    """
+    Move old chat messages out of the message table into compressed archive segments.
+    """
+    if days is None:
+        days = current_app.config.get('CHAT_ARCHIVE_AFTER_DAYS', 180)
+    if days < 0 or segment_size < 1:
+        raise click.UsageError('--days must not be negative and --segment-size must be positive.')
+    cutoff = datetime.now() - timedelta(days=days)
+    archived = archive_messages(cutoff, segment_size)
+    click.echo(f'Archived {archived} messages sent before {cutoff:%Y-%m-%d %H:%M}.')
+
+
+@click.command('compact-event-changes')
+@click.option('--days', type=int, default=None,
+              help='Drop log entries older than this many days (defaults to EVENT_CHANGES_RETENTION_DAYS).')
+def compact_event_changes_command(days):
+    """
+    Shorten the event change log used by calendar delta sync.
+    """
+    if days is None:
+        days = current_app.config.get('EVENT_CHANGES_RETENTION_DAYS', 30)
+    if days < 0:
+        raise click.UsageError('--days must not be negative.')
+    cutoff = datetime.now() - timedelta(days=days)
+    removed = compact_event_changes(cutoff)
+    click.echo(f'Removed {removed} event changes; entries from before {cutoff:%Y-%m-%d %H:%M} are gone.')
@@ -0,0 +1,44 @@
+"""
+Running blocking work under the configured Socket.IO async mode.
+
+In the 'gevent' and 'eventlet' modes (`SOCKETIO_ASYNC_MODE`), every Socket.IO
+connection is a greenlet on one event loop per worker process, so an idle
+connection costs a few kilobytes instead of an OS thread. The database driver
+does not cooperate with the event loop, though: a query or commit made directly
+in a handler would stall every other connection of the worker until it
+returns. `run_blocking` hands such work to the async library's pool of OS
+threads and suspends only the calling greenlet. In 'threading' mode it simply
+calls the function.
+"""
+
+from flask import current_app
+
+from . import db, socketio
+
+
+def _in_app_context(app, fn, args, kwargs):
+    with app.app_context():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            db.session.remove()
+
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    Call `fn(*args, **kwargs)` without blocking the event loop and return its result.
+
+    Under 'gevent' or 'eventlet', `fn` runs on a worker thread in a fresh
+    application context with its own database session, which is closed when it
+    returns. It must therefore commit its own changes, and return plain data
+    (such as serialized messages) rather than ORM objects.
+    """
+    if socketio.async_mode == 'gevent':
+        import gevent
+        app = current_app._get_current_object()
+        return gevent.get_hub().threadpool.apply(_in_app_context, (app, fn, args, kwargs))
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        app = current_app._get_current_object()
+        return tpool.execute(_in_app_context, app, fn, args, kwargs)
+    return fn(*args, **kwargs)
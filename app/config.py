@@ -20,9 +20,42 @@ class Config:
         SECRET_KEY (str): Secret key used for session management and security-related features.
                           Loaded from the environment variable 'SECRET_KEY'.
         SQLALCHEMY_TRACK_MODIFICATIONS (bool): Disables SQLAlchemy's event system to reduce overhead.
+        SOCKETIO_MESSAGE_QUEUE (str): Message queue shared by Socket.IO worker processes, e.g.
+                                      'redis://localhost:6379/0' or 'unix:///tmp/socketio.sock'.
+                                      Loaded from the environment variable 'SOCKETIO_MESSAGE_QUEUE';
+                                      unset means a single worker process.
+        SOCKETIO_CHANNEL (str): Channel name on the message queue, shared by all the workers.
+        SOCKETIO_ASYNC_MODE (str): Server mode for Socket.IO: 'threading' (one OS thread per
+                                   connection), or 'gevent' / 'eventlet' (one greenlet per
+                                   connection, database work on a thread pool; see wsgi.py).
+                                   Loaded from the environment variable 'SOCKETIO_ASYNC_MODE'.
+        CHAT_WRITE_BEHIND (bool): Acknowledge chat messages before they are committed and write
+                                  them in batches from a background thread (see app/writebehind.py).
+                                  Single worker only: refused when SOCKETIO_MESSAGE_QUEUE is set.
+                                  Loaded from the environment variable 'CHAT_WRITE_BEHIND'.
+        CHAT_WRITE_BATCH_SIZE (int): Most messages written in one transaction.
+        CHAT_WRITE_INTERVAL_MS (int): Milliseconds a batch waits for more messages.
+        CHAT_WRITE_QUEUE_SIZE (int): Most messages waiting to be written.
+        CHAT_WRITE_SUBMIT_TIMEOUT (float): Seconds a sender waits for room in a full queue
+                                           before the message is refused.
+        CHAT_ARCHIVE_AFTER_DAYS (int): Age in days after which `flask archive-messages` moves
+                                       messages to compressed archive segments.
+        EVENT_CHANGES_RETENTION_DAYS (int): Age in days after which `flask compact-event-changes`
+                                            drops entries of the event change log; clients
+                                            syncing from before them must reload their calendar.
     """
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+    CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+    CHAT_WRITE_BATCH_SIZE = 200
+    CHAT_WRITE_INTERVAL_MS = 5
+    CHAT_WRITE_QUEUE_SIZE = 10000
+    CHAT_WRITE_SUBMIT_TIMEOUT = 1.0
+    CHAT_ARCHIVE_AFTER_DAYS = 180
+    EVENT_CHANGES_RETENTION_DAYS = 30
 
 class DevelopmentConfig(Config):
     """
@@ -39,10 +72,20 @@ class TestConfig(Config):
 
     Attributes:
         TESTING (bool): Enables Flask's testing mode.
+        SECRET_KEY (str): Falls back to a fixed key so tests can sign sessions without the environment variable.
+        WTF_CSRF_ENABLED (bool): Disables CSRF checks so tests can post forms and JSON directly.
         SQLALCHEMY_DATABASE_URI (str): Uses an in-memory SQLite database for fast, isolated testing.
+        SOCKETIO_MESSAGE_QUEUE (str): Always unset, so tests never publish to a real queue.
+        SOCKETIO_ASYNC_MODE (str): Always 'threading', so tests need no monkey-patching.
+        CHAT_WRITE_BEHIND (bool): Off, so stored messages are committed before the request returns.
     """
     TESTING = True
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'test-secret-key')
+    WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory"
+    SOCKETIO_MESSAGE_QUEUE = None
+    SOCKETIO_ASYNC_MODE = 'threading'
+    CHAT_WRITE_BEHIND = False
 
 
 
@@ -0,0 +1,461 @@
+"""
+Time-range queries over calendar events.
+
+This module holds the day/month window arithmetic and the interval-overlap
+queries shared by the calendar routes. An event belongs to a window when it
+overlaps it (`start_time < window_end AND end_time > window_start`), so events
+that run across midnight or across several days show up on every day they cover.
+
+To keep the overlap query a bounded range scan on the `(user_id, start_time)`
+index, every user carries `max_event_seconds`, an upper bound on the length of
+any of their events. Only events starting within that bound before the window
+can overlap it.
+
+Per-day busy hours are served from the `daily_busy_hours` rollup. Every route
+that creates, changes or deletes an event must call `record_change` before
+committing, so the rollup stays in step with the `events` table. The rollup is
+rebuilt with `aggregate_daily_hours`, which sums durations inside the database
+rather than hydrating every `Event`.
+
+Once a transaction containing recorded changes commits, the `calendar_changed`
+signal is sent with the list of (before, after) snapshots, so that caches and
+other listeners can react without the routes having to call them. The same
+transaction increments `User.calendar_version` once for every user whose
+events it changed, so a calendar response can be validated, in any process,
+by comparing versions instead of reading events again. Every change is also
+appended to the `event_changes` log, which `app.sync` serves to clients as
+deltas, and stamped with the new version as its sequence number.
+"""
+
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from blinker import Namespace
+from sqlalchemy import Date, Float, event as sa_event, func, select, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import FunctionElement
+
+from . import db
+from .models import Event, EventChange, User, DailyBusyHours
+
+# Longest window, in days, that `EventRepository.by_day` serves in one request.
+MAX_RANGE_DAYS = 100
+
+EventSnapshot = namedtuple(
+    'EventSnapshot', ['id', 'user_id', 'start_time', 'end_time', 'privacy_level', 'title', 'description']
+)
+
+signals = Namespace()
+calendar_changed = signals.signal('calendar-changed')
+
+
+class day_of(FunctionElement):
+    """
+    SQL expression for the calendar day of a datetime column.
+    """
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(day_of)
+def _day_of_sqlite(element, compiler, **kw):
+    return 'date(%s)' % compiler.process(element.clauses, **kw)
+
+
+@compiles(day_of, 'postgresql')
+def _day_of_postgresql(element, compiler, **kw):
+    return 'CAST(%s AS DATE)' % compiler.process(element.clauses, **kw)
+
+
+class hours_between(FunctionElement):
+    """
+    SQL expression for the number of hours from the first datetime to the second.
+    """
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(hours_between)
+def _hours_between_sqlite(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return '((julianday(%s) - julianday(%s)) * 24)' % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+@compiles(hours_between, 'postgresql')
+def _hours_between_postgresql(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return '(EXTRACT(EPOCH FROM (%s - %s)) / 3600)' % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+def parse_date(date_str):
+    """
+    Parse a 'YYYY-MM-DD' string into a date, raising ValueError if it is invalid.
+    """
+    return datetime.strptime(date_str, '%Y-%m-%d').date()
+
+
+def parse_month(month_str):
+    """
+    Parse a 'YYYY-MM' string into the first day of that month, raising ValueError if it is invalid.
+    """
+    return datetime.strptime(month_str, '%Y-%m').date()
+
+
+def day_bounds(day):
+    """
+    Return the half-open [start, end) datetime window covering a single day.
+    """
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def month_bounds(day):
+    """
+    Return the half-open [start, end) datetime window covering the month of `day`.
+    """
+    start = datetime(day.year, day.month, 1)
+    if day.month == 12:
+        return start, datetime(day.year + 1, 1, 1)
+    return start, datetime(day.year, day.month + 1, 1)
+
+
+def split_by_day(start, end, window_start=None, window_end=None):
+    """
+    Split the interval [start, end) into per-day pieces, optionally clipped to a window.
+
+    Yields:
+        tuple: (date, hours) for every day the clipped interval touches.
+    """
+    if window_start is not None:
+        start = max(start, window_start)
+    if window_end is not None:
+        end = min(end, window_end)
+    while start < end:
+        next_day = datetime.combine(start.date() + timedelta(days=1), datetime.min.time())
+        piece_end = min(end, next_day)
+        yield start.date(), (piece_end - start).total_seconds() / 3600
+        start = piece_end
+
+
+def snapshot(event):
+    """
+    Capture the fields of `event` that derived calendar data depends on.
+    """
+    return EventSnapshot(
+        event.id,
+        event.user_id,
+        event.start_time,
+        event.end_time,
+        event.privacy_level or 'private',
+        event.title,
+        event.description
+    )
+
+
+def serialize_event(event):
+    """
+    Return the JSON-ready dict the event APIs send for an event.
+    """
+    return {
+        'id': event.id,
+        'title': event.title,
+        'start_time': event.start_time.isoformat(),
+        'end_time': event.end_time.isoformat(),
+        'description': event.description,
+        'created_by': event.created_by
+    }
+
+
+def track_duration(event):
+    """
+    Raise the owner's `max_event_seconds` bound if `event` is longer than it.
+
+    Without this, overlap queries could miss the event.
+    """
+    seconds = math.ceil((event.end_time - event.start_time).total_seconds())
+    owner = db.session.get(User, event.user_id)
+    if seconds > (owner.max_event_seconds or 0):
+        owner.max_event_seconds = seconds
+
+
+def apply_busy_hours(event, sign):
+    """
+    Add (sign=1) or remove (sign=-1) an event's hours from the daily rollup.
+
+    Returns:
+        list: The rollup rows touched, which the caller deletes if they end up empty.
+    """
+    rows = []
+    for day, hours in split_by_day(event.start_time, event.end_time):
+        row = db.session.get(DailyBusyHours, (event.user_id, day, event.privacy_level))
+        if row is None:
+            row = DailyBusyHours(user_id=event.user_id, day=day, privacy_level=event.privacy_level, hours=0)
+            db.session.add(row)
+        row.hours += sign * hours
+        rows.append(row)
+    return rows
+
+
+def _busy_fields(event):
+    return event and (event.user_id, event.start_time, event.end_time, event.privacy_level)
+
+
+def log_change(before, after):
+    """
+    Append the change to the `event_changes` log of the calendar(s) it touches.
+    """
+    if before is not None and after is not None and before.user_id != after.user_id:
+        log_change(before, None)
+        log_change(None, after)
+        return
+    current = after or before
+    operation = 'insert' if before is None else 'delete' if after is None else 'update'
+    db.session.add(EventChange(user_id=current.user_id, event_id=current.id, operation=operation))
+
+
+def record_change(before, after):
+    """
+    Update the data derived from an event after it is created, changed or deleted.
+
+    Must be called in the same transaction as the change itself, before committing.
+
+    Args:
+        before (EventSnapshot): The event before the change, or None if it was created.
+        after (EventSnapshot): The event after the change, or None if it was deleted.
+    """
+    if before == after:
+        return
+    if _busy_fields(before) != _busy_fields(after):
+        rows = []
+        if before is not None:
+            rows += apply_busy_hours(before, -1)
+        if after is not None:
+            track_duration(after)
+            rows += apply_busy_hours(after, 1)
+        # Only prune once both sides are applied: a row emptied by `before` may be refilled by `after`.
+        for row in {id(row): row for row in rows}.values():
+            if row.hours < 1e-6:
+                if row in db.session.new:
+                    db.session.expunge(row)
+                else:
+                    db.session.delete(row)
+    log_change(before, after)
+    db.session.info.setdefault('calendar_changes', []).append((before, after))
+
+
+def changed_user_ids(changes):
+    """
+    Return the ids of the users whose calendars a list of (before, after) changes touches.
+    """
+    return {snapshot.user_id for change in changes for snapshot in change if snapshot is not None}
+
+
+@sa_event.listens_for(Session, 'before_commit')
+def _bump_calendar_versions(session):
+    changes = session.info.get('calendar_changes')
+    if changes:
+        user_ids = changed_user_ids(changes)
+        session.flush()
+        session.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(calendar_version=User.calendar_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        # The users' rows stay locked until the commit, so versions, and the log
+        # entries stamped with them, commit in increasing order for each user.
+        session.execute(
+            update(EventChange)
+            .where(EventChange.user_id.in_(user_ids), EventChange.seq.is_(None))
+            .values(seq=select(User.calendar_version).where(User.id == EventChange.user_id).scalar_subquery())
+            .execution_options(synchronize_session=False)
+        )
+
+
+@sa_event.listens_for(Session, 'after_commit')
+def _send_calendar_changed(session):
+    changes = session.info.pop('calendar_changes', None)
+    if changes:
+        calendar_changed.send(changes=changes)
+
+
+@sa_event.listens_for(Session, 'after_rollback')
+def _discard_calendar_changes(session):
+    session.info.pop('calendar_changes', None)
+
+
+def compute_daily_hours(events, window_start=None, window_end=None):
+    """
+    Compute busy hours per (user_id, day, privacy_level) directly from events.
+
+    Returns:
+        dict: Hours keyed by (user_id, day, privacy_level) tuples.
+    """
+    totals = {}
+    for event in events:
+        level = event.privacy_level or 'private'
+        for day, hours in split_by_day(event.start_time, event.end_time, window_start, window_end):
+            key = (event.user_id, day, level)
+            totals[key] = totals.get(key, 0) + hours
+    return totals
+
+
+def aggregate_daily_hours(*criteria, window_start=None, window_end=None):
+    """
+    Sum busy hours per (user_id, day, privacy_level) inside the database.
+
+    Events that start and end on the same day are summed with a single
+    GROUP BY over their start date, so only one row per day comes back. The
+    few events that cross midnight are fetched on their own and split per day
+    with `split_by_day`. The optional window must start and end on day boundaries.
+
+    Args:
+        *criteria: Extra filters on `Event`, such as `Event.user_id == 1`.
+        window_start (datetime): Ignore hours before this point.
+        window_end (datetime): Ignore hours from this point on.
+
+    Returns:
+        dict: Hours keyed by (user_id, day, privacy_level) tuples.
+    """
+    level = func.coalesce(Event.privacy_level, 'private')
+    same_day = day_of(Event.start_time) == day_of(Event.end_time)
+
+    single_day = db.session.query(
+        Event.user_id,
+        day_of(Event.start_time),
+        level,
+        func.sum(hours_between(Event.start_time, Event.end_time))
+    ).filter(same_day, *criteria)
+    spanning = db.session.query(
+        Event.user_id, Event.start_time, Event.end_time, level
+    ).filter(~same_day, *criteria)
+
+    if window_start is not None:
+        single_day = single_day.filter(Event.start_time >= window_start)
+        spanning = spanning.filter(Event.end_time > window_start)
+    if window_end is not None:
+        single_day = single_day.filter(Event.start_time < window_end)
+        spanning = spanning.filter(Event.start_time < window_end)
+
+    totals = {}
+    for user_id, day, privacy_level, hours in single_day.group_by(Event.user_id, day_of(Event.start_time), level):
+        totals[(user_id, day, privacy_level)] = round(hours, 6)
+    for user_id, start, end, privacy_level in spanning:
+        for day, hours in split_by_day(start, end, window_start, window_end):
+            key = (user_id, day, privacy_level)
+            totals[key] = totals.get(key, 0) + hours
+    return totals
+
+
+def rebuild_busy_hours(user_id=None):
+    """
+    Recompute the daily rollup from scratch for one user, or for everyone.
+
+    Returns:
+        int: The number of rollup rows written.
+    """
+    criteria = []
+    rollup = DailyBusyHours.query
+    if user_id is not None:
+        criteria.append(Event.user_id == user_id)
+        rollup = rollup.filter(DailyBusyHours.user_id == user_id)
+
+    totals = aggregate_daily_hours(*criteria)
+    rollup.delete(synchronize_session=False)
+    db.session.add_all(
+        DailyBusyHours(user_id=uid, day=day, privacy_level=level, hours=hours)
+        for (uid, day, level), hours in totals.items()
+    )
+    db.session.commit()
+    return len(totals)
+
+
+class EventRepository:
+    """
+    Interval-overlap queries over one user's calendar.
+
+    Attributes:
+        user (User): The owner of the events being queried.
+        privacy_level (str): If set, only events with this privacy level are
+            returned (e.g. 'friends' when another user views the calendar).
+    """
+
+    def __init__(self, user, privacy_level=None):
+        self.user = user
+        self.privacy_level = privacy_level
+
+    def overlapping(self, window_start, window_end):
+        """
+        Query for the events overlapping [window_start, window_end), ordered by start time.
+        """
+        lookback = timedelta(seconds=self.user.max_event_seconds or 0)
+        query = Event.query.filter(Event.user_id == self.user.id)
+        if self.privacy_level is not None:
+            query = query.filter(Event.privacy_level == self.privacy_level)
+        return query.filter(
+            Event.start_time >= window_start - lookback,
+            Event.start_time < window_end,
+            Event.end_time > window_start
+        ).order_by(Event.start_time)
+
+    def intervals(self, window_start, window_end):
+        """
+        Return (start, end) tuples of the events overlapping the window, without loading full events.
+        """
+        query = self.overlapping(window_start, window_end).with_entities(Event.start_time, Event.end_time)
+        return [tuple(row) for row in query]
+
+    def on_day(self, day):
+        """
+        Return the list of events overlapping the given day.
+        """
+        return self.overlapping(*day_bounds(day)).all()
+
+    def by_day(self, window_start, window_end):
+        """
+        Group the events overlapping the window by the days they cover, in one range query.
+
+        Events come back ordered by start time, so a day is complete as soon as
+        an event starting on a later day is read. Days are yielded one at a time
+        while the rows stream in, and an event spanning several days is listed
+        under each of them. Days without events are skipped. The window must
+        start and end on day boundaries.
+
+        Yields:
+            tuple: ('YYYY-MM-DD', list of event dicts from `serialize_event`), in day order.
+        """
+        query = self.overlapping(window_start, window_end).with_entities(
+            Event.id, Event.title, Event.start_time, Event.end_time, Event.description, Event.created_by
+        ).execution_options(yield_per=500)
+        pending = {}
+        for event in query:
+            first_day = max(event.start_time, window_start).date()
+            for day in sorted(day for day in pending if day < first_day):
+                yield day.isoformat(), pending.pop(day)
+            payload = serialize_event(event)
+            for day, _ in split_by_day(event.start_time, event.end_time, window_start, window_end):
+                pending.setdefault(day, []).append(payload)
+        for day in sorted(pending):
+            yield day.isoformat(), pending[day]
+
+    def daily_hours(self, window_start, window_end):
+        """
+        Return busy hours per day within the window, keyed by 'YYYY-MM-DD'.
+
+        Read from the `daily_busy_hours` rollup, where events spanning several
+        days are already split so that each day is only charged for its own hours.
+        The window must start and end on day boundaries.
+        """
+        query = db.session.query(DailyBusyHours.day, func.sum(DailyBusyHours.hours)).filter(
+            DailyBusyHours.user_id == self.user.id,
+            DailyBusyHours.day >= window_start.date(),
+            DailyBusyHours.day < window_end.date()
+        )
+        if self.privacy_level is not None:
+            query = query.filter(DailyBusyHours.privacy_level == self.privacy_level)
+        return {
+            day.strftime('%Y-%m-%d'): hours
+            for day, hours in query.group_by(DailyBusyHours.day)
+        }
@@ -143,7 +143,7 @@ class EventForm(FlaskForm):
     Form for creating or editing a calendar event.
 
     Fields:
-        title (StringField): Title of the event. Required.
+        title (StringField): Title of the event. Required, at most 100 characters.
         description (TextAreaField): Optional event details.
         start_time (DateTimeLocalField): Start timestamp of the event. Required.
         end_time (DateTimeLocalField): End timestamp of the event. Required.
@@ -153,7 +153,7 @@ class EventForm(FlaskForm):
     Methods:
         validate_end_time(field): Ensures end_time is later than start_time.
     """
-    title = StringField('Title', validators=[DataRequired()])
+    title = StringField('Title', validators=[DataRequired(), Length(max=100)])
     description = TextAreaField('Description')
     
     start_time = DateTimeLocalField(
@@ -180,5 +180,5 @@ class EventForm(FlaskForm):
     )
 
     def validate_end_time(form, field):
-        if field.data <= form.start_time.data:
+        if form.start_time.data is not None and field.data <= form.start_time.data:
             raise ValidationError("End time must be after start time")
\ No newline at end of file
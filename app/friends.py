@@ -0,0 +1,77 @@
+"""
+Friend-graph loading.
+
+Pages that list a user's friends or friend requests load them here, with the
+related `User` rows joined in, so a page costs a fixed number of queries no
+matter how many friends the user has.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+
+from .models import Friendship, User
+
+FriendGraph = namedtuple('FriendGraph', ['friends', 'incoming_pairs', 'outgoing_pairs'])
+
+
+def load_friends(user_id):
+    """
+    Return the user's accepted friends, in the order the friendships were made, in one query.
+    """
+    return User.query.join(Friendship, Friendship.friend_id == User.id).filter(
+        Friendship.user_id == user_id,
+        Friendship.status == 'accepted'
+    ).order_by(Friendship.id).all()
+
+
+def friend_ids(user_id):
+    """
+    Return the ids of all the user's accepted friends.
+    """
+    rows = Friendship.query.with_entities(Friendship.friend_id).filter(
+        Friendship.user_id == user_id,
+        Friendship.status == 'accepted'
+    )
+    return [friend_id for (friend_id,) in rows]
+
+
+def accepted_friend_ids(user_id, candidate_ids):
+    """
+    Return the subset of `candidate_ids` that are accepted friends of the user.
+    """
+    rows = Friendship.query.with_entities(Friendship.friend_id).filter(
+        Friendship.user_id == user_id,
+        Friendship.status == 'accepted',
+        Friendship.friend_id.in_(candidate_ids)
+    )
+    return {friend_id for (friend_id,) in rows}
+
+
+def load_friend_graph(user_id):
+    """
+    Load the user's friends and pending requests in a single query.
+
+    Returns:
+        FriendGraph: `friends` is a list of Users; `incoming_pairs` and
+        `outgoing_pairs` are lists of (Friendship, User) pairs, where the User
+        is the other side of the pending request.
+    """
+    friendships = Friendship.query.options(
+        joinedload(Friendship.user),
+        joinedload(Friendship.friend)
+    ).filter(or_(
+        and_(Friendship.user_id == user_id, Friendship.status.in_(('accepted', 'pending'))),
+        and_(Friendship.friend_id == user_id, Friendship.status == 'pending')
+    )).order_by(Friendship.id).all()
+
+    graph = FriendGraph([], [], [])
+    for friendship in friendships:
+        if friendship.user_id == user_id and friendship.status == 'accepted':
+            graph.friends.append(friendship.friend)
+        elif friendship.user_id == user_id:
+            graph.outgoing_pairs.append((friendship, friendship.friend))
+        else:
+            graph.incoming_pairs.append((friendship, friendship.user))
+    return graph
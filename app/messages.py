@@ -0,0 +1,365 @@
+"""
+Chat message loading and serialization.
+
+Every route and Socket.IO handler that sends messages to a client builds the
+payload with `serialize_message`, so REST responses and real-time events have
+the same shape. Lists of messages are loaded with their sender and recipient
+joined in (`with_participants`), so serializing a conversation costs a single
+query however long it is.
+
+Conversations are read a page at a time with keyset pagination on
+`(timestamp, id)`. Cursors are opaque strings naming the message a page
+starts or ends at. Each direction of a conversation (alice to bob, bob to alice)
+is read with its own range scan on the `(sender_id, recipient_id, timestamp)`
+index, and the two are merged, so fetching a page costs O(page size) rather
+than O(history).
+
+Messages older than `CHAT_ARCHIVE_AFTER_DAYS` may have been moved to
+compressed archive segments (`app.archive`); `conversation_page` reads
+through to them once the hot messages of a conversation run out.
+
+Clients that already hold a conversation catch up with `conversation_since`,
+which returns only the messages with an id above the last one they have seen,
+read from the `(sender_id, recipient_id, id)` index.
+
+Every stored message also updates both participants' `ConversationSummary`
+rows in the same transaction, so the inbox (`inbox`) and unread counts are
+read from the summaries rather than from the message table.
+"""
+
+import base64
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, case, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from . import db
+from .archive import archived_page
+from .models import ConversationSummary, Message, User
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# The parts of a user needed to store and serialize their messages; can stand in for `User`.
+Participant = namedtuple('Participant', ['id', 'username'])
+
+
+def with_participants(query):
+    """
+    Load the sender and recipient of every message in `query` in the same statement.
+    """
+    return query.options(
+        joinedload(Message.sender, innerjoin=True),
+        joinedload(Message.recipient, innerjoin=True)
+    )
+
+
+def insert_messages(rows):
+    """
+    Insert message rows (dicts of `Message` columns, id included) and update
+    the conversation summaries, in the current transaction, without committing.
+    """
+    db.session.execute(insert(Message), rows)
+    for row in rows:
+        update_summaries(row['id'], row['sender_id'], row['recipient_id'], row['timestamp'])
+
+
+def _advance_summary(user_id, peer_id, message_id, timestamp, unread):
+    newer = ConversationSummary.last_message_id < message_id
+    return db.session.execute(
+        update(ConversationSummary)
+        .where(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+        .values(
+            last_message_id=case((newer, message_id), else_=ConversationSummary.last_message_id),
+            last_timestamp=case((newer, timestamp), else_=ConversationSummary.last_timestamp),
+            unread_count=ConversationSummary.unread_count + unread,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def update_summaries(message_id, sender_id, recipient_id, timestamp):
+    """
+    Record a new message in the sender's and the recipient's conversation summaries.
+
+    Must be called in the same transaction as the insert of the message. The
+    summaries are changed with single UPDATE statements, so concurrent senders
+    cannot lose each other's unread increments.
+    """
+    views = [(sender_id, recipient_id, 0)]
+    if recipient_id != sender_id:
+        views.append((recipient_id, sender_id, 1))
+    for user_id, peer_id, unread in views:
+        if _advance_summary(user_id, peer_id, message_id, timestamp, unread):
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(ConversationSummary(
+                    user_id=user_id, peer_id=peer_id, last_message_id=message_id,
+                    last_timestamp=timestamp, unread_count=unread
+                ))
+        except IntegrityError:
+            # The other participant's first message created the row meanwhile.
+            _advance_summary(user_id, peer_id, message_id, timestamp, unread)
+
+
+def load_participant(user_id):
+    """
+    Return the user with the given id as a `Participant`, or None if there is no such user.
+    """
+    row = db.session.execute(select(User.id, User.username).where(User.id == user_id)).first()
+    return Participant(*row) if row else None
+
+
+def store_message(sender, recipient, content):
+    """
+    Store a new message.
+
+    Normally the message is inserted and committed before returning. When the
+    write-behind pipeline is running (`app.writebehind`), it is given an id and
+    queued instead, and committed shortly afterwards by the writer thread.
+
+    The payload is built from `sender` and `recipient`, so storing a message
+    issues no SELECT.
+
+    Args:
+        sender (User or Participant): The user sending the message.
+        recipient (User or Participant): The user receiving it.
+        content (str): The message text.
+
+    Returns:
+        dict: The stored message, serialized with `serialize_message`.
+
+    Raises:
+        queue.Full: If the write-behind queue stays full.
+    """
+    timestamp = datetime.now()
+    writer = current_app.extensions.get('message_writer')
+    if writer is None:
+        message = Message(sender_id=sender.id, recipient_id=recipient.id, content=content, timestamp=timestamp)
+        db.session.add(message)
+        db.session.flush()
+        message_id = message.id
+        update_summaries(message_id, sender.id, recipient.id, timestamp)
+        db.session.commit()
+    else:
+        message_id = writer.submit({
+            'sender_id': sender.id,
+            'recipient_id': recipient.id,
+            'content': content,
+            'timestamp': timestamp,
+        })
+    return _payload(message_id, sender, recipient, content, timestamp)
+
+
+def inbox(user, limit=PAGE_SIZE):
+    """
+    Return the user's most recently active conversations, newest first, serialized.
+
+    A single range read of the user's `ConversationSummary` rows, with the peer
+    and the latest message joined in.
+
+    Returns:
+        list: Dicts with the peer's id and username, the unread count, and the
+            latest message serialized like `serialize_message`.
+    """
+    summaries = db.session.scalars(
+        select(ConversationSummary)
+        .where(ConversationSummary.user_id == user.id)
+        .order_by(ConversationSummary.last_timestamp.desc(), ConversationSummary.peer_id.desc())
+        .limit(limit)
+        .options(
+            joinedload(ConversationSummary.peer, innerjoin=True),
+            joinedload(ConversationSummary.last_message, innerjoin=True),
+        )
+    )
+    entries = []
+    for summary in summaries:
+        message = summary.last_message
+        if message.sender_id == user.id:
+            sender, recipient = user, summary.peer
+        else:
+            sender, recipient = summary.peer, user
+        entries.append({
+            'peer_id': summary.peer_id,
+            'peer_username': summary.peer.username,
+            'unread_count': summary.unread_count,
+            'last_message': _payload(message.id, sender, recipient, message.content, message.timestamp),
+        })
+    return entries
+
+
+def mark_read(user_id, peer_id, up_to_id=None):
+    """
+    Mark the messages from `peer_id` to `user_id` as read and commit.
+
+    Args:
+        user_id (int): The reader.
+        peer_id (int): The other participant of the conversation.
+        up_to_id (int): Only mark the messages up to this id, e.g. the last one
+            shown to the user. Defaults to the latest message of the conversation.
+
+    Returns:
+        int: The number of messages from the peer still unread.
+    """
+    summary = db.session.get(ConversationSummary, (user_id, peer_id))
+    if summary is None:
+        return 0
+    if up_to_id is None:
+        up_to_id = summary.last_message_id
+    from_peer = and_(Message.sender_id == peer_id, Message.recipient_id == user_id,
+                     or_(Message.read.is_(False), Message.read.is_(None)))
+    db.session.execute(
+        update(Message).where(from_peer, Message.id <= up_to_id).values(read=True)
+        .execution_options(synchronize_session=False)
+    )
+    still_unread = select(func.count()).select_from(Message).where(from_peer, Message.id > up_to_id)
+    db.session.execute(
+        update(ConversationSummary)
+        .where(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+        .values(unread_count=still_unread.scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.get(ConversationSummary, (user_id, peer_id)).unread_count
+
+
+def encode_cursor(message):
+    """
+    Return the opaque cursor naming a message's position in its conversation.
+    """
+    raw = f'{message.timestamp.isoformat()}|{message.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor into a (timestamp, id) tuple, raising ValueError if it is invalid.
+    """
+    timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+
+def _direction_page(sender_id, recipient_id, before, after, limit):
+    query = with_participants(Message.query).filter(
+        Message.sender_id == sender_id,
+        Message.recipient_id == recipient_id
+    )
+    if after is not None:
+        timestamp, message_id = after
+        return query.filter(or_(
+            Message.timestamp > timestamp,
+            and_(Message.timestamp == timestamp, Message.id > message_id)
+        )).order_by(Message.timestamp, Message.id).limit(limit).all()
+    if before is not None:
+        timestamp, message_id = before
+        query = query.filter(or_(
+            Message.timestamp < timestamp,
+            and_(Message.timestamp == timestamp, Message.id < message_id)
+        ))
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
+
+
+def conversation_page(user_id, peer_id, before=None, after=None, limit=PAGE_SIZE):
+    """
+    Load one page of the conversation between two users.
+
+    With no cursor the newest page is returned. With `before`, the page of
+    messages just older than that position; with `after`, the page just newer.
+    Archived messages are all older than the hot ones, so the archive is only
+    read when the hot messages do not fill the page.
+
+    Args:
+        user_id (int): One participant.
+        peer_id (int): The other participant.
+        before (tuple): A decoded cursor, or None.
+        after (tuple): A decoded cursor, or None. Takes precedence over `before`.
+        limit (int): Maximum number of messages in the page.
+
+    Returns:
+        tuple: The messages (`Message` rows or `ArchivedMessage` tuples), oldest
+        first, and whether more messages exist beyond the page in the direction
+        being read.
+    """
+    directions = {(user_id, peer_id), (peer_id, user_id)}
+    messages = [
+        message
+        for sender_id, recipient_id in directions
+        for message in _direction_page(sender_id, recipient_id, before, after, limit + 1)
+    ]
+    newer = after is not None
+    messages.sort(key=lambda m: (m.timestamp, m.id), reverse=not newer)
+    if newer:
+        messages = archived_page(user_id, peer_id, after=after, limit=limit + 1) + messages
+    elif len(messages) <= limit:
+        messages += archived_page(user_id, peer_id, before=before, limit=limit + 1 - len(messages))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not newer:
+        messages.reverse()
+    return messages, has_more
+
+
+def conversation_since(user_id, peer_id, after_id, limit=PAGE_SIZE):
+    """
+    Load the messages between two users with an id greater than `after_id`.
+
+    Returns:
+        tuple: Up to `limit` messages, in id order, and whether more newer messages exist.
+    """
+    messages = [
+        message
+        for sender_id, recipient_id in {(user_id, peer_id), (peer_id, user_id)}
+        for message in with_participants(Message.query).filter(
+            Message.sender_id == sender_id,
+            Message.recipient_id == recipient_id,
+            Message.id > after_id
+        ).order_by(Message.id).limit(limit + 1)
+    ]
+    messages.sort(key=lambda m: m.id)
+    return messages[:limit], len(messages) > limit
+
+
+def serialize_page(messages, has_more, before=None, after=None):
+    """
+    Build the JSON-ready dict for a page returned by `conversation_page` or `conversation_since`.
+
+    `before` and `after` in the result are cursors for the neighbouring older
+    and newer pages, or None when there is nothing more in that direction.
+    """
+    older = has_more if after is None else True
+    newer = has_more if after is not None else before is not None
+    return {
+        'messages': [serialize_message(message) for message in messages],
+        'before': encode_cursor(messages[0]) if messages and older else None,
+        'after': encode_cursor(messages[-1]) if messages and newer else None,
+    }
+
+
+def serialize_message(message):
+    """
+    Convert a message into the JSON-ready dict sent to chat clients.
+
+    Args:
+        message (Message): A message with an id and timestamp, i.e. flushed or loaded.
+
+    Returns:
+        dict: The message fields, with the sender's and recipient's usernames.
+    """
+    return _payload(message.id, message.sender, message.recipient, message.content, message.timestamp)
+
+
+def _payload(message_id, sender, recipient, content, timestamp):
+    return {
+        'id': message_id,
+        'sender_id': sender.id,
+        'sender_username': sender.username,
+        'recipient_id': recipient.id,
+        'recipient_username': recipient.username,
+        'content': content,
+        'timestamp': timestamp.strftime(TIMESTAMP_FORMAT),
+    }
@@ -20,6 +20,12 @@ class User(UserMixin, db.Model):
         username (str): The unique username of the user.
         email (str): The unique email address of the user.
         password_hash (str): The hashed password of the user.
+        max_event_seconds (int): Upper bound on the length of any of the user's events,
+            used to bound calendar overlap queries (see `app.events`).
+        calendar_version (int): Incremented by every committed transaction that changes
+            the user's events; validates cached calendar responses (see `app.events`).
+        event_changes_floor (int): Highest `EventChange` sequence number removed by compaction;
+            clients syncing from an older cursor must reload their calendar (see `app.sync`).
     """
     __tablename__ = 'user' 
 
@@ -27,6 +33,9 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)  
     password_hash = db.Column(db.String(128))
+    max_event_seconds = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    calendar_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    event_changes_floor = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -61,10 +70,19 @@ class Event(db.Model):
         user (User): The user the event is for (via user_id).
         creator (User): The user who created the event (via created_by).
 
+    Indexes:
+        ix_events_user_start: (user_id, start_time) for a user's day and month ranges.
+        ix_events_user_privacy_start: (user_id, privacy_level, start_time) for the
+            friend-visible ranges read by the shared calendar.
+
     Methods:
         __repr__(): Returns a string representation of the event with title and times.
     """
     __tablename__ = 'events'
+    __table_args__ = (
+        db.Index('ix_events_user_start', 'user_id', 'start_time'),
+        db.Index('ix_events_user_privacy_start', 'user_id', 'privacy_level', 'start_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -138,5 +156,176 @@ class Message(db.Model):
     read = db.Column(db.Boolean, default=False)
     room = db.Column(db.String(100), nullable=True)  
 
+    __table_args__ = (
+        db.Index('ix_message_sender_recipient_timestamp', 'sender_id', 'recipient_id', 'timestamp'),
+        db.Index('ix_message_sender_recipient_id', 'sender_id', 'recipient_id', 'id'),
+    )
+
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
-    recipient = db.relationship('User', foreign_keys=[recipient_id], backref='received_messages')
\ No newline at end of file
+    recipient = db.relationship('User', foreign_keys=[recipient_id], backref='received_messages')
+
+class ConversationSummary(db.Model):
+    """
+    One user's view of a conversation: its latest message and how many messages they have not read.
+
+    Each conversation has a row per participant, maintained in the same
+    transaction as the messages themselves by `app.messages`, so the inbox is a
+    single range read of the user's rows, however many messages there are.
+
+    Attributes:
+        __tablename__ (str): Name of the table in the database ('conversation_summary').
+        user_id (int): Foreign key referencing the User whose view this is.
+        peer_id (int): Foreign key referencing the other participant.
+        last_message_id (int): Foreign key referencing the latest Message of the conversation.
+        last_timestamp (datetime): Time of the latest message, used to order the inbox.
+        unread_count (int): Messages from the peer that the user has not read yet.
+
+    Relationships:
+        peer (User): The other participant.
+        last_message (Message): The latest message of the conversation.
+    """
+    __tablename__ = 'conversation_summary'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    peer_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_conversation_summary_user_timestamp', 'user_id', 'last_timestamp'),
+    )
+
+    peer = db.relationship('User', foreign_keys=[peer_id])
+    last_message = db.relationship('Message')
+
+    def __repr__(self):
+        return f'<ConversationSummary {self.user_id} -> {self.peer_id}: {self.unread_count} unread>'
+
+class MessageArchive(db.Model):
+    """
+    A compressed segment of old messages from one conversation.
+
+    `app.archive` moves messages older than `CHAT_ARCHIVE_AFTER_DAYS` out of the
+    `message` table into these segments, in `(timestamp, id)` order, so the hot
+    table and its indexes only hold recent messages. History pages read
+    through to the segments when a client pages past the hot messages.
+
+    Attributes:
+        __tablename__ (str): Name of the table in the database ('message_archive').
+        id (int): Primary key for the segment.
+        user_low (int): Foreign key referencing the participant with the smaller id.
+        user_high (int): Foreign key referencing the participant with the larger id.
+        first_timestamp (datetime): Timestamp of the oldest message in the segment.
+        first_id (int): Id of the oldest message in the segment.
+        last_timestamp (datetime): Timestamp of the newest message in the segment.
+        last_id (int): Id of the newest message in the segment.
+        message_count (int): Number of messages in the segment.
+        data (bytes): The messages, as zlib-compressed JSON.
+    """
+    __tablename__ = 'message_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_low = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_high = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_message_archive_pair_first', 'user_low', 'user_high', 'first_timestamp', 'first_id'),
+        db.Index('ix_message_archive_pair_last', 'user_low', 'user_high', 'last_timestamp', 'last_id'),
+    )
+
+    def __repr__(self):
+        return f'<MessageArchive {self.user_low}-{self.user_high}: {self.message_count} messages>'
+
+class DailyBusyHours(db.Model):
+    """
+    Precomputed busy hours per user, day and privacy level.
+
+    A rollup of the `events` table maintained incrementally by
+    `app.events.record_change`, so that month heatmaps are a single range read
+    of at most 31 rows per privacy level. It can be recomputed from scratch with
+    the `flask rebuild-busy-hours` command.
+
+    Attributes:
+        __tablename__ (str): Name of the table in the database ('daily_busy_hours').
+        user_id (int): Foreign key referencing the User who owns the events.
+        day (date): The calendar day the hours fall on.
+        privacy_level (str): Privacy level of the events counted in this row.
+        hours (float): Total hours of the user's events on that day.
+    """
+    __tablename__ = 'daily_busy_hours'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    privacy_level = db.Column(db.String(20), primary_key=True)
+    hours = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailyBusyHours {self.user_id} {self.day} {self.privacy_level}: {self.hours}>'
+
+class EventChange(db.Model):
+    """
+    One entry of the append-only log of changes to users' events.
+
+    Written by `app.events.record_change` in the same transaction as the change,
+    so the log never disagrees with the `events` table. Clients sync from `seq`
+    (see `app.sync`), not from the id: ids are assigned when a transaction
+    flushes, so concurrent transactions can commit them out of order.
+
+    Attributes:
+        __tablename__ (str): Name of the table in the database ('event_changes').
+        id (int): Primary key, increasing with every change within a transaction.
+        user_id (int): Foreign key referencing the User whose calendar changed.
+        event_id (int): Id of the changed event; not a foreign key, as deleted events are logged too.
+        operation (str): 'insert', 'update' or 'delete'.
+        changed_at (datetime): When the change was recorded, for compaction.
+        seq (int): The sequence number: the user's `calendar_version` as set by the
+            committing transaction, shared by all its changes to the calendar.
+            Stamped just before the commit, under the lock of the user's row, so
+            sequence numbers commit in increasing order; NULL until then.
+
+    Indexes:
+        ix_event_changes_user_seq: (user_id, seq) for reading one user's changes after a cursor.
+    """
+    __tablename__ = 'event_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    event_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    seq = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_event_changes_user_seq', 'user_id', 'seq'),
+    )
+
+    def __repr__(self):
+        return f'<EventChange {self.id} {self.operation} event {self.event_id}>'
+
+class IdSequence(db.Model):
+    """
+    Primary keys handed out in blocks, for rows whose id must be known before they are inserted.
+
+    The chat write-behind pipeline (`app.writebehind`) broadcasts messages before
+    writing them, so it reserves their ids here, a block at a time, by advancing
+    `next_id` in a single UPDATE.
+
+    Attributes:
+        __tablename__ (str): Name of the table in the database ('id_sequences').
+        name (str): Name of the table whose ids are handed out (e.g. 'message').
+        next_id (int): The first id that has not been reserved yet.
+    """
+    __tablename__ = 'id_sequences'
+
+    name = db.Column(db.String(64), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<IdSequence {self.name}: {self.next_id}>'
@@ -0,0 +1,89 @@
+"""
+Presence of chat users.
+
+Every Socket.IO connection of a logged-in user joins that user's personal room
+(`user_room`), so anything meant for a user reaches all of their devices, and
+nobody else, with a single emit. The `PresenceRegistry` records which
+connections each user has open, so whether a user is online is a dictionary
+lookup. Friends are told when a user's first connection opens and when their
+last one closes.
+
+The registry only knows about the connections of its own process. With several
+workers behind a message queue, a user with tabs on two workers would be
+reported offline when either closes, and users connected to another worker
+would look offline. Presence is therefore turned off when
+`SOCKETIO_MESSAGE_QUEUE` is set: emits to personal rooms still reach every
+device, but no `presence` events are sent and `/api/presence` reports nobody.
+"""
+
+import threading
+
+
+def user_room(user_id):
+    """
+    Return the name of the user's personal Socket.IO room.
+    """
+    return f'user_{user_id}'
+
+
+class PresenceRegistry:
+    """
+    Thread-safe map from user ids to the ids of their open Socket.IO connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sids_by_user = {}
+        self._user_by_sid = {}
+
+    def add(self, user_id, sid):
+        """
+        Record a new connection of the user.
+
+        Returns:
+            bool: True if it is the user's only connection, i.e. they just came online.
+        """
+        with self._lock:
+            sids = self._sids_by_user.setdefault(user_id, set())
+            sids.add(sid)
+            self._user_by_sid[sid] = user_id
+            return len(sids) == 1
+
+    def remove(self, sid):
+        """
+        Forget a closed connection.
+
+        Returns:
+            int: The id of the connection's user if it was their last connection,
+                i.e. they just went offline, otherwise None.
+        """
+        with self._lock:
+            user_id = self._user_by_sid.pop(sid, None)
+            if user_id is None:
+                return None
+            sids = self._sids_by_user[user_id]
+            sids.discard(sid)
+            if sids:
+                return None
+            del self._sids_by_user[user_id]
+            return user_id
+
+    def is_online(self, user_id):
+        with self._lock:
+            return user_id in self._sids_by_user
+
+    def online(self, user_ids):
+        """
+        Return the subset of `user_ids` that have at least one open connection.
+        """
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._sids_by_user}
+
+
+def init_presence(app):
+    """
+    Attach an empty presence registry to `app`, or None when several workers share a message queue.
+    """
+    registry = None if app.config.get('SOCKETIO_MESSAGE_QUEUE') else PresenceRegistry()
+    app.extensions['presence'] = registry
+    return registry
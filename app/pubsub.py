@@ -0,0 +1,213 @@
+"""
+Message-queue backends for running Socket.IO across several worker processes.
+
+Without a message queue, `socketio.emit` only reaches the clients connected to
+the process that calls it. Setting `SOCKETIO_MESSAGE_QUEUE` makes every worker
+publish its emits to a shared queue and deliver the emits published by the
+others. Any URL supported by Flask-SocketIO can be used (`redis://`,
+`kafka://`, `zmq+tcp://`, or a Kombu URL such as `amqp://`), as well as the
+built-in `unix://` backend below, which needs no outside services.
+
+The `unix://` backend is a small broker listening on a Unix domain socket
+(started with `flask socketio-broker`). Each worker opens two connections to
+it: one to publish and one to subscribe. The broker copies every line
+published to it to all subscribers. Messages are newline-delimited JSON.
+Workers skip their own messages, as with the other pub/sub backends.
+"""
+
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse
+
+import socketio
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 10000
+RECONNECT_DELAY = 1.0
+
+
+def socket_path(url):
+    """
+    Return the filesystem path of a 'unix:///path/to/broker.sock' URL.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme != 'unix' or not parsed.path:
+        raise ValueError(f'Expected a unix:///path URL, got {url!r}')
+    return parsed.path
+
+
+def client_manager(url, channel='flask-socketio', write_only=False):
+    """
+    Build the Socket.IO client manager for a message-queue URL.
+
+    Args:
+        url (str): The message-queue URL, or None to keep clients in this process only.
+        channel (str): The channel shared by all the workers.
+        write_only (bool): Only publish, e.g. from a script that emits but has no clients.
+
+    Returns:
+        socketio.Manager: The manager to pass to `SocketIO.init_app` as `client_manager`.
+    """
+    if not url:
+        return socketio.Manager()
+    if url.startswith('unix://'):
+        queue_class = UnixSocketManager
+    elif url.startswith(('redis://', 'rediss://')):
+        queue_class = socketio.RedisManager
+    elif url.startswith('kafka://'):
+        queue_class = socketio.KafkaManager
+    elif url.startswith('zmq'):
+        queue_class = socketio.ZmqManager
+    else:
+        queue_class = socketio.KombuManager
+    return queue_class(url, channel=channel, write_only=write_only)
+
+
+class UnixSocketManager(socketio.PubSubManager):
+    """
+    Socket.IO client manager that shares emits through a `UnixSocketBroker`.
+
+    Attributes:
+        path (str): Filesystem path of the broker's socket.
+    """
+    name = 'unix'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = socket_path(url)
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+
+    def _connect(self, role):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(self.path)
+        connection.sendall(f'{role} {self.channel}\n'.encode())
+        return connection
+
+    def _publish(self, data):
+        line = (self.json.dumps(data) + '\n').encode()
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect('PUB')
+                    self._publisher.sendall(line)
+                    return
+                except OSError:
+                    if self._publisher is not None:
+                        self._publisher.close()
+                        self._publisher = None
+                    if attempt:
+                        self._get_logger().exception('Cannot publish to the Socket.IO broker at %s', self.path)
+
+    def _listen(self):
+        while True:
+            try:
+                with self._connect('SUB') as connection, connection.makefile('rb') as stream:
+                    for line in stream:
+                        yield line
+            except OSError:
+                self._get_logger().warning('Lost the Socket.IO broker at %s, reconnecting', self.path)
+            time.sleep(RECONNECT_DELAY)
+
+
+class _Subscriber:
+    """
+    A subscribed connection, with its own queue and writer thread so that a
+    slow subscriber cannot hold up publishers or the other subscribers.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lines = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.closed = threading.Event()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def _write(self):
+        try:
+            for line in iter(self.lines.get, None):
+                self.connection.sendall(line)
+        except OSError:
+            self.closed.set()
+
+    def send(self, line):
+        try:
+            self.lines.put_nowait(line)
+        except queue.Full:
+            logger.warning('Dropping a Socket.IO broker subscriber that fell too far behind')
+            self.closed.set()
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+    def close(self):
+        self.closed.set()
+        try:
+            self.lines.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        role, _, channel = self.rfile.readline().decode().strip().partition(' ')
+        if role == 'SUB':
+            subscriber = _Subscriber(self.request)
+            self.server.subscribe(channel, subscriber)
+            try:
+                # Subscribers never send anything; this returns when they disconnect.
+                self.rfile.read()
+            finally:
+                self.server.unsubscribe(channel, subscriber)
+                subscriber.close()
+        elif role == 'PUB':
+            for line in self.rfile:
+                self.server.publish(channel, line)
+
+
+class UnixSocketBroker(socketserver.ThreadingUnixStreamServer):
+    """
+    Fan-out broker for `UnixSocketManager`, listening on a Unix domain socket.
+
+    Lines published on a channel are copied to every subscriber of that channel.
+
+    Attributes:
+        path (str): Filesystem path of the listening socket.
+    """
+    daemon_threads = True
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                if probe.connect_ex(path) == 0:
+                    raise OSError(f'A Socket.IO broker is already listening on {path}')
+            os.unlink(path)
+        super().__init__(path, _BrokerHandler)
+        self.path = path
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, subscriber):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            self._subscribers.get(channel, set()).discard(subscriber)
+
+    def publish(self, channel, line):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            if not subscriber.closed.is_set():
+                subscriber.send(line)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -5,18 +5,86 @@ This module defines the routes for the application, including user authenticatio
 event management, and API endpoints. It uses Flask blueprints to organize the routes.
 """
 
-from flask import Blueprint, abort, redirect, render_template, url_for, session, flash, request, jsonify
+import hashlib
+import json
+import queue
+from functools import wraps
+
+from flask import (Blueprint, Response, abort, current_app, redirect, render_template, url_for, session, flash, request,
+                   jsonify, stream_with_context)
 from flask_login import login_user, logout_user, current_user, login_required
 from . import  db
 from .forms import LoginForm, SignUpForm, EventForm
 from .models import User,Event, Friendship, Message
+from .events import (MAX_RANGE_DAYS, EventRepository, day_bounds, month_bounds, parse_date, parse_month,
+                     record_change, serialize_event, snapshot)
+from . import analytics, availability
+from .friends import accepted_friend_ids, friend_ids, load_friend_graph, load_friends
+from .messages import (MAX_PAGE_SIZE, PAGE_SIZE, Participant, conversation_page, conversation_since, decode_cursor,
+                       inbox, load_participant, mark_read, serialize_message, serialize_page, store_message)
+from .concurrency import run_blocking
+from .presence import user_room
+from .search import search_messages
+from .sync import changes_since, current_cursor
+from .batch import MAX_BATCH_OPERATIONS, apply_operations, event_fields, parse_fields, validate_event
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime, timedelta
-from flask_socketio import emit, join_room, leave_room
+from flask_socketio import emit, join_room
 from . import socketio
 
 main = Blueprint('main', __name__)
 
+# Number of recipients whose usernames each Socket.IO connection remembers.
+PEER_CACHE_SIZE = 64
+
+def conditional_on_calendar(owner_id=lambda **kwargs: current_user.id):
+    """
+    Make a calendar JSON view answer conditional GETs from the owner's `calendar_version`.
+
+    The strong ETag covers the viewer, the calendar owner and their version, the
+    current date (views default to today's day or month) and the request path
+    with its query string. When `If-None-Match` matches, a 304 is returned
+    without calling the view, so no events are read.
+
+    Another user's calendar may only be read by their accepted friends. That is
+    checked before the ETag, since unfriending does not change the version: a
+    former friend holding an ETag gets a 403, not a 304 telling them whether
+    the calendar changed.
+
+    Args:
+        owner_id (callable): Called with the view's keyword arguments, returns the
+            id of the user whose calendar the view reads; the current user by default.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            owner = db.session.get(User, owner_id(**kwargs))
+            if owner is None:
+                return view(**kwargs)
+            if owner.id != current_user.id and not accepted_friend_ids(current_user.id, {owner.id}):
+                abort(403)
+            key = '%s:%s:%s:%s:%s' % (current_user.id, owner.id, owner.calendar_version, datetime.now().date(),
+                                      request.full_path)
+            etag = hashlib.sha1(key.encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+def _busyness_owner_id(**kwargs):
+    try:
+        return int(request.args.get('user_id', current_user.id))
+    except ValueError:
+        return current_user.id
+
 @main.route('/')
 @main.route('/index', methods=['GET', 'POST'])
 def index():
@@ -93,14 +161,7 @@ def signup():
 @main.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
-    friendships = Friendship.query.filter_by(user_id=current_user.id, status='accepted').all()
-    friends = [User.query.get(f.friend_id) for f in friendships]
-
-    incoming_requests = Friendship.query.filter_by(friend_id=current_user.id, status='pending').all()
-    incoming_pairs = [(req, User.query.get(req.user_id)) for req in incoming_requests]
-
-    outgoing_requests = Friendship.query.filter_by(user_id=current_user.id, status='pending').all()
-    outgoing_pairs = [(req, User.query.get(req.friend_id)) for req in outgoing_requests]
+    friends, incoming_pairs, outgoing_pairs = load_friend_graph(current_user.id)
 
     if request.method == 'POST':
         search_query = request.form.get('search_query', '').strip()
@@ -159,7 +220,7 @@ def dashboard():
     
     date_str = request.args.get('date')
     try:
-        display_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else datetime.utcnow().date()
+        display_date = parse_date(date_str) if date_str else datetime.utcnow().date()
     except ValueError:
         display_date = datetime.now().date()
 
@@ -176,6 +237,8 @@ def dashboard():
                 created_by=current_user.id  
             )
             db.session.add(event)
+            db.session.flush()
+            record_change(None, snapshot(event))
             db.session.commit()
             flash('Event created successfully!', 'success')
             return redirect(url_for('main.dashboard', date=display_date.strftime('%Y-%m-%d')))
@@ -183,34 +246,9 @@ def dashboard():
             db.session.rollback()
             flash(f'Error: {str(e)}', 'danger')
 
-    start_of_day = datetime.combine(display_date, datetime.min.time())
-    end_of_day = datetime.combine(display_date, datetime.max.time())
-
-    daily_events = Event.query.filter(
-        Event.user_id == current_user.id,
-        Event.start_time >= start_of_day,
-        Event.start_time <= end_of_day
-    ).order_by(Event.start_time).all()
-
-    start_of_month = datetime(display_date.year, display_date.month, 1)
-    if display_date.month == 12:
-        end_of_month = datetime(display_date.year + 1, 1, 1) - timedelta(seconds=1)
-    else:
-        end_of_month = datetime(display_date.year, display_date.month + 1, 1) - timedelta(seconds=1)
-
-    monthly_events = Event.query.filter(
-        Event.user_id == current_user.id,
-        Event.start_time >= start_of_month,
-        Event.start_time <= end_of_month
-    ).order_by(Event.start_time).all()
-
-    event_durations = {}
-    for event in monthly_events:
-        day = event.start_time.strftime('%Y-%m-%d')  
-        duration = (event.end_time - event.start_time).total_seconds() / 3600  
-        if day not in event_durations:
-            event_durations[day] = 0
-        event_durations[day] += duration
+    repository = EventRepository(current_user)
+    daily_events = repository.on_day(display_date)
+    event_durations = repository.daily_hours(*month_bounds(display_date))
 
     return render_template(
         'dashboard.html',
@@ -225,58 +263,68 @@ def dashboard():
 
 @main.route('/api/events/<date>', methods=['GET'])
 @login_required
+@conditional_on_calendar()
 def get_events_by_date(date):
     """
     Retrieve the event list for the specified date.
     """
     try:
-        date_obj = datetime.strptime(date, '%Y-%m-%d')
-        start_of_day = datetime.combine(date_obj, datetime.min.time())
-        end_of_day = datetime.combine(date_obj, datetime.max.time())
+        events = EventRepository(current_user).on_day(parse_date(date))
         
-        events = Event.query.filter(
-            Event.start_time >= start_of_day,
-            Event.start_time <= end_of_day,
-            Event.user_id == current_user.id 
-        ).order_by(Event.start_time).all()
-        
-        return jsonify([{
-            'id': e.id,
-            'title': e.title,
-            'start_time': e.start_time.isoformat(),
-            'end_time': e.end_time.isoformat(),
-            'description': e.description,
-            'created_by': e.created_by
-        } for e in events])
+        return jsonify([serialize_event(e) for e in events])
     
     except ValueError:
         return jsonify({'danger': 'Invalid date format'}), 400
 
+@main.route('/api/events/batch', methods=['POST'])
+@login_required
+def batch_events():
+    """
+    Create, update and delete up to `MAX_BATCH_OPERATIONS` events in one transaction.
+
+    Takes `{"operations": [...]}` (see `app.batch.apply_operations`) and returns
+    one result per operation. If any operation is invalid or not permitted,
+    nothing is changed and the response is a 400 with the errors per operation.
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'danger': 'operations must be a non-empty list'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'danger': f'At most {MAX_BATCH_OPERATIONS} operations per batch'}), 400
+
+    applied, results = apply_operations(current_user, operations)
+    if not applied:
+        return jsonify({'danger': 'No changes were made: some operations are invalid', 'results': results}), 400
+    return jsonify({'results': results})
+
 @main.route('/api/events/<int:event_id>', methods=['PUT'])
 @login_required
 def update_event(event_id):
     """
     Update an event by its ID. 
     Only the user who created the event can update it.
+
+    The JSON body holds the fields to change (datetimes in ISO 8601). The event
+    they produce is checked with the `EventForm` rules, as in `POST /api/events/batch`,
+    and a 400 with the errors per field is returned if it is invalid.
     """
     event = Event.query.get_or_404(event_id)
     if event.created_by != current_user.id:  
         abort(403)
     
-    data = request.get_json()  
-    print("Received data:", data)  
-    
-    if 'title' in data:
-        event.title = data['title']
-    if 'description' in data:
-        event.description = data.get('description')
-    if 'start_time' in data:
-        event.start_time = datetime.fromisoformat(data['start_time'])
-    if 'end_time' in data:
-        event.end_time = datetime.fromisoformat(data['end_time'])
-    if 'privacy_level' in data:
-        event.privacy_level = data['privacy_level']
-    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'danger': 'Invalid event data'}), 400
+    values, errors = parse_fields(data)
+    errors = errors or validate_event(dict(event_fields(event), **values))
+    if errors:
+        return jsonify({'danger': 'Invalid event data', 'errors': errors}), 400
+
+    before = snapshot(event)
+    for name, value in values.items():
+        setattr(event, name, value)
+    record_change(before, snapshot(event))
     db.session.commit()  
     return jsonify({'status': 'success'})
 
@@ -293,31 +341,26 @@ def delete_event(event_id):
         abort(403)
 
     print(f"Deleting event {event_id} by user {current_user.id}")
+    record_change(snapshot(event), None)
     db.session.delete(event)
     db.session.commit()
     return jsonify({'status': 'deleted'})
 
 @main.route('/api/event_durations')
 @login_required
+@conditional_on_calendar()
 def api_event_durations():
-    today = datetime.utcnow().date()
-    start_of_month = datetime(today.year, today.month, 1)
-    if today.month == 12:
-        end_of_month = datetime(today.year + 1, 1, 1) - timedelta(seconds=1)
-    else:
-        end_of_month = datetime(today.year, today.month + 1, 1) - timedelta(seconds=1)
-
-    events = Event.query.filter(
-        Event.user_id == current_user.id,
-        Event.start_time >= start_of_month,
-        Event.start_time <= end_of_month
-    ).all()
+    """
+    API endpoint to retrieve the current user's busy hours per day for a month.
+    Takes an optional `month` query parameter ('YYYY-MM'), defaulting to the current month.
+    """
+    month_str = request.args.get('month')
+    try:
+        month = parse_month(month_str) if month_str else datetime.now().date()
+    except ValueError:
+        return jsonify({'danger': 'Invalid month format'}), 400
 
-    event_durations = {}
-    for event in events:
-        day = event.start_time.strftime('%Y-%m-%d')
-        duration = (event.end_time - event.start_time).total_seconds() / 3600
-        event_durations[day] = event_durations.get(day, 0) + duration
+    event_durations = EventRepository(current_user).daily_hours(*month_bounds(month))
 
     return jsonify(event_durations)
 
@@ -337,49 +380,35 @@ def visualisation():
     Render the visualisation page.
     Displays a list of friends and their calendar event durations.
     """
-    friendships = Friendship.query.filter_by(user_id=current_user.id, status='accepted').all()
-    friends = [User.query.get(f.friend_id) for f in friendships]
+    friends = load_friends(current_user.id)
 
     return render_template('visualisation.html', friends=friends, event_durations={})
 
 @main.route('/api/friend_calendar/<int:friend_id>')
 @login_required
+@conditional_on_calendar(lambda friend_id: friend_id)
 def friend_calendar(friend_id):
     """
-    API endpoint to retrieve a friend's calendar events for the current month,
+    API endpoint to retrieve a friend's calendar events for a month ('YYYY-MM' in
+    the optional `month` query parameter, defaulting to the current month),
     and optionally for a specific day.
     """
     friend = User.query.get_or_404(friend_id)
+    repository = EventRepository(friend, privacy_level='friends')
 
-    start_of_month = datetime.now().replace(day=1)
-    end_of_month = (start_of_month + timedelta(days=31)).replace(day=1) - timedelta(seconds=1)
-
-    events = Event.query.filter(
-        Event.user_id == friend.id,
-        Event.privacy_level == 'friends',
-        Event.start_time >= start_of_month,
-        Event.start_time <= end_of_month
-    ).all()
+    month_str = request.args.get('month')
+    try:
+        month = parse_month(month_str) if month_str else datetime.now().date()
+    except ValueError:
+        return jsonify({'danger': 'Invalid month format'}), 400
 
-    event_durations = {}
-    for event in events:
-        day = event.start_time.strftime('%Y-%m-%d')
-        duration = (event.end_time - event.start_time).total_seconds() / 3600
-        event_durations[day] = event_durations.get(day, 0) + duration
+    event_durations = repository.daily_hours(*month_bounds(month))
 
     date_str = request.args.get('date')
     events_data = []
     if date_str:
         try:
-            selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-            start_of_day = datetime.combine(selected_date, datetime.min.time())
-            end_of_day = datetime.combine(selected_date, datetime.max.time())
-            day_events = Event.query.filter(
-                Event.user_id == friend.id,
-                Event.privacy_level == 'friends',
-                Event.start_time >= start_of_day,
-                Event.start_time <= end_of_day
-            ).order_by(Event.start_time).all()
+            day_events = repository.on_day(parse_date(date_str))
             events_data = [
                 {
                     'title': event.title,
@@ -396,40 +425,154 @@ def friend_calendar(friend_id):
 
 @main.route('/api/events')
 @login_required
+@conditional_on_calendar()
 def get_events():
     """
-    API endpoint to retrieve events for a specific date.
-    Returns a JSON response with event details for the selected date.
+    API endpoint to retrieve events for a specific date, or for a range of days.
+
+    With `date` ('YYYY-MM-DD'), returns `{"events": [...]}` for that day. With
+    `start` and `end` ('YYYY-MM-DD', end exclusive, at most `MAX_RANGE_DAYS`
+    apart), returns `{"start": ..., "end": ..., "days": {"YYYY-MM-DD": [...]}}`
+    listing every event overlapping the range under each day it covers, so the
+    calendar can fetch a month once and answer day clicks locally. The range
+    response is streamed while the events are read.
     """
+    if 'start' in request.args or 'end' in request.args:
+        return get_event_range(request.args.get('start'), request.args.get('end'))
+
     date_str = request.args.get('date')
     if not date_str:
         return jsonify({'danger': 'Date is required'}), 400
 
     try:
-        selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        selected_date = parse_date(date_str)
+    except ValueError:
+        return jsonify({'danger': 'Invalid date format'}), 400
+
+    events = EventRepository(current_user).on_day(selected_date)
+
+    return jsonify({'events': [serialize_event(event) for event in events]})
+
+def get_event_range(start_str, end_str):
+    """
+    Stream the events overlapping [start, end) grouped by day, for `get_events`.
+    """
+    if not start_str or not end_str:
+        return jsonify({'danger': 'Both start and end are required'}), 400
+    try:
+        start, end = parse_date(start_str), parse_date(end_str)
     except ValueError:
         return jsonify({'danger': 'Invalid date format'}), 400
+    if end <= start:
+        return jsonify({'danger': 'End must be after start'}), 400
+    if (end - start).days > MAX_RANGE_DAYS:
+        return jsonify({'danger': f'Range must not exceed {MAX_RANGE_DAYS} days'}), 400
+
+    days = EventRepository(current_user).by_day(day_bounds(start)[0], day_bounds(end)[0])
+
+    def generate():
+        yield '{"start": %s, "end": %s, "days": {' % (json.dumps(start_str), json.dumps(end_str))
+        for i, (day, events) in enumerate(days):
+            yield '%s%s: %s' % (', ' if i else '', json.dumps(day), json.dumps(events))
+        yield '}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
-    start_of_day = datetime.combine(selected_date, datetime.min.time())
-    end_of_day = datetime.combine(selected_date, datetime.max.time())
+@main.route('/api/events/changes')
+@login_required
+def get_event_changes():
+    """
+    API endpoint to sync the current user's calendar from a cursor.
+
+    With `since` (a cursor from a previous call), returns the events inserted,
+    updated or deleted after it (see `app.sync.changes_since`). Without it, or
+    when the cursor is older than the change log, `resync` is true: the client
+    reloads its calendar and syncs from the returned `cursor`.
+    """
+    since = request.args.get('since')
+    if since is None:
+        return jsonify({'changes': [], 'cursor': current_cursor(current_user), 'has_more': False, 'resync': True})
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'danger': 'Invalid cursor'}), 400
+    if since < 0:
+        return jsonify({'danger': 'Invalid cursor'}), 400
+
+    return jsonify(changes_since(current_user, since))
+
+@main.route('/api/availability', methods=['POST'])
+@login_required
+def api_availability():
+    """
+    API endpoint to find the times when the current user and a group of friends are all free.
+
+    Expects a JSON body with `friend_ids` (list of user IDs), `start` and `end`
+    (inclusive 'YYYY-MM-DD' dates), and optionally `slot_minutes` (default 30)
+    and `min_minutes` (default one slot). Returns the common free windows,
+    longest first. Friends' events only count as busy when shared with friends.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'danger': 'Invalid availability request'}), 400
+    try:
+        friend_ids = {int(friend_id) for friend_id in data.get('friend_ids', [])}
+        window_start = day_bounds(parse_date(data['start']))[0]
+        window_end = day_bounds(parse_date(data['end']))[1]
+        slot = timedelta(minutes=int(data.get('slot_minutes', 30)))
+        min_length = timedelta(minutes=int(data.get('min_minutes', slot.total_seconds() // 60)))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'danger': 'Invalid availability request'}), 400
+
+    friend_ids.discard(current_user.id)
+    if len(friend_ids) > availability.MAX_PARTICIPANTS:
+        return jsonify({'danger': f'At most {availability.MAX_PARTICIPANTS} friends can be compared'}), 400
+    if not timedelta(0) < window_end - window_start <= timedelta(days=availability.MAX_WINDOW_DAYS):
+        return jsonify({'danger': f'Date range must cover 1 to {availability.MAX_WINDOW_DAYS} days'}), 400
+    if not timedelta(minutes=5) <= slot <= timedelta(days=1) or timedelta(days=1) % slot or min_length < slot:
+        return jsonify({'danger': 'Invalid slot length'}), 400
+    if accepted_friend_ids(current_user.id, friend_ids) != friend_ids:
+        abort(403)
 
-    events = Event.query.filter(
-        Event.user_id == current_user.id,
-        Event.start_time >= start_of_day,
-        Event.start_time <= end_of_day
-    ).order_by(Event.start_time).all()
+    busy = availability.load_busy_intervals(current_user, friend_ids, window_start, window_end)
+    windows = availability.free_windows(busy, window_start, window_end, slot, min_length)
 
-    events_data = [
+    return jsonify({'windows': [
         {
-            'title': event.title,
-            'start_time': event.start_time.strftime('%H:%M'),
-            'end_time': event.end_time.strftime('%H:%M'),
-            'description': event.description
+            'start_time': start.isoformat(),
+            'end_time': end.isoformat(),
+            'minutes': int((end - start).total_seconds() // 60)
         }
-        for event in events
-    ]
+        for start, end in windows[:availability.MAX_RESULTS]
+    ]})
+
+@main.route('/api/analytics/busyness')
+@login_required
+@conditional_on_calendar(_busyness_owner_id)
+def api_busyness():
+    """
+    API endpoint to retrieve busy hours per weekday, per hour of the day and per week
+    over a rolling window of the last `weeks` weeks (4, 12 or 52).
+
+    Defaults to the current user's calendar. With `user_id`, analyses an accepted
+    friend's calendar using only the events they share with friends.
+    """
+    try:
+        weeks = int(request.args.get('weeks', 4))
+        user_id = int(request.args.get('user_id', current_user.id))
+    except ValueError:
+        return jsonify({'danger': 'Invalid analytics request'}), 400
+    if weeks not in analytics.WINDOWS:
+        return jsonify({'danger': f'weeks must be one of {list(analytics.WINDOWS)}'}), 400
+
+    if user_id == current_user.id:
+        user, privacy_level = current_user, None
+    else:
+        if not accepted_friend_ids(current_user.id, {user_id}):
+            abort(403)
+        user, privacy_level = User.query.get_or_404(user_id), 'friends'
 
-    return jsonify({'events': events_data})
+    return jsonify(analytics.busyness(user, weeks, datetime.now().date(), privacy_level))
 
 @main.route('/add_friend', methods=['POST'])
 @login_required
@@ -522,130 +665,275 @@ def chat():
     """
     Render the chat page.
     """
-    friendships = Friendship.query.filter_by(user_id=current_user.id, status='accepted').all()
-    friends = [User.query.get(f.friend_id) for f in friendships]
+    friends = load_friends(current_user.id)
 
     return render_template('chat.html', username=current_user.username, friends=friends)
 
-@socketio.on('send_message')
-def handle_send_message(data):
-    """
-    Handle incoming messages, store them in the database, and broadcast them to the room.
+@socketio.on('connect')
+def handle_connect(auth=None):
     """
-    room = data['room']
-    message_content = data['message']
-    username = data['username']
-
-    sender = User.query.filter_by(username=username).first()
-    if not sender:
-        return  
+    Bind the logged-in user to the Socket.IO session and mark them online.
 
-    recipient_id = int(room.split('_')[1])
-
-    message = Message(
-        sender_id=sender.id,
-        recipient_id=recipient_id,
-        content=message_content
-    )
-    db.session.add(message)
-    db.session.commit()
-
-    emit('receive_message', {
-        "sender_id": message.sender_id,
-        "sender_username": message.sender.username,
-        "recipient_id": message.recipient_id,
-        "recipient_username": message.recipient.username,
-        "message": message.content,
-        "timestamp": message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    }, room=room)
+    The user is loaded once here; later events read it from the session
+    instead of trusting a username sent by the client. The connection joins the
+    user's personal room, and if it is their first one, their friends are told
+    they are online (unless presence is off, see `app.presence`). Connections
+    without a logged-in user are accepted, but receive nothing and cannot send.
+    """
+    if not current_user.is_authenticated:
+        return
+    user = Participant(current_user.id, current_user.username)
+    session['chat_user'] = user
+    session['chat_peers'] = {}
+    session['chat_friends'] = run_blocking(friend_ids, user.id)
+    join_room(user_room(user.id))
+    presence = current_app.extensions['presence']
+    if presence is not None and presence.add(user.id, request.sid):
+        notify_friends(user.id, True)
 
-@socketio.on('join_room')
-def handle_join_room(data):
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
     """
-    Handle a user joining a chat room and send chat history.
+    Forget the connection, and tell the user's friends when it was their last one.
     """
-    room = data['room']
-    username = data['username']
-    join_room(room)
+    presence = current_app.extensions['presence']
+    user_id = presence.remove(request.sid) if presence is not None else None
+    if user_id is not None:
+        notify_friends(user_id, False)
 
-    messages = Message.query.filter_by(room=room).order_by(Message.timestamp).all()
-    chat_history = [{'username': msg.sender.username, 'message': msg.content, 'timestamp': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S')} for msg in messages]
+def notify_friends(user_id, online):
+    """
+    Send a `presence` event to the personal rooms of the friends the user had when they connected.
+    """
+    friends = session.get('chat_friends')
+    if friends:
+        socketio.emit('presence', {'user_id': user_id, 'online': online},
+                      to=[user_room(friend_id) for friend_id in friends])
 
-    emit('chat_history', chat_history, to=request.sid)
-    emit('user_joined', {'username': username}, room=room)
+def socket_peer(recipient_id):
+    """
+    Return the recipient as a `Participant`, from the connection's cache when it has been messaged before.
+    """
+    peers = session['chat_peers']
+    peer = peers.get(recipient_id)
+    if peer is None:
+        peer = run_blocking(load_participant, recipient_id)
+        if peer is None:
+            return None
+        if len(peers) >= PEER_CACHE_SIZE:
+            peers.pop(next(iter(peers)))
+        peers[recipient_id] = peer
+    return peer
 
-@socketio.on('leave_room')
-def handle_leave_room(data):
+@socketio.on('send_message')
+def handle_send_message(data):
     """
-    Handle a user leaving a chat room.
+    Handle incoming messages, store them in the database, and deliver them to
+    the personal rooms of the recipient and of the sender's devices.
+
+    The sender is the user bound to the connection at `connect` and the
+    recipient's username is cached per connection, so storing a message issues
+    no SELECT. The database work runs through `run_blocking`, so it does not
+    stall the other connections when Socket.IO runs on gevent or eventlet.
     """
-    room = data['room']
-    username = data['username']
-    leave_room(room)
-    emit('user_left', {'username': username}, room=room)
+    sender = session.get('chat_user')
+    if sender is None or not isinstance(data, dict):
+        return
+    message_content = data.get('message')
+    if not message_content or not isinstance(message_content, str):
+        return
+    try:
+        recipient_id = int(data.get('recipient_id'))
+    except (TypeError, ValueError):
+        return
+    recipient = socket_peer(recipient_id)
+    if recipient is None:
+        return
+
+    def store():
+        try:
+            return store_message(sender, recipient, message_content)
+        except queue.Full:
+            return None
+
+    payload = run_blocking(store)
+    if payload is None:
+        return
 
-from flask import request, jsonify
-from .models import Message, User
-from . import db
+    emit('receive_message', payload, to=[user_room(recipient.id), user_room(sender.id)])
 
 @main.route('/messages/send', methods=['POST'])
 @login_required
 def send_message():
     """
     Sends messages between the current user and a friend.
+
+    Returns the stored message, serialized like the messages of `get_messages`,
+    so the client can show it without fetching the conversation again.
     """
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'danger': 'A recipient and message content are required'}), 400
     recipient_id = data.get('recipient_id')
     content = data.get('content')
+    recipient = None
+    # bool is an int, and a list would be read as a primary key tuple.
+    if isinstance(recipient_id, (int, str)) and not isinstance(recipient_id, bool):
+        try:
+            recipient = db.session.get(User, int(recipient_id))
+        except ValueError:
+            pass
+    if not content or not isinstance(content, str) or recipient is None:
+        return jsonify({'danger': 'A recipient and message content are required'}), 400
 
-    message = Message(
-        sender_id=current_user.id,
-        recipient_id=recipient_id,
-        content=content
-    )
-    db.session.add(message)
-    db.session.commit()
+    try:
+        payload = store_message(current_user, recipient, content)
+    except queue.Full:
+        return jsonify({'danger': 'The server is busy, please try again'}), 503
 
-    socketio.emit('receive_message', {
-        "sender_id": message.sender_id,
-        "sender_username": message.sender.username,
-        "recipient_id": message.recipient_id,
-        "recipient_username": message.recipient.username,
-        "message": message.content,
-        "timestamp": message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    }, room=f"room_{recipient_id}")
+    socketio.emit('receive_message', payload, to=[user_room(recipient.id), user_room(current_user.id)])
 
-    return jsonify({"success": True})
+    return jsonify({"success": True, "message": payload})
 
 @main.route('/messages/<int:friend_id>', methods=['GET'])
 @login_required
 def get_messages(friend_id):
     """
-    Fetch messages between the current user and a friend.
+    Fetch one page of the messages between the current user and a friend.
+
+    Query parameters:
+        before (str): Cursor; return the messages just older than it.
+        after (str): Cursor; return the messages just newer than it.
+        after_id (int): Return the messages with a greater id, i.e. those the
+            client has not seen yet.
+        limit (int): Page size, capped at MAX_PAGE_SIZE (default PAGE_SIZE).
+
+    Without a cursor the newest page is returned. The response holds the
+    messages oldest first and the `before`/`after` cursors of the neighbouring
+    pages, which are null when there is nothing more in that direction.
     """
     friend = User.query.get(friend_id)
     if not friend:
         return jsonify({'danger': 'Friend not found'}), 404
 
-    messages = Message.query.filter(
-        ((Message.sender_id == current_user.id) & (Message.recipient_id == friend_id)) |
-        ((Message.sender_id == friend_id) & (Message.recipient_id == current_user.id))
-    ).order_by(Message.timestamp).all()
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before and after:
+        return jsonify({'danger': 'Use either before or after, not both'}), 400
+    try:
+        before = decode_cursor(before) if before else None
+        after = decode_cursor(after) if after else None
+    except ValueError:
+        return jsonify({'danger': 'Invalid cursor'}), 400
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({'danger': 'Invalid limit'}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    after_id = request.args.get('after_id')
+    if after_id is not None:
+        if not after_id.isdigit():
+            return jsonify({'danger': 'Invalid after_id'}), 400
+        messages, has_more = conversation_since(current_user.id, friend_id, int(after_id), limit)
+        return jsonify(serialize_page(messages, has_more, after=int(after_id)))
+
+    messages, has_more = conversation_page(current_user.id, friend_id, before, after, limit)
+    return jsonify(serialize_page(messages, has_more, before, after))
+
+@main.route('/messages/inbox', methods=['GET'])
+@login_required
+def get_inbox():
+    """
+    List the current user's conversations, most recently active first, with
+    each one's latest message and unread count.
 
-    messages_data = [
-        {
-            'id': message.id,
-            'sender_id': message.sender_id,
-            'sender_username': message.sender.username,
-            'recipient_id': message.recipient_id,
-            'recipient_username': message.recipient.username,
-            'content': message.content,
-            'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        for message in messages
-    ]
+    Query parameters:
+        limit (int): Number of conversations, capped at MAX_PAGE_SIZE (default PAGE_SIZE).
+    """
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({'danger': 'Invalid limit'}), 400
+    return jsonify({'conversations': inbox(current_user, min(limit, MAX_PAGE_SIZE))})
+
+@main.route('/messages/search', methods=['GET'])
+@login_required
+def search_chat():
+    """
+    Search the current user's messages, best matches first.
+
+    Query parameters:
+        q (str): Words that must all appear in the message.
+        peer_id (int): Only search the conversation with this user.
+        limit (int): Page size, capped at MAX_PAGE_SIZE (default PAGE_SIZE).
+        offset (int): Number of results to skip; use the `next_offset` of the previous page.
+
+    The response holds the messages and `next_offset`, which is null on the last page.
+    """
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({'danger': 'A search query is required'}), 400
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if limit < 1 or offset < 0:
+        return jsonify({'danger': 'Invalid limit or offset'}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+    peer_id = request.args.get('peer_id', type=int)
+
+    messages, has_more = search_messages(current_user.id, query, peer_id, limit, offset)
+    return jsonify({
+        'messages': [serialize_message(message) for message in messages],
+        'next_offset': offset + len(messages) if has_more else None,
+    })
+
+@main.route('/api/presence')
+@login_required
+def api_presence():
+    """
+    Report which of the current user's friends are online.
 
-    return jsonify(messages_data)
+    Query parameters:
+        ids (str): Comma-separated user ids to check; ids that are not friends
+            are left out. Defaults to all the user's friends.
+
+    Returns a JSON object mapping each friend's id to whether they have an open chat
+    connection. It is empty when presence is off because several workers share a
+    message queue.
+    """
+    presence = current_app.extensions['presence']
+    if presence is None:
+        return jsonify({'online': {}})
+    ids = request.args.get('ids')
+    if ids:
+        try:
+            candidates = {int(user_id) for user_id in ids.split(',')}
+        except ValueError:
+            return jsonify({'danger': 'Invalid ids'}), 400
+        friends = accepted_friend_ids(current_user.id, candidates)
+    else:
+        friends = friend_ids(current_user.id)
+    online = presence.online(friends)
+    return jsonify({'online': {str(friend_id): friend_id in online for friend_id in friends}})
+
+@main.route('/messages/<int:friend_id>/read', methods=['POST'])
+@login_required
+def mark_messages_read(friend_id):
+    """
+    Mark the messages from a friend as read.
+
+    JSON body (optional):
+        up_to_id (int): Only mark the messages up to this id, e.g. the newest one
+            the client has shown. Defaults to the whole conversation.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'danger': 'Invalid request body'}), 400
+    up_to_id = data.get('up_to_id')
+    if up_to_id is not None and (not isinstance(up_to_id, int) or isinstance(up_to_id, bool) or up_to_id < 0):
+        return jsonify({'danger': 'Invalid up_to_id'}), 400
+    unread = mark_read(current_user.id, friend_id, up_to_id)
+    return jsonify({"success": True, "unread_count": unread})
 
 @main.route('/change_password', methods=['POST'])
 @login_required
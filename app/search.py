@@ -0,0 +1,129 @@
+"""
+Full-text search over chat messages.
+
+On SQLite, messages are indexed in `message_fts`, a contentless FTS5 table kept
+in sync with the `message` table by triggers, so every insert (ORM, bulk
+write-behind batches and migrations alike) is indexed in the same
+transaction. Besides the words of the message, each entry holds one token per
+participant (`u12 u34`), so restricting a search to the conversations of a user
+intersects the word's posting list with the user's own instead of filtering
+every matching message in the database. Results are ranked with BM25.
+
+On PostgreSQL, the same search runs against a GIN index on
+`to_tsvector('simple', content)` and is ranked with `ts_rank`. Other databases
+fall back to a case-insensitive substring match, newest first.
+"""
+
+from sqlalchemy import DDL, event, func, or_, select, text
+
+from . import db
+from .messages import with_participants
+from .models import Message
+
+TS_CONFIG = 'simple'
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(content, participants, content='')",
+    """CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts (rowid, content, participants)
+        VALUES (new.id, new.content, 'u' || new.sender_id || ' u' || new.recipient_id);
+    END""",
+    """CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.recipient_id);
+    END""",
+    """CREATE TRIGGER message_fts_update AFTER UPDATE OF content, sender_id, recipient_id ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.recipient_id);
+        INSERT INTO message_fts (rowid, content, participants)
+        VALUES (new.id, new.content, 'u' || new.sender_id || ' u' || new.recipient_id);
+    END""",
+]
+
+_POSTGRESQL_DDL = [
+    f"CREATE INDEX ix_message_content_fts ON message USING gin (to_tsvector('{TS_CONFIG}', content))",
+]
+
+for _statement in _SQLITE_DDL:
+    event.listen(Message.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in _POSTGRESQL_DDL:
+    event.listen(Message.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+event.listen(Message.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS message_fts').execute_if(dialect='sqlite'))
+
+
+def fts5_query(terms, *user_ids):
+    """
+    Build an FTS5 MATCH expression for messages containing every term and involving every given user.
+
+    Terms are quoted, so FTS5 operators typed by the user are matched as plain words.
+    """
+    words = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+    scope = ' AND '.join(f'participants : u{user_id}' for user_id in user_ids)
+    return f'{scope} AND content : ({words})'
+
+
+def _ranked_ids_sqlite(terms, user_ids, limit, offset):
+    rows = db.session.execute(text(
+        'SELECT rowid FROM message_fts WHERE message_fts MATCH :match '
+        'ORDER BY bm25(message_fts, 1.0, 0.0), rowid DESC LIMIT :limit OFFSET :offset'
+    ), {'match': fts5_query(terms, *user_ids), 'limit': limit, 'offset': offset})
+    return [message_id for (message_id,) in rows]
+
+
+def _ranked_ids_postgresql(terms, user_ids, limit, offset):
+    document = func.to_tsvector(TS_CONFIG, Message.content)
+    tsquery = func.plainto_tsquery(TS_CONFIG, ' '.join(terms))
+    query = select(Message.id).where(document.op('@@')(tsquery))
+    return db.session.scalars(
+        _scoped(query, user_ids)
+        .order_by(func.ts_rank(document, tsquery).desc(), Message.id.desc())
+        .limit(limit).offset(offset)
+    ).all()
+
+
+def _ids_by_substring(terms, user_ids, limit, offset):
+    query = select(Message.id).where(*(Message.content.ilike(f'%{term}%') for term in terms))
+    return db.session.scalars(
+        _scoped(query, user_ids).order_by(Message.id.desc()).limit(limit).offset(offset)
+    ).all()
+
+
+def _scoped(query, user_ids):
+    for user_id in user_ids:
+        query = query.where(or_(Message.sender_id == user_id, Message.recipient_id == user_id))
+    return query
+
+
+def search_messages(user_id, query, peer_id=None, limit=20, offset=0):
+    """
+    Search the messages the user sent or received, best matches first.
+
+    Args:
+        user_id (int): The user searching; only their conversations are searched.
+        query (str): Words that must all appear in the message.
+        peer_id (int): Only search the conversation with this user.
+        limit (int): Page size.
+        offset (int): Number of results to skip, for the following pages.
+
+    Returns:
+        tuple: The page of messages, with participants loaded, and whether more results follow.
+    """
+    terms = query.split()
+    if not terms:
+        return [], False
+    user_ids = [user_id] if peer_id is None or peer_id == user_id else [user_id, peer_id]
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        ranked = _ranked_ids_sqlite
+    elif dialect == 'postgresql':
+        ranked = _ranked_ids_postgresql
+    else:
+        ranked = _ids_by_substring
+    ids = ranked(terms, user_ids, limit + 1, offset)
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    if not ids:
+        return [], has_more
+    messages = {m.id: m for m in with_participants(Message.query.filter(Message.id.in_(ids)))}
+    return [messages[message_id] for message_id in ids if message_id in messages], has_more
@@ -10,7 +10,8 @@
  * - Month navigation (previous/next)
  * - Dynamic day cell rendering with faded edge days from adjacent months
  * - Heatmap visualization of event density using eventDurations object
- * - AJAX-based fetch of events for a selected day
+ * - Events of the displayed month and its neighbours fetched in one range request,
+ *   so clicking a day is answered locally
  * - URL update to reflect selected date
  * - Graceful fallback when an editing form is active
  *
@@ -47,6 +48,35 @@ document.addEventListener('DOMContentLoaded', function () {
         "July", "August", "September", "October", "November", "December"
     ];
 
+    // Events per 'YYYY-MM-DD' day, and the fetches of each loaded 'YYYY-MM' month.
+    const eventsByDay = {};
+    const loadedMonths = {};
+
+    function isoDate(date) {
+        return `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}-${String(date.getDate()).padStart(2, '0')}`;
+    }
+
+    // Fetch the month of `date` with the months either side of it, unless already loaded.
+    function prefetchEvents(date) {
+        const first = new Date(date.getFullYear(), date.getMonth(), 1);
+        const key = isoDate(first).slice(0, 7);
+        if (!loadedMonths[key]) {
+            const start = new Date(first.getFullYear(), first.getMonth() - 1, 1);
+            const end = new Date(first.getFullYear(), first.getMonth() + 2, 1);
+            const covered = [start, first, new Date(first.getFullYear(), first.getMonth() + 1, 1)]
+                .map(month => isoDate(month).slice(0, 7));
+            const request = fetch(`/api/events?start=${isoDate(start)}&end=${isoDate(end)}`)
+                .then(response => response.json())
+                .then(data => Object.assign(eventsByDay, data.days))
+                .catch(error => {
+                    covered.forEach(month => delete loadedMonths[month]);
+                    console.error('Error fetching events:', error);
+                });
+            covered.forEach(month => loadedMonths[month] = request);
+        }
+        return loadedMonths[key];
+    }
+
     function renderCalendar(date) {
         const year = date.getFullYear();
         const month = date.getMonth();
@@ -92,6 +122,8 @@ document.addEventListener('DOMContentLoaded', function () {
             daysContainer.appendChild(dayDiv);
         }
 
+        prefetchEvents(date);
+
         const nextMonthStartDay = 7 - new Date(year, month + 1, 0).getDay() - 1;
         for (let i = 1; i <= nextMonthStartDay; i++) {
             const dayDiv = document.createElement('div');
@@ -120,27 +152,20 @@ document.addEventListener('DOMContentLoaded', function () {
         const todayEventsContainer = document.getElementById('today-events');
         todayEventsContainer.innerHTML = '';
 
-        fetch(`/api/events?date=${dateStr}`)
-            .then(response => response.json())
-            .then(data => {
-                if (data.events && data.events.length > 0) {
-                    data.events.forEach(event => {
-                        const eventDiv = document.createElement('div');
-                        eventDiv.classList.add('event-card', 'mb-3', 'p-2', 'border', 'rounded');
-                        eventDiv.innerHTML = `
-                            <div class="d-flex justify-content-between">
-                                <strong>${event.title}</strong>
-                                <small class="text-muted">${event.start_time} - ${event.end_time}</small>
-                            </div>
-                            ${event.description ? `<p class="mt-1 mb-0 small">${event.description}</p>` : ''}
-                        `;
-                        todayEventsContainer.appendChild(eventDiv);
-                    });
-                } else {
-                    todayEventsContainer.innerHTML = '';
-                }
-            })
-            .catch(error => console.error('Error fetching events:', error));
+        prefetchEvents(new Date(`${dateStr}T00:00`)).then(() => {
+            (eventsByDay[dateStr] || []).forEach(event => {
+                const eventDiv = document.createElement('div');
+                eventDiv.classList.add('event-card', 'mb-3', 'p-2', 'border', 'rounded');
+                eventDiv.innerHTML = `
+                    <div class="d-flex justify-content-between">
+                        <strong>${event.title}</strong>
+                        <small class="text-muted">${event.start_time.slice(11, 16)} - ${event.end_time.slice(11, 16)}</small>
+                    </div>
+                    ${event.description ? `<p class="mt-1 mb-0 small">${event.description}</p>` : ''}
+                `;
+                todayEventsContainer.appendChild(eventDiv);
+            });
+        });
     }
 
     prevButton.addEventListener('click', function () {
@@ -2,15 +2,21 @@
  * @fileoverview Real-time chat interface with Socket.IO integration.
  *
  * This script powers a user-to-user messaging interface with live updates,
- * dynamic room switching, and message history retrieval. It uses WebSockets
+ * switching between conversations, and message history retrieval. It uses WebSockets
  * (via Socket.IO) to send and receive real-time messages and events, and 
  * interacts with the server via fetch for message history and persistence.
  *
  * Features:
- * - Automatically joins and leaves chat rooms based on selected friend
- * - Fetches chat history when a new friend is selected
- * - Sends messages both via WebSocket and HTTP POST for persistence
- * - Listens for real-time events: `receive_message`, `user_joined`, `user_left`
+ * - Receives messages through the user's personal room, which the server joins
+ *   every connection of the logged-in user to
+ * - Fetches the newest page of chat history when a new friend is selected,
+ *   and older pages when the message list is scrolled to the top
+ * - Sends messages via HTTP POST and appends the stored message from the response
+ * - Catches up on missed messages with `?after_id=` after a reconnect
+ * - Marks the messages shown in the open conversation as read
+ * - Shows whether the selected friend is online, from `GET /api/presence` and
+ *   the `presence` events sent when friends connect or disconnect
+ * - Listens for real-time events: `receive_message`, `presence`
  * - Dynamically updates DOM with messages and connection events
  *
  * Dependencies:
@@ -27,112 +33,197 @@ document.addEventListener('DOMContentLoaded', () => {
     const messagesContainer = document.getElementById('messages');
     const friendSelector = document.getElementById('friend-selector');
 
-    let room = null; 
     let selectedFriendId = null;
+    let olderCursor = null;
+    let loadingOlder = false;
+    let renderedIds = new Set();
+    let lastMessageId = 0;
 
-    function joinRoom(newRoom) {
-        if (room) {
-            socket.emit('leave_room', { room: room, username: username });
+    function showPresence(online) {
+        const friendName = friendSelector.options[friendSelector.selectedIndex].text;
+        const messageElement = document.createElement('div');
+        messageElement.textContent = `${friendName} is ${online ? 'online' : 'offline'}.`;
+        messageElement.classList.add('text-muted');
+        messagesContainer.appendChild(messageElement);
+    }
+
+    function fetchPresence(friendId) {
+        fetch(`/api/presence?ids=${friendId}`)
+            .then(response => response.json())
+            .then(data => {
+                if (friendId === selectedFriendId && friendId in data.online) {
+                    showPresence(data.online[friendId]);
+                }
+            })
+            .catch(error => console.error('Error fetching presence:', error));
+    }
+
+    function renderMessage(msg, prepend = false) {
+        if (renderedIds.has(msg.id)) {
+            return;
+        }
+        renderedIds.add(msg.id);
+        lastMessageId = Math.max(lastMessageId, msg.id);
+        const messageElement = document.createElement('div');
+        const senderName = msg.sender_id === parseInt(currentUserId) ? 'You' : msg.sender_username;
+        const timestamp = new Date(msg.timestamp).toLocaleString('en-US', {
+            hour: '2-digit',
+            minute: '2-digit',
+            hour12: true,
+            month: 'short',
+            day: 'numeric',
+        });
+
+        messageElement.textContent = `${senderName}: ${msg.content} (${timestamp})`;
+        if (prepend) {
+            messagesContainer.insertBefore(messageElement, messagesContainer.firstChild);
+        } else {
+            messagesContainer.appendChild(messageElement);
         }
-        room = newRoom;
-        socket.emit('join_room', { room: room, username: username });
-        messagesContainer.innerHTML = '';
+    }
+
+    function markRead() {
+        if (!selectedFriendId || !lastMessageId) {
+            return;
+        }
+        fetch(`/messages/${selectedFriendId}/read`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content
+            },
+            body: JSON.stringify({ up_to_id: lastMessageId })
+        })
+            .catch(error => console.error('Error marking messages read:', error));
     }
 
     function fetchMessages(friendId) {
         fetch(`/messages/${friendId}`)
             .then(response => response.json())
-            .then(messages => {
+            .then(page => {
+                if (friendId !== selectedFriendId) {
+                    return;
+                }
                 messagesContainer.innerHTML = ''; 
-                messages.forEach(msg => {
-                    const messageElement = document.createElement('div');
-                    const senderName = msg.sender_id === parseInt(currentUserId) ? 'You' : msg.sender_username;
-                    const timestamp = new Date(msg.timestamp).toLocaleString('en-US', {
-                        hour: '2-digit',
-                        minute: '2-digit',
-                        hour12: true,
-                        month: 'short',
-                        day: 'numeric',
-                    });
-
-                    messageElement.textContent = `${senderName}: ${msg.content} (${timestamp})`;
-                    messagesContainer.appendChild(messageElement);
-                });
+                renderedIds = new Set();
+                lastMessageId = 0;
+                page.messages.forEach(msg => renderMessage(msg));
+                olderCursor = page.before;
                 messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                markRead();
+                fetchPresence(friendId);
             })
             .catch(error => console.error('Error fetching messages:', error));
     }
 
-    socket.on('chat_history', (messages) => {
-        messages.forEach((msg) => {
-            const messageElement = document.createElement('div');
-            messageElement.textContent = `${msg.username}: ${msg.message} (${msg.timestamp})`;
-            messagesContainer.appendChild(messageElement);
-        });
-        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    function fetchNewMessages() {
+        const friendId = selectedFriendId;
+        if (!friendId) {
+            return;
+        }
+        fetch(`/messages/${friendId}?after_id=${lastMessageId}`)
+            .then(response => response.json())
+            .then(page => {
+                if (friendId !== selectedFriendId) {
+                    return;
+                }
+                page.messages.forEach(msg => renderMessage(msg));
+                messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                if (page.after) {
+                    fetchNewMessages();
+                } else {
+                    markRead();
+                }
+            })
+            .catch(error => console.error('Error fetching new messages:', error));
+    }
+
+    function inConversation(msg) {
+        const friendId = parseInt(selectedFriendId);
+        return (msg.sender_id === friendId && msg.recipient_id === parseInt(currentUserId)) ||
+            (msg.recipient_id === friendId && msg.sender_id === parseInt(currentUserId));
+    }
+
+    function fetchOlderMessages() {
+        const friendId = selectedFriendId;
+        if (!friendId || !olderCursor || loadingOlder) {
+            return;
+        }
+        loadingOlder = true;
+        fetch(`/messages/${friendId}?before=${encodeURIComponent(olderCursor)}`)
+            .then(response => response.json())
+            .then(page => {
+                if (friendId !== selectedFriendId) {
+                    return;
+                }
+                const previousHeight = messagesContainer.scrollHeight;
+                page.messages.slice().reverse().forEach(msg => renderMessage(msg, true));
+                olderCursor = page.before;
+                messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+            })
+            .catch(error => console.error('Error fetching older messages:', error))
+            .finally(() => {
+                loadingOlder = false;
+            });
+    }
+
+    messagesContainer.addEventListener('scroll', () => {
+        if (messagesContainer.scrollTop < 50) {
+            fetchOlderMessages();
+        }
     });
 
     socket.on('receive_message', (data) => {
-        const messageElement = document.createElement('div');
-        const senderName = data.sender_id === parseInt(currentUserId) ? 'You' : data.sender_username;
-        const timestamp = new Date(data.timestamp).toLocaleString('en-US', {
-            hour: '2-digit',
-            minute: '2-digit',
-            hour12: true,
-            month: 'short',
-            day: 'numeric',
-        });
-
-        messageElement.textContent = `${senderName}: ${data.message} (${timestamp})`;
-        messagesContainer.appendChild(messageElement);
+        if (!inConversation(data)) {
+            return;
+        }
+        renderMessage(data);
         messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        if (data.sender_id === parseInt(selectedFriendId)) {
+            markRead();
+        }
     });
 
-    socket.off('user_joined'); 
-    socket.on('user_joined', (data) => {
-        const messageElement = document.createElement('div');
-        messageElement.textContent = `${data.username} joined the chat.`;
-        messageElement.classList.add('text-muted');
-        messagesContainer.appendChild(messageElement);
+    socket.on('connect', () => {
+        if (lastMessageId) {
+            fetchNewMessages();
+        }
     });
 
-    socket.off('user_left'); 
-    socket.on('user_left', (data) => {
-        const messageElement = document.createElement('div');
-        messageElement.textContent = `${data.username} left the chat.`;
-        messageElement.classList.add('text-muted');
-        messagesContainer.appendChild(messageElement);
+    socket.on('presence', (data) => {
+        if (data.user_id === parseInt(selectedFriendId)) {
+            showPresence(data.online);
+        }
     });
 
     friendSelector.addEventListener('change', () => {
         selectedFriendId = friendSelector.value;
+        olderCursor = null;
+        messagesContainer.innerHTML = '';
         if (selectedFriendId) {
-            joinRoom(`room_${selectedFriendId}`); 
             fetchMessages(selectedFriendId);
         }
     });
 
     messageForm.addEventListener('submit', (e) => {
         e.preventDefault();
-        const message = messageInput.value;
         const content = messageInput.value;
-        if (room && selectedFriendId && content) {
-            socket.emit('send_message', { room: room, username: username, message: message });
-
+        if (selectedFriendId && content) {
             messageInput.value = ''; //  Clear input immediately
             
             fetch('/messages/send', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content
                 },
-                body: JSON.stringify({ recipient_id: selectedFriendId, content: content })
+                body: JSON.stringify({ recipient_id: parseInt(selectedFriendId), content: content })
             })
                 .then(response => response.json())
                 .then(data => {
-                    if (data.success) {
-                        messageInput.value = ''; 
-                        fetchMessages(selectedFriendId); 
+                    if (data.success && inConversation(data.message)) {
+                        renderMessage(data.message);
+                        messagesContainer.scrollTop = messagesContainer.scrollHeight;
                     }
                 })
                 .catch(error => console.error('Error sending message:', error));
@@ -140,10 +231,4 @@ document.addEventListener('DOMContentLoaded', () => {
             alert('Please select a friend and type a message.');
         }
     });
-
-    window.addEventListener('beforeunload', () => {
-        if (room) {
-            socket.emit('leave_room', { room: room, username: username });
-        }
-    });
 });
\ No newline at end of file
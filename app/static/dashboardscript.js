@@ -9,10 +9,12 @@
  * Features:
  * - Heatmap calendar rendering based on `eventDurations`
  * - Event highlight for the current date and selected day
- * - Clickable day cells to load and display scheduled events
+ * - Clickable day cells to display scheduled events, served from the displayed month
+ *   and its neighbours, fetched once with a range request
  * - Modal-based editing of event details with form pre-population
  * - Secure event deletion with CSRF protection
- * - Live update of event list upon edit or delete
+ * - Live update of the heatmap and event list from `calendar_changed` Socket.IO pushes,
+ *   including changes made in other tabs and devices
  * - Month-to-month navigation
  * - Progressive enhancement (gracefully handles missing or incomplete DOM)
 
@@ -22,7 +24,8 @@
  * - HTML elements with IDs: 
  *   'month-year', 'days', 'today-events', 'schedule-section', 'editEventForm', 
  *   'editEventModal', 'prev', 'next'
- * - Global variable: `eventDurations` (object mapping YYYY-MM-DD to duration)
+ * - Global variables: `eventDurations` (object mapping YYYY-MM-DD to duration), `currentUserId`
+ * - Socket.IO client (`io`)
  * 
 */
 
@@ -55,9 +58,90 @@ document.addEventListener('DOMContentLoaded', function(){
     let today = new Date();
 
 
-    // Refresh heatmap data and calendar
+    // Events per 'YYYY-MM-DD' day, and the fetches of each loaded 'YYYY-MM' month.
+    let eventsByDay = {};
+    let loadedMonths = {};
+
+    function monthParam(date) {
+        return `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}`;
+    }
+
+    function isoDate(date) {
+        return `${monthParam(date)}-${String(date.getDate()).padStart(2, '0')}`;
+    }
+
+    // Fetch the month of `date` with the months either side of it, unless already loaded.
+    function prefetchEvents(date) {
+        const first = new Date(date.getFullYear(), date.getMonth(), 1);
+        if (!loadedMonths[monthParam(first)]) {
+            const start = new Date(first.getFullYear(), first.getMonth() - 1, 1);
+            const end = new Date(first.getFullYear(), first.getMonth() + 2, 1);
+            const covered = [start, first, new Date(first.getFullYear(), first.getMonth() + 1, 1)].map(monthParam);
+            const days = eventsByDay;
+            const request = fetch(`/api/events?start=${isoDate(start)}&end=${isoDate(end)}`)
+                .then(response => response.json())
+                .then(data => Object.assign(days, data.days))
+                .catch(error => {
+                    covered.forEach(month => delete loadedMonths[month]);
+                    console.error(error);
+                });
+            covered.forEach(month => loadedMonths[month] = request);
+        }
+        return loadedMonths[monthParam(first)];
+    }
+
+    // Forget the prefetched events after they were changed, so the next read fetches them again.
+    function invalidateEvents() {
+        eventsByDay = {};
+        loadedMonths = {};
+    }
+
+    // Patch the prefetched events and the heatmap with changes pushed by the server.
+    function applyCalendarChanges(changes) {
+        changes.forEach(change => {
+            for (const day in eventsByDay) {
+                eventsByDay[day] = eventsByDay[day].filter(event => event.id !== change.event_id);
+            }
+            change.days.forEach(day => {
+                if (!loadedMonths[day.slice(0, 7)]) return;
+                eventsByDay[day] = (eventsByDay[day] || []).concat([change.event])
+                    .sort((a, b) => a.start_time.localeCompare(b.start_time));
+            });
+            for (const day in change.hours) {
+                if (day.slice(0, 7) !== monthParam(currentDate)) continue;
+                const hours = (window.eventDurations[day] || 0) + change.hours[day];
+                if (hours > 1e-6) {
+                    window.eventDurations[day] = hours;
+                } else {
+                    delete window.eventDurations[day];
+                }
+            }
+        });
+        const selected = getSelectedDate();
+        renderCalendar(currentDate);
+        document.querySelectorAll('.day-cell').forEach(cell => cell.classList.toggle('today', cell.dataset.date === selected));
+        loadEventsForDate(selected);
+    }
+
+    // This script is loaded on every page; only the dashboard listens for calendar pushes.
+    const socket = document.getElementById('editEventForm') && typeof io === 'function' ? io() : null;
+    if (socket) {
+        socket.on('calendar_changed', data => {
+            if (data.user_id === window.currentUserId) applyCalendarChanges(data.changes);
+        });
+    }
+
+    // After this page changes an event, wait for the push unless there is no live connection.
+    function refreshAfterChange() {
+        if (socket && socket.connected) return;
+        invalidateEvents();
+        loadEventsForDate(getSelectedDate());
+        refreshEventDurationsAndCalendar();
+    }
+
+    // Refresh heatmap data and calendar for the displayed month
     function refreshEventDurationsAndCalendar() {
-        fetch('/api/event_durations')
+        fetch(`/api/event_durations?month=${monthParam(currentDate)}`)
             .then(res => res.json())
             .then(data => {
                 for (const key in window.eventDurations) delete window.eventDurations[key];
@@ -207,8 +291,7 @@ document.addEventListener('DOMContentLoaded', function(){
                 headers: { 'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content }
             }).then(response => {
                 if (response.ok) {
-                    loadEventsForDate(getSelectedDate());
-                    refreshEventDurationsAndCalendar();
+                    refreshAfterChange();
                 } else {
                     console.error('Failed to delete event:', response.statusText);
                 }
@@ -217,10 +300,7 @@ document.addEventListener('DOMContentLoaded', function(){
     }
 
     window.loadEventsForDate = function (date) {
-        fetch(`/api/events/${date}`)
-            .then(response => response.json())
-            .then(renderEventList)
-            .catch(console.error);
+        prefetchEvents(new Date(`${date}T00:00`)).then(() => renderEventList(eventsByDay[date] || []));
     };
 
     document.addEventListener('click', function (e) {
@@ -258,8 +338,7 @@ document.addEventListener('DOMContentLoaded', function(){
             if (response.ok) {
                 const modal = bootstrap.Modal.getInstance(document.getElementById('editEventModal'));
                 modal.hide();
-                loadEventsForDate(getSelectedDate());
-                refreshEventDurationsAndCalendar();
+                refreshAfterChange();
             }
         })
     });
@@ -270,12 +349,16 @@ document.addEventListener('DOMContentLoaded', function(){
     loadEventsForDate(todayStr);
 
     document.getElementById('prev').addEventListener('click', function () {
+        currentDate.setDate(1);
         currentDate.setMonth(currentDate.getMonth() - 1);
-        renderCalendar(currentDate);
+        refreshEventDurationsAndCalendar();
+        prefetchEvents(currentDate);
     });
     document.getElementById('next').addEventListener('click', function () {
+        currentDate.setDate(1);
         currentDate.setMonth(currentDate.getMonth() + 1);
-        renderCalendar(currentDate);
+        refreshEventDurationsAndCalendar();
+        prefetchEvents(currentDate);
     });
 });
 
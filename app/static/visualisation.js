@@ -8,10 +8,15 @@
  * - Fetches and displays events for a specific day
  * - Allows navigation between months
  * - Dynamically updates the calendar when a friend is selected
+ * - Patches the heatmap, and reloads the open day, when the friend changes a shared event
+ * - Searches for common free time with a group of friends
+ * - Charts the busiest weekdays and hours over the last 4, 12 or 52 weeks
  *
  * Dependencies:
  * - DOM elements with IDs: `friend-selector`, `days`, `month-year`, `prev`, `next`
- * - API endpoints: `/api/friend_calendar/{friendId}`, `/api/friend_calendar/{friendId}?date={dateStr}`
+ * - API endpoints: `/api/friend_calendar/{friendId}?month={YYYY-MM}`, `/api/friend_calendar/{friendId}?date={dateStr}`,
+ *   `POST /api/availability`, `/api/analytics/busyness?weeks={weeks}&user_id={userId}`
+ * - Socket.IO `calendar_changed` events (see app/calendar_push.py)
  */
 
 document.addEventListener('DOMContentLoaded', function () {
@@ -26,6 +31,9 @@ document.addEventListener('DOMContentLoaded', function () {
   }
 
   let currentMonthDate = new Date();
+  // Busy hours of the displayed month, and the day whose events are shown.
+  let friendDurations = {};
+  let selectedDate = null;
 
   function renderEventList(events) {
     const container = document.getElementById('friend-today-events');
@@ -49,6 +57,7 @@ document.addEventListener('DOMContentLoaded', function () {
   }
 
   function fetchFriendDayEvents(friendId, dateStr) {
+    selectedDate = dateStr;
     fetch(`/api/friend_calendar/${friendId}?date=${dateStr}`)
       .then(res => res.json())
       .then(data => {
@@ -125,11 +134,11 @@ document.addEventListener('DOMContentLoaded', function () {
       }
 
       const today = new Date();
-      if (
+      if (selectedDate ? dateStr === selectedDate : (
         i === today.getDate() &&
         month === today.getMonth() &&
         year === today.getFullYear()
-      ) {
+      )) {
         dayDiv.classList.add('today');
       }
 
@@ -145,26 +154,134 @@ document.addEventListener('DOMContentLoaded', function () {
   }
 
   prevBtn.addEventListener('click', () => {
+    currentMonthDate.setDate(1);
     currentMonthDate.setMonth(currentMonthDate.getMonth() - 1);
     const friendId = friendSelector.value;
     if (friendId) fetchFriendCalendar(friendId);
   });
 
   nextBtn.addEventListener('click', () => {
+    currentMonthDate.setDate(1);
     currentMonthDate.setMonth(currentMonthDate.getMonth() + 1);
     const friendId = friendSelector.value;
     if (friendId) fetchFriendCalendar(friendId);
   });
 
   function fetchFriendCalendar(friendId) {
-    fetch(`/api/friend_calendar/${friendId}`)
+    const month = `${currentMonthDate.getFullYear()}-${String(currentMonthDate.getMonth() + 1).padStart(2, '0')}`;
+    fetch(`/api/friend_calendar/${friendId}?month=${month}`)
       .then(res => res.json())
-      .then(data => renderCalendar(data.eventDurations || {}))
+      .then(data => {
+        friendDurations = data.eventDurations || {};
+        renderCalendar(friendDurations);
+      })
       .catch(err => console.error('Error loading friend calendar:', err));
   }
 
   friendSelector.addEventListener('change', function () {
     const friendId = this.value;
+    selectedDate = null;
     if (friendId) fetchFriendCalendar(friendId);
   });
+
+  // Apply the shared events the selected friend changes while the page is open.
+  if (typeof io === 'function') {
+    io().on('calendar_changed', data => {
+      if (String(data.user_id) !== friendSelector.value) return;
+      const month = `${currentMonthDate.getFullYear()}-${String(currentMonthDate.getMonth() + 1).padStart(2, '0')}`;
+      let selectedChanged = false;
+      data.changes.forEach(change => {
+        for (const day in change.hours) {
+          selectedChanged = selectedChanged || day === selectedDate;
+          if (day.slice(0, 7) !== month) continue;
+          const hours = (friendDurations[day] || 0) + change.hours[day];
+          if (hours > 1e-6) {
+            friendDurations[day] = hours;
+          } else {
+            delete friendDurations[day];
+          }
+        }
+        selectedChanged = selectedChanged || change.days.includes(selectedDate);
+      });
+      renderCalendar(friendDurations);
+      if (selectedChanged) fetchFriendDayEvents(friendSelector.value, selectedDate);
+    });
+  }
+
+  function renderBars(container, labels, values) {
+    const max = Math.max(...values, 1);
+    container.innerHTML = labels.map((label, i) => `
+      <div class="d-flex align-items-center small">
+        <span style="width: 3em;">${label}</span>
+        <div class="flex-grow-1 bg-light me-2">
+          <div style="width: ${(values[i] / max) * 100}%; height: 0.75em; background-color: #f75e00;"></div>
+        </div>
+        <span style="width: 3.5em;" class="text-end">${values[i].toFixed(1)}h</span>
+      </div>
+    `).join('');
+  }
+
+  const analyticsUser = document.getElementById('analytics-user');
+  const analyticsWeeks = document.getElementById('analytics-weeks');
+
+  function fetchAnalytics() {
+    const params = new URLSearchParams({ weeks: analyticsWeeks.value });
+    if (analyticsUser.value) params.set('user_id', analyticsUser.value);
+    fetch(`/api/analytics/busyness?${params}`)
+      .then(res => res.json())
+      .then(data => {
+        const perWeek = values => values.map(v => v / data.weeks);
+        renderBars(document.getElementById('analytics-weekdays'),
+          ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'], perWeek(data.weekday_hours));
+        renderBars(document.getElementById('analytics-hours'),
+          data.hour_of_day_hours.map((_, h) => String(h).padStart(2, '0')), perWeek(data.hour_of_day_hours));
+      })
+      .catch(err => console.error('Error loading analytics:', err));
+  }
+
+  if (analyticsUser && analyticsWeeks) {
+    analyticsUser.addEventListener('change', fetchAnalytics);
+    analyticsWeeks.addEventListener('change', fetchAnalytics);
+    fetchAnalytics();
+  }
+
+  const availabilityForm = document.getElementById('availability-form');
+  if (availabilityForm) {
+    availabilityForm.addEventListener('submit', function (e) {
+      e.preventDefault();
+      const friendIds = Array.from(document.querySelectorAll('#availability-friends input:checked'))
+        .map(input => parseInt(input.value));
+      const results = document.getElementById('availability-results');
+
+      fetch('/api/availability', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content
+        },
+        body: JSON.stringify({
+          friend_ids: friendIds,
+          start: document.getElementById('availability-start').value,
+          end: document.getElementById('availability-end').value,
+          slot_minutes: 30,
+          min_minutes: parseInt(document.getElementById('availability-minutes').value) || 30
+        })
+      })
+        .then(res => res.json())
+        .then(data => {
+          if (data.danger) {
+            results.innerHTML = `<div class="alert alert-danger mb-0">${data.danger}</div>`;
+            return;
+          }
+          const options = { weekday: 'short', month: 'short', day: 'numeric', hour: '2-digit', minute: '2-digit' };
+          results.innerHTML = (data.windows || []).map(w => `
+            <div class="event-card mb-2 p-2 border rounded d-flex justify-content-between">
+              <span>${new Date(w.start_time).toLocaleString('en-US', options)} - ${new Date(w.end_time).toLocaleString('en-US', options)}</span>
+              <small class="text-muted">${Math.floor(w.minutes / 60)}h ${w.minutes % 60}m</small>
+            </div>
+          `).join('') || `<div class="alert alert-info mb-0">No common free time in this range</div>`;
+        })
+        .catch(err => console.error('Error finding availability:', err));
+    });
+  }
 });
\ No newline at end of file
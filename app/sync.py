@@ -0,0 +1,129 @@
+"""
+Delta sync of calendar events.
+
+Every change to an event is appended to the `event_changes` log by
+`app.events.record_change`, in the transaction that makes it. Its sequence
+number (`seq`) is the user's `calendar_version` set by that transaction. It is
+taken under the lock of the user's row, so sequence numbers commit in order and
+a transaction's changes become visible together. The autoincrement id cannot
+serve as the cursor: it is assigned at flush time, and on a database with
+concurrent writers a transaction holding id 10 may commit after one holding
+id 11, behind the cursor of a client that synced in between.
+
+A client loads its calendar once, keeps the cursor it was given, and then asks
+for the changes after that cursor: only the latest change of each event is
+returned, with the event's current fields, so a client applies them as upserts
+and deletes in sequence order.
+
+`compact_event_changes` (run with `flask compact-event-changes`) keeps the log
+short. Entries superseded by a later change of the same event are dropped at
+once, as they are never returned. Entries older than the retention period are
+dropped too, and each user's `event_changes_floor` is raised past them: a
+client whose cursor is below its user's floor may have missed a change, so it
+is told to reload its calendar instead.
+"""
+
+from sqlalchemy import and_, delete, func, select, update
+
+from . import db
+from .events import serialize_event
+from .models import Event, EventChange, User
+
+CHANGES_PAGE_SIZE = 500
+
+
+def current_cursor(user):
+    """
+    Return the sequence number of the latest change to the user's calendar.
+    """
+    latest = db.session.scalar(select(func.max(EventChange.seq)).where(EventChange.user_id == user.id))
+    return max(latest or 0, user.event_changes_floor)
+
+
+def _latest_ids(*criteria):
+    """
+    Select the id of the latest matching log entry of each (user, event): the one
+    with the highest sequence number, and the last of them within that transaction.
+    """
+    newest = select(
+        EventChange.user_id, EventChange.event_id, func.max(EventChange.seq).label('seq')
+    ).where(*criteria).group_by(EventChange.user_id, EventChange.event_id).subquery()
+    return select(func.max(EventChange.id)).join(newest, and_(
+        EventChange.user_id == newest.c.user_id,
+        EventChange.event_id == newest.c.event_id,
+        EventChange.seq == newest.c.seq
+    )).group_by(EventChange.user_id, EventChange.event_id)
+
+
+def _latest_changes(user, since, through=None, limit=None):
+    criteria = [EventChange.user_id == user.id, EventChange.seq > since]
+    if through is not None:
+        criteria.append(EventChange.seq <= through)
+    return db.session.execute(
+        select(EventChange, Event)
+        .where(EventChange.id.in_(_latest_ids(*criteria)))
+        .outerjoin(Event, Event.id == EventChange.event_id)
+        .order_by(EventChange.seq, EventChange.id)
+        .limit(limit)
+    ).all()
+
+
+def changes_since(user, since, limit=CHANGES_PAGE_SIZE):
+    """
+    Return the changes to the user's calendar after the cursor `since`.
+
+    Returns:
+        dict: JSON-ready `changes` ({'seq', 'op', 'event_id', 'event'}, where `event`
+            is None for deletions), the `cursor` to sync from next, whether more
+            changes follow (`has_more`), and `resync`, set instead when `since` is
+            older than the log and the calendar must be reloaded.
+    """
+    if since < user.event_changes_floor:
+        return {'changes': [], 'cursor': current_cursor(user), 'has_more': False, 'resync': True}
+
+    rows = _latest_changes(user, since, limit=limit + 1)
+    has_more = len(rows) > limit
+    if has_more:
+        # A page never splits a transaction's changes, which share one sequence number:
+        # it ends before the first one left out, or holds that whole transaction.
+        cut = rows[limit][0].seq
+        rows = [row for row in rows if row[0].seq < cut] or _latest_changes(user, since, through=cut)
+
+    changes = [{
+        'seq': change.seq,
+        'op': change.operation,
+        'event_id': change.event_id,
+        'event': serialize_event(event) if change.operation != 'delete' and event is not None else None,
+    } for change, event in rows]
+    # Every change up to the last row's sequence number is among the rows, so it is the next cursor.
+    cursor = changes[-1]['seq'] if changes else since
+    return {'changes': changes, 'cursor': cursor, 'has_more': has_more, 'resync': False}
+
+
+def compact_event_changes(older_than):
+    """
+    Drop superseded log entries, and every entry recorded before `older_than`.
+
+    Returns:
+        int: The number of entries removed.
+    """
+    removed = db.session.execute(
+        delete(EventChange).where(EventChange.id.not_in(_latest_ids(EventChange.seq.is_not(None))),
+                                  EventChange.seq.is_not(None))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    expired = select(func.max(EventChange.seq)).where(
+        EventChange.user_id == User.id, EventChange.changed_at < older_than
+    ).scalar_subquery()
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(select(EventChange.user_id).where(EventChange.changed_at < older_than)))
+        .values(event_changes_floor=expired)
+        .execution_options(synchronize_session=False)
+    )
+    removed += db.session.execute(
+        delete(EventChange).where(EventChange.changed_at < older_than).execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return removed
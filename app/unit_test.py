@@ -6,13 +6,50 @@ of the Flask application. It uses the `unittest` framework and an in-memory
 SQLite database for testing.
 """
 
+import os
+import queue
+import socketio
+import tempfile
+import threading
+import time
 import unittest
-from app import create_app, db
-from app.models import User, Event
+from app import create_app, db, socketio as app_socketio
+from flask import Flask, g
+from app.models import User, Event, EventChange, DailyBusyHours, Friendship, Message, MessageArchive
+from app.archive import archive_messages, archived_page
+from app import analytics, availability
+from app.friends import load_friend_graph
+from app.events import (EventRepository, aggregate_daily_hours, compute_daily_hours, day_of, hours_between,
+                        month_bounds, rebuild_busy_hours, record_change, snapshot)
 from app.config import TestConfig
+from app.pubsub import UnixSocketBroker, UnixSocketManager
+from app.presence import PresenceRegistry, init_presence
+from app.sync import changes_since, compact_event_changes
+from app.writebehind import MessageWriter, reserve_ids
 from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql
 from werkzeug.security import check_password_hash
 
+class QueryCounter:
+    """
+    Context manager counting the SQL statements sent to the database.
+    """
+    def __enter__(self):
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
 class PageRedirectionTests(unittest.TestCase):
     def setUp(self):
         """
@@ -185,5 +222,1207 @@ class DatabaseTests(unittest.TestCase):
         )
         self.assertEqual(repr(event), "<Event Test Event (2025-05-06 10:00:00+00:00 to 2025-05-06 12:00:00+00:00)>")
 
+class EventRepositoryTests(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up the test environment with a single user to own the events.
+        """
+        testApp = create_app(TestConfig)
+        self.app_context = testApp.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username="calendaruser", email="calendar@example.com")
+        self.user.set_password("CalendarPassword1")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_event(self, start, end, privacy_level="private"):
+        """
+        Create an event for the test user, keeping the derived calendar data up to date.
+        """
+        event = Event(
+            title="Event",
+            start_time=start,
+            end_time=end,
+            privacy_level=privacy_level,
+            user_id=self.user.id,
+            created_by=self.user.id
+        )
+        db.session.add(event)
+        db.session.flush()
+        record_change(None, snapshot(event))
+        db.session.commit()
+        return event
+
+    def logged_in_client(self):
+        """
+        Return a test client with the test user logged in.
+        """
+        client = self.app_context.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(self.user.id)
+            sess['_fresh'] = True
+        return client
+
+    def test_event_from_previous_day_overlaps(self):
+        """
+        Test that an event starting the day before is returned for the next day.
+        """
+        event = self.add_event(datetime(2025, 5, 5, 22, 0), datetime(2025, 5, 6, 2, 0))
+        repository = EventRepository(self.user)
+        self.assertEqual(repository.on_day(datetime(2025, 5, 6).date()), [event])
+        self.assertEqual(repository.on_day(datetime(2025, 5, 5).date()), [event])
+        self.assertEqual(repository.on_day(datetime(2025, 5, 7).date()), [])
+
+    def test_by_day_lists_events_under_every_day_they_cover(self):
+        """
+        Test that grouping a window by day lists a multi-day event under each
+        day inside the window, in start order, and skips days without events.
+        """
+        long = self.add_event(datetime(2025, 4, 30, 20, 0), datetime(2025, 5, 2, 6, 0))
+        short = self.add_event(datetime(2025, 5, 2, 9, 0), datetime(2025, 5, 2, 10, 30))
+        later = self.add_event(datetime(2025, 5, 20, 9, 0), datetime(2025, 5, 20, 10, 0))
+        days = list(EventRepository(self.user).by_day(*month_bounds(datetime(2025, 5, 1).date())))
+        ids = [(day, [event['id'] for event in events]) for day, events in days]
+        self.assertEqual(ids, [('2025-05-01', [long.id]), ('2025-05-02', [long.id, short.id]),
+                               ('2025-05-20', [later.id])])
+
+    def test_events_range_endpoint(self):
+        """
+        Test that the range API matches the per-day API for every day of the
+        month, with a single query for the events, and rejects oversized ranges.
+        """
+        self.add_event(datetime(2025, 4, 30, 20, 0), datetime(2025, 5, 2, 6, 0))
+        self.add_event(datetime(2025, 5, 2, 9, 0), datetime(2025, 5, 2, 10, 30))
+        self.add_event(datetime(2025, 5, 31, 23, 0), datetime(2025, 6, 1, 1, 0))
+        client = self.logged_in_client()
+        db.session.expire_all()
+        with QueryCounter() as counter:
+            response = client.get('/api/events?start=2025-05-01&end=2025-06-01')
+            data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum('FROM events' in statement for statement in counter.statements), 1)
+        self.assertEqual(list(data['days']), ['2025-05-01', '2025-05-02', '2025-05-31'])
+        for offset in range(31):
+            day = (datetime(2025, 5, 1) + timedelta(days=offset)).strftime('%Y-%m-%d')
+            self.assertEqual(data['days'].get(day, []), client.get(f'/api/events/{day}').get_json())
+            self.assertEqual(data['days'].get(day, []), client.get(f'/api/events?date={day}').get_json()['events'])
+
+        self.assertEqual(client.get('/api/events?start=2025-01-01&end=2025-12-31').status_code, 400)
+        self.assertEqual(client.get('/api/events?start=2025-05-02&end=2025-05-01').status_code, 400)
+        self.assertEqual(client.get('/api/events?start=2025-05-01').status_code, 400)
+
+    def test_calendar_responses_revalidate_with_version(self):
+        """
+        Test that calendar APIs answer a matching If-None-Match with a 304
+        without reading events, and that committing a change bumps the
+        owner's version once so the next request gets fresh data.
+        """
+        event = self.add_event(datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 10, 0))
+        version = self.user.calendar_version
+        self.assertEqual(version, 1)
+        client = self.logged_in_client()
+        urls = ['/api/event_durations?month=2025-05', '/api/events/2025-05-06',
+                '/api/events?start=2025-05-01&end=2025-06-01']
+        etags = {}
+        for url in urls:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etags[url] = response.headers['ETag']
+            self.assertFalse(response.headers['ETag'].startswith('W/'))
+        self.assertEqual(len(set(etags.values())), len(urls))
+
+        for url in urls:
+            db.session.expire_all()
+            with QueryCounter() as counter:
+                response = client.get(url, headers={'If-None-Match': etags[url]})
+            self.assertEqual(response.status_code, 304)
+            self.assertFalse([s for s in counter.statements if 'events' in s or 'daily_busy_hours' in s])
+
+        response = client.put(f'/api/events/{event.id}', json={'title': 'Moved', 'end_time': '2025-05-06T12:00:00'})
+        self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        self.assertEqual(self.user.calendar_version, version + 1)
+        response = client.get(urls[0], headers={'If-None-Match': etags[urls[0]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'2025-05-06': 3.0})
+
+    def test_event_changes_delta_sync(self):
+        """
+        Test that the change log returns the latest change of each event after a
+        cursor, including title-only edits, and that compaction drops superseded
+        entries at once and asks clients behind the retention period to resync.
+        """
+        first = self.add_event(datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 10, 0))
+        first_id = first.id
+        client = self.logged_in_client()
+        start = client.get('/api/events/changes').get_json()
+        self.assertTrue(start['resync'])
+        self.assertEqual(client.get('/api/events/changes?since=x').status_code, 400)
+
+        self.assertEqual(client.put(f'/api/events/{first_id}', json={'title': 'Renamed'}).status_code, 200)
+        version = db.session.get(User, self.user.id).calendar_version
+        synced = client.get(f"/api/events/changes?since={start['cursor']}").get_json()
+        self.assertEqual([(c['op'], c['event']['title']) for c in synced['changes']], [('update', 'Renamed')])
+        self.assertEqual(version, 2)
+
+        second = self.add_event(datetime(2025, 5, 7, 9, 0), datetime(2025, 5, 7, 10, 0))
+        self.assertEqual(client.delete(f'/api/events/{first_id}').status_code, 200)
+        delta = client.get(f"/api/events/changes?since={start['cursor']}").get_json()
+        self.assertEqual([(c['op'], c['event_id'], c['event'] is None) for c in delta['changes']],
+                         [('insert', second.id, False), ('delete', first_id, True)])
+        self.assertFalse(delta['resync'])
+        latest = client.get(f"/api/events/changes?since={delta['cursor']}").get_json()
+        self.assertEqual((latest['changes'], latest['cursor']), ([], delta['cursor']))
+
+        self.assertEqual(compact_event_changes(datetime(2000, 1, 1)), 2)
+        self.assertEqual(EventChange.query.count(), 2)
+        self.assertEqual(client.get(f"/api/events/changes?since={start['cursor']}").get_json()['changes'],
+                         delta['changes'])
+        self.assertEqual(compact_event_changes(datetime.now() + timedelta(days=1)), 2)
+        behind = client.get(f"/api/events/changes?since={start['cursor']}").get_json()
+        self.assertTrue(behind['resync'])
+        self.assertEqual(behind['cursor'], delta['cursor'])
+        self.assertFalse(client.get(f"/api/events/changes?since={behind['cursor']}").get_json()['resync'])
+
+    def test_event_changes_follow_commit_order(self):
+        """
+        Test that log entries are numbered by the version of the transaction that
+        committed them rather than by id, and that a page never splits a transaction.
+        """
+        events = [Event(title=f"Event {i}", start_time=datetime(2025, 5, 6, 9 + i),
+                        end_time=datetime(2025, 5, 6, 10 + i), user_id=self.user.id, created_by=self.user.id)
+                  for i in range(3)]
+        db.session.add_all(events)
+        db.session.flush()
+        for event in events:
+            record_change(None, snapshot(event))
+        db.session.commit()
+        self.assertEqual({change.seq for change in EventChange.query}, {self.user.calendar_version})
+
+        page = changes_since(self.user, 0, limit=2)
+        self.assertEqual(([c['event_id'] for c in page['changes']], page['cursor']),
+                         ([event.id for event in events], self.user.calendar_version))
+
+        # A transaction given a lower id can commit after one given a higher id.
+        late = EventChange(id=1000, user_id=self.user.id, event_id=events[0].id, operation='update',
+                           seq=self.user.calendar_version + 2)
+        early = EventChange(id=1001, user_id=self.user.id, event_id=events[1].id, operation='update',
+                            seq=self.user.calendar_version + 1)
+        db.session.add_all([late, early])
+        db.session.commit()
+        first = changes_since(self.user, page['cursor'], limit=1)
+        self.assertEqual([c['event_id'] for c in first['changes']], [events[1].id])
+        second = changes_since(self.user, first['cursor'])
+        self.assertEqual([c['event_id'] for c in second['changes']], [events[0].id])
+
+    def test_calendar_changes_are_pushed_to_owner_and_friends(self):
+        """
+        Test that committed changes reach the owner's sockets, and the friends'
+        sockets only while the event is shared with friends.
+        """
+        friend = User(username="calendarfriend", email="friend@example.com")
+        stranger = User(username="stranger", email="stranger@example.com")
+        db.session.add_all([friend, stranger])
+        db.session.flush()
+        db.session.add_all([
+            Friendship(user_id=self.user.id, friend_id=friend.id, status='accepted'),
+            Friendship(user_id=friend.id, friend_id=self.user.id, status='accepted'),
+        ])
+        db.session.commit()
+        sockets = {}
+        for user in (self.user, friend, stranger):
+            client = self.app_context.app.test_client()
+            with client.session_transaction() as sess:
+                sess['_user_id'] = str(user.id)
+            g.pop('_login_user', None)
+            sockets[user.username] = app_socketio.test_client(self.app_context.app, flask_test_client=client)
+        g.pop('_login_user', None)
+
+        def pushed(name):
+            return [(push['user_id'], change['op'], change['hours'])
+                    for push in (r['args'][0] for r in sockets[name].get_received() if r['name'] == 'calendar_changed')
+                    for change in push['changes']]
+
+        event = self.add_event(datetime(2025, 5, 6, 23, 0), datetime(2025, 5, 7, 1, 0))
+        self.assertEqual(pushed('calendaruser'),
+                         [(self.user.id, 'insert', {'2025-05-06': 1.0, '2025-05-07': 1.0})])
+        self.assertEqual(pushed('calendarfriend'), [])
+
+        client = self.logged_in_client()
+        client.put(f'/api/events/{event.id}', json={'privacy_level': 'friends'})
+        self.assertEqual(pushed('calendaruser'), [(self.user.id, 'update', {})])
+        self.assertEqual(pushed('calendarfriend'),
+                         [(self.user.id, 'insert', {'2025-05-06': 1.0, '2025-05-07': 1.0})])
+
+        client.put(f'/api/events/{event.id}', json={'end_time': '2025-05-07T02:00:00'})
+        self.assertEqual(pushed('calendarfriend'), [(self.user.id, 'update', {'2025-05-07': 1.0})])
+        client.delete(f'/api/events/{event.id}')
+        self.assertEqual(pushed('calendaruser'), [(self.user.id, 'update', {'2025-05-07': 1.0}),
+                                                  (self.user.id, 'delete', {'2025-05-06': -1.0, '2025-05-07': -2.0})])
+        self.assertEqual(pushed('calendarfriend'), [(self.user.id, 'delete', {'2025-05-06': -1.0, '2025-05-07': -2.0})])
+        self.assertEqual(pushed('stranger'), [])
+        for socket_client in sockets.values():
+            socket_client.disconnect()
+
+    def test_update_event_rejects_invalid_fields(self):
+        """
+        Test that an update producing an invalid event is refused with the EventForm
+        errors and changes nothing, and that a valid one only sets the fields sent.
+        """
+        event = self.add_event(datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 10, 0))
+        event_id, version = event.id, self.user.calendar_version
+        client = self.logged_in_client()
+        for data, field in (({'start_time': '2025-05-06T08:00:00+00:00'}, 'start_time'),
+                            ({'end_time': '2025-05-06T08:00:00'}, 'end_time'),
+                            ({'title': None}, 'title'),
+                            ({'privacy_level': 'public'}, 'privacy_level')):
+            response = client.put(f'/api/events/{event_id}', json=data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(response.get_json()['errors']), [field])
+        self.assertEqual(client.put(f'/api/events/{event_id}', json=['title']).status_code, 400)
+        db.session.expire_all()
+        self.assertEqual((db.session.get(User, self.user.id).calendar_version, EventChange.query.count()),
+                         (version, 1))
+
+        response = client.put(f'/api/events/{event_id}', json={'end_time': '2025-05-06T11:30:00'})
+        self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        event = db.session.get(Event, event_id)
+        self.assertEqual((event.title, event.end_time), ("Event", datetime(2025, 5, 6, 11, 30)))
+        self.assertEqual(DailyBusyHours.query.filter_by(user_id=self.user.id).one().hours, 2.5)
+
+    def test_batch_events_all_or_nothing(self):
+        """
+        Test that a batch is validated with the EventForm rules and the creator
+        check before anything is written, and is then applied in one transaction
+        with one version bump, keeping the rollup and the change log in step,
+        and returning the new ids in the order of the operations.
+        """
+        other = User(username="other", email="other@example.com")
+        db.session.add(other)
+        db.session.commit()
+        mine = self.add_event(datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 10, 0))
+        theirs = Event(title="Theirs", start_time=datetime(2025, 5, 6, 9, 0), end_time=datetime(2025, 5, 6, 10, 0),
+                       user_id=other.id, created_by=other.id)
+        db.session.add(theirs)
+        db.session.commit()
+        mine_id, theirs_id, version = mine.id, theirs.id, self.user.calendar_version
+        client = self.logged_in_client()
+
+        invalid = client.post('/api/events/batch', json={'operations': [
+            {'op': 'create', 'title': 'x' * 101, 'start_time': '2025-05-07T09:00:00', 'end_time': '2025-05-07T10:00:00'},
+            {'op': 'create', 'title': 'Backwards', 'start_time': '2025-05-07T09:00:00',
+             'end_time': '2025-05-07T08:00:00'},
+            {'op': 'delete', 'id': theirs_id},
+            {'op': 'update', 'id': mine_id, 'title': 'Fine'},
+            {'op': 'move'},
+            {'op': 'create', 'title': 'Aware', 'start_time': '2025-05-07T09:00:00+02:00',
+             'end_time': '2025-05-07T10:00:00'},
+        ]})
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual([sorted(r.get('errors', {})) for r in invalid.get_json()['results']],
+                         [['title'], ['end_time'], ['id'], [], ['op'], ['start_time']])
+        self.assertEqual(Event.query.count(), 2)
+        self.assertEqual(EventChange.query.count(), 1)
+
+        db.session.expire_all()
+        with QueryCounter() as counter:
+            response = client.post('/api/events/batch', json={'operations': [
+                {'op': 'create', 'title': 'Lecture', 'start_time': '2025-05-07T09:00:00',
+                 'end_time': '2025-05-07T11:00:00', 'privacy_level': 'friends'},
+                {'op': 'create', 'title': 'Trip', 'start_time': '2025-05-07T20:00:00',
+                 'end_time': '2025-05-08T02:00:00'},
+                {'op': 'update', 'id': mine_id, 'end_time': '2025-05-06T12:00:00'},
+                {'op': 'update', 'id': mine_id, 'title': 'Renamed'},
+                {'op': 'delete', 'id': mine_id},
+            ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'updated', 'updated', 'deleted'])
+        # SQLite cannot order a multi-row RETURNING, so each new row has its own INSERT.
+        self.assertEqual(sum(s.startswith('INSERT INTO events') for s in counter.statements), 2)
+        self.assertEqual([db.session.get(Event, r['id']).title for r in results[:2]], ['Lecture', 'Trip'])
+        self.assertEqual(db.session.get(User, self.user.id).calendar_version, version + 1)
+        self.assertEqual({e.title for e in Event.query.filter_by(user_id=self.user.id)}, {'Lecture', 'Trip'})
+        self.assertEqual({(r.day, r.privacy_level): r.hours for r in DailyBusyHours.query.filter_by(user_id=self.user.id)},
+                         {(key[1], key[2]): hours for key, hours in compute_daily_hours(Event.query).items()
+                          if key[0] == self.user.id})
+        self.assertEqual(EventChange.query.count(), 1 + 5)
+
+        same = {'op': 'create', 'title': 'Same', 'start_time': '2025-05-09T09:00:00', 'end_time': '2025-05-09T10:00:00'}
+        ids = [r['id'] for r in client.post('/api/events/batch', json={'operations': [same] * 3}).get_json()['results']]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(client.post('/api/events/batch', json={'operations': [{'op': 'delete', 'id': 1}] * 501})
+                         .status_code, 400)
+
+    def test_daily_hours_split_across_days(self):
+        """
+        Test that a multi-day event charges each day only for its own hours,
+        clipped to the month window.
+        """
+        self.add_event(datetime(2025, 4, 30, 20, 0), datetime(2025, 5, 2, 6, 0))
+        self.add_event(datetime(2025, 5, 2, 9, 0), datetime(2025, 5, 2, 10, 30))
+        durations = EventRepository(self.user).daily_hours(*month_bounds(datetime(2025, 5, 1).date()))
+        self.assertEqual(durations, {'2025-05-01': 24.0, '2025-05-02': 7.5})
+
+    def test_privacy_level_filter(self):
+        """
+        Test that a repository restricted to 'friends' ignores private events.
+        """
+        self.add_event(datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 10, 0), "private")
+        shared = self.add_event(datetime(2025, 5, 6, 11, 0), datetime(2025, 5, 6, 12, 0), "friends")
+        repository = EventRepository(self.user, privacy_level='friends')
+        self.assertEqual(repository.on_day(datetime(2025, 5, 6).date()), [shared])
+
+    def test_busy_hours_rollup_follows_updates_and_deletes(self):
+        """
+        Test that the daily rollup tracks an event being moved and then deleted,
+        and matches a rebuild from scratch.
+        """
+        event = self.add_event(datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 11, 0))
+        before = snapshot(event)
+        event.start_time = datetime(2025, 5, 6, 10, 0)
+        event.end_time = datetime(2025, 5, 7, 1, 0)
+        record_change(before, snapshot(event))
+        db.session.commit()
+
+        month = month_bounds(datetime(2025, 5, 1).date())
+        self.assertEqual(EventRepository(self.user).daily_hours(*month), {'2025-05-06': 14.0, '2025-05-07': 1.0})
+        stored = {(row.user_id, row.day, row.privacy_level): row.hours for row in DailyBusyHours.query}
+        self.assertEqual(stored, compute_daily_hours(Event.query))
+        rebuild_busy_hours()
+        self.assertEqual(EventRepository(self.user).daily_hours(*month), {'2025-05-06': 14.0, '2025-05-07': 1.0})
+
+        record_change(snapshot(event), None)
+        db.session.delete(event)
+        db.session.commit()
+        self.assertEqual(DailyBusyHours.query.count(), 0)
+
+    def test_sql_aggregation_matches_python(self):
+        """
+        Test that the in-database aggregation agrees with summing hydrated events,
+        including events that cross midnight, with and without a window.
+        """
+        self.add_event(datetime(2025, 4, 30, 20, 0), datetime(2025, 5, 2, 6, 0), "friends")
+        self.add_event(datetime(2025, 5, 2, 9, 0), datetime(2025, 5, 2, 10, 30))
+        self.add_event(datetime(2025, 5, 2, 12, 15), datetime(2025, 5, 2, 13, 0))
+        self.add_event(datetime(2025, 5, 31, 23, 0), datetime(2025, 6, 1, 1, 0))
+        window = month_bounds(datetime(2025, 5, 1).date())
+
+        for args in ((), window):
+            expected = compute_daily_hours(Event.query, *args)
+            actual = aggregate_daily_hours(Event.user_id == self.user.id, window_start=args[0] if args else None,
+                                           window_end=args[1] if args else None)
+            self.assertEqual(actual.keys(), expected.keys())
+            for key, hours in expected.items():
+                self.assertAlmostEqual(actual[key], hours, places=6)
+
+    def test_sql_aggregation_postgresql_dialect(self):
+        """
+        Test that the aggregation expressions compile to PostgreSQL syntax.
+        """
+        sql = str(select(day_of(Event.start_time), hours_between(Event.start_time, Event.end_time))
+                  .compile(dialect=postgresql.dialect()))
+        self.assertIn("CAST(events.start_time AS DATE)", sql)
+        self.assertIn("EXTRACT(EPOCH FROM (events.end_time - events.start_time)) / 3600", sql)
+
+class AvailabilityTests(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up two friends and a stranger, with the first friend logged in.
+        """
+        testApp = create_app(TestConfig)
+        self.app_context = testApp.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = testApp.test_client()
+
+        self.alice, self.bob, self.carol = (
+            User(username=name, email=f"{name}@example.com") for name in ("alice", "bob", "carol")
+        )
+        db.session.add_all([self.alice, self.bob, self.carol])
+        db.session.commit()
+        db.session.add_all([
+            Friendship(user_id=self.alice.id, friend_id=self.bob.id, status='accepted'),
+            Friendship(user_id=self.bob.id, friend_id=self.alice.id, status='accepted'),
+        ])
+        db.session.commit()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.alice.id)
+            sess['_fresh'] = True
+
+    def tearDown(self):
+        """
+        Clean up after each test, including cached analytics for the test users.
+        """
+        for user in (self.alice, self.bob, self.carol):
+            analytics.invalidate(user.id)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_event(self, user, start, end, privacy_level):
+        event = Event(title="Busy", start_time=start, end_time=end, privacy_level=privacy_level,
+                      user_id=user.id, created_by=user.id)
+        db.session.add(event)
+        db.session.flush()
+        record_change(None, snapshot(event))
+        db.session.commit()
+
+    def test_common_free_windows(self):
+        """
+        Test that free windows exclude both users' visible events, ignore the
+        friend's private events, and are snapped to the slot grid and ranked.
+        """
+        self.add_event(self.alice, datetime(2025, 5, 6, 0, 0), datetime(2025, 5, 6, 9, 10), "private")
+        self.add_event(self.bob, datetime(2025, 5, 6, 12, 0), datetime(2025, 5, 6, 13, 0), "friends")
+        self.add_event(self.bob, datetime(2025, 5, 6, 15, 0), datetime(2025, 5, 6, 23, 0), "friends")
+        self.add_event(self.bob, datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 11, 0), "private")
+
+        response = self.client.post('/api/availability', json={
+            'friend_ids': [self.bob.id], 'start': '2025-05-06', 'end': '2025-05-06',
+            'slot_minutes': 30, 'min_minutes': 60
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['windows'], [
+            {'start_time': '2025-05-06T09:30:00', 'end_time': '2025-05-06T12:00:00', 'minutes': 150},
+            {'start_time': '2025-05-06T13:00:00', 'end_time': '2025-05-06T15:00:00', 'minutes': 120},
+            {'start_time': '2025-05-06T23:00:00', 'end_time': '2025-05-07T00:00:00', 'minutes': 60},
+        ])
+
+    def test_rejects_non_friends(self):
+        """
+        Test that only accepted friends can be included in an availability search.
+        """
+        response = self.client.post('/api/availability', json={
+            'friend_ids': [self.carol.id], 'start': '2025-05-06', 'end': '2025-05-06'
+        })
+        self.assertEqual(response.status_code, 403)
+
+    def test_rejects_non_object_body(self):
+        """
+        Test that a JSON body other than an object is a bad request.
+        """
+        for body in ([self.bob.id], 'start', 42):
+            self.assertEqual(self.client.post('/api/availability', json=body).status_code, 400)
+
+    def test_busyness_analytics_cached_and_invalidated(self):
+        """
+        Test the weekly analytics for a friend: only shared events count, the
+        result is cached, and a committed change to the friend's events refreshes it.
+        """
+        day = datetime.combine(datetime.now().date() - timedelta(days=2), datetime.min.time())
+        self.add_event(self.bob, day + timedelta(hours=9), day + timedelta(hours=11), "friends")
+        self.add_event(self.bob, day + timedelta(hours=13), day + timedelta(hours=14), "private")
+
+        response = self.client.get(f'/api/analytics/busyness?user_id={self.bob.id}&weeks=4')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['total_hours'], 2.0)
+        self.assertEqual(data['weekday_hours'][day.weekday()], 2.0)
+        self.assertEqual(data['hour_of_day_hours'][9:11], [1.0, 1.0])
+        self.assertEqual(data['weekly_hours'][-1], 2.0)
+
+        self.add_event(self.bob, day + timedelta(hours=20), day + timedelta(hours=21), "friends")
+        data = self.client.get(f'/api/analytics/busyness?user_id={self.bob.id}&weeks=4').get_json()
+        self.assertEqual(data['total_hours'], 3.0)
+
+        self.assertEqual(self.client.get(f'/api/analytics/busyness?user_id={self.carol.id}').status_code, 403)
+        self.assertEqual(self.client.get('/api/analytics/busyness?weeks=5').status_code, 400)
+
+    def test_former_friend_cannot_revalidate(self):
+        """
+        Test that a friend's calendar ETag stops working once the friendship ends,
+        and that non-friends cannot read the friend calendar API.
+        """
+        etags = {}
+        for url in (f'/api/analytics/busyness?user_id={self.bob.id}', f'/api/friend_calendar/{self.bob.id}'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etags[url] = response.headers['ETag']
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etags[url]}).status_code, 304)
+
+        Friendship.query.delete()
+        db.session.commit()
+        for url, etag in etags.items():
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 403)
+        self.assertEqual(self.client.get(f'/api/friend_calendar/{self.carol.id}').status_code, 403)
+
+    def test_busy_bitmap_operations(self):
+        """
+        Test marking intervals into slot bitmaps, combining them, finding free
+        runs, and summing busy hours per day, weekday and hour of the day.
+        """
+        start = datetime(2025, 5, 5)
+        end = start + timedelta(days=2)
+        first = availability.busy_bitmap([(datetime(2025, 5, 5, 9, 10), datetime(2025, 5, 5, 10, 0))], start, end)
+        second = availability.busy_bitmap([(datetime(2025, 5, 5, 9, 45), datetime(2025, 5, 6, 1, 0))], start, end)
+
+        self.assertEqual(len(first), 192)
+        self.assertEqual(first.sum(), 4)
+        either, both = availability.union([first, second]), availability.intersection([first, second])
+        self.assertEqual(both.sum(), 1)
+        starts, ends = availability.free_runs(either, min_slots=8)
+        self.assertEqual(list(zip(starts, ends)), [(0, 36), (100, 192)])
+        self.assertEqual(list(availability.daily_hours(either)), [15.0, 1.0])
+        self.assertEqual(list(availability.weekday_hours(either, start)), [15.0, 1.0, 0, 0, 0, 0, 0])
+        hours = availability.hour_of_day_hours(either)
+        self.assertEqual((hours[0], hours[8], hours[9], hours[23]), (1.0, 0, 1.0, 1.0))
+
+        inverted = (datetime(2025, 5, 5, 12, 0), datetime(2025, 5, 5, 8, 0))
+        marked = availability.busy_bitmap([inverted, (datetime(2025, 5, 5, 9, 10), datetime(2025, 5, 5, 10, 0))],
+                                          start, end)
+        self.assertTrue((marked == first).all())
+
+class FriendGraphTests(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up a logged-in user with no friends yet.
+        """
+        testApp = create_app(TestConfig)
+        self.app_context = testApp.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = testApp.test_client()
+        self.user = User(username="popular", email="popular@example.com")
+        db.session.add(self.user)
+        db.session.commit()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.user.id)
+            sess['_fresh'] = True
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_relationships(self, count):
+        """
+        Add `count` accepted friends, incoming requests and outgoing requests.
+        """
+        start = User.query.count()
+        others = [User(username=f"user{start + i}", email=f"user{start + i}@example.com") for i in range(3 * count)]
+        db.session.add_all(others)
+        db.session.commit()
+        for i in range(count):
+            friend, incoming, outgoing = others[3 * i:3 * i + 3]
+            db.session.add_all([
+                Friendship(user_id=self.user.id, friend_id=friend.id, status='accepted'),
+                Friendship(user_id=friend.id, friend_id=self.user.id, status='accepted'),
+                Friendship(user_id=incoming.id, friend_id=self.user.id, status='pending'),
+                Friendship(user_id=self.user.id, friend_id=outgoing.id, status='pending'),
+            ])
+        db.session.commit()
+        db.session.expire_all()
+
+    def page_query_counts(self):
+        counts = {}
+        for page in ('/profile', '/visualisation', '/chat'):
+            db.session.expire_all()
+            with QueryCounter() as counter:
+                response = self.client.get(page)
+            self.assertEqual(response.status_code, 200)
+            counts[page] = counter.count
+        return counts
+
+    def test_friend_pages_issue_fixed_number_of_queries(self):
+        """
+        Test that the profile, visualisation and chat pages issue the same small
+        number of SQL statements whether the user has 2 or 50 friends: one to
+        load the logged-in user and one for the friend graph.
+        """
+        self.add_relationships(2)
+        few = self.page_query_counts()
+        self.add_relationships(48)
+        many = self.page_query_counts()
+        self.assertEqual(few, many)
+        self.assertEqual(many, {'/profile': 2, '/visualisation': 2, '/chat': 2})
+
+    def test_friend_graph_contents(self):
+        """
+        Test that the profile page lists friends and both kinds of pending requests.
+        """
+        self.add_relationships(1)
+        graph = load_friend_graph(self.user.id)
+        self.assertEqual([u.username for u in graph.friends], ["user1"])
+        self.assertEqual([u.username for _, u in graph.incoming_pairs], ["user2"])
+        self.assertEqual([u.username for _, u in graph.outgoing_pairs], ["user3"])
+
+class MessageTests(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up two users, with alice logged in.
+        """
+        testApp = create_app(TestConfig)
+        self.app_context = testApp.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.app = testApp
+        self.client = testApp.test_client()
+        self.alice = User(username="alice", email="alice@example.com")
+        self.bob = User(username="bob", email="bob@example.com")
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+        self.alice_id, self.bob_id = self.alice.id, self.bob.id
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.alice_id)
+            sess['_fresh'] = True
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_messages(self, count):
+        """
+        Add `count` more messages, alternating between alice and bob, one minute apart.
+        """
+        offset = Message.query.count()
+        start = datetime(2025, 5, 1, 9, 0)
+        db.session.add_all(
+            Message(
+                sender_id=(self.alice_id, self.bob_id)[i % 2],
+                recipient_id=(self.bob_id, self.alice_id)[i % 2],
+                content=f"message {i}",
+                timestamp=start + timedelta(minutes=i)
+            )
+            for i in range(offset, offset + count)
+        )
+        db.session.commit()
+
+    def history_query_count(self, query=''):
+        db.session.expire_all()
+        with QueryCounter() as counter:
+            response = self.client.get(f'/messages/{self.bob_id}{query}')
+        self.assertEqual(response.status_code, 200)
+        return counter.count, response.get_json()
+
+    def test_history_issues_fixed_number_of_queries(self):
+        """
+        Test that fetching a page of a conversation costs the same number of SQL
+        statements for 4 and 200 messages: the logged-in user, the friend, one
+        range scan per direction of the conversation, with participants joined in,
+        and one read of the archive since the hot messages do not fill the page.
+        """
+        self.add_messages(4)
+        few, _ = self.history_query_count()
+        self.add_messages(196)
+        many, page = self.history_query_count('?limit=1000')
+        self.assertEqual(few, many)
+        self.assertEqual(many, 5)
+        self.assertEqual(len(page['messages']), 200)
+        self.assertEqual(page['messages'][1]['sender_username'], "bob")
+        self.assertEqual(page['messages'][1]['recipient_username'], "alice")
+
+    def test_unarchived_conversation_reads_no_users(self):
+        """
+        Test that reading the archive of a conversation without segments costs a
+        single query, and that the participants are loaded once there are segments.
+        """
+        self.add_messages(4)
+        db.session.expunge_all()
+        with QueryCounter() as counter:
+            self.assertEqual(archived_page(self.alice_id, self.bob_id), [])
+        self.assertEqual(counter.count, 1)
+
+        archive_messages(datetime.now() + timedelta(days=1), segment_size=2)
+        db.session.expunge_all()
+        with QueryCounter() as counter:
+            page = archived_page(self.alice_id, self.bob_id, limit=3)
+        self.assertEqual(counter.count, 2)
+        self.assertEqual([m.content for m in page], ["message 3", "message 2", "message 1"])
+
+    def test_history_pages_with_cursors(self):
+        """
+        Test that the newest page comes first and that the before/after cursors
+        walk the whole conversation without gaps or repeats.
+        """
+        self.add_messages(45)
+        _, page = self.history_query_count('?limit=20')
+        self.assertEqual([m['content'] for m in page['messages']], [f"message {i}" for i in range(25, 45)])
+        self.assertIsNone(page['after'])
+
+        seen = page['messages']
+        while page['before']:
+            _, page = self.history_query_count(f"?limit=20&before={page['before']}")
+            seen = page['messages'] + seen
+        self.assertEqual([m['content'] for m in seen], [f"message {i}" for i in range(45)])
+        self.assertEqual(len(page['messages']), 5)
+
+        _, page = self.history_query_count(f"?limit=30&after={page['after']}")
+        self.assertEqual([m['content'] for m in page['messages']], [f"message {i}" for i in range(5, 35)])
+        self.assertIsNotNone(page['before'])
+
+        response = self.client.get(f'/messages/{self.bob_id}?before=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_reads_through_to_archive(self):
+        """
+        Test that archived messages leave the message table in compressed segments,
+        and that cursors page through the hot and archived messages in both
+        directions without gaps or repeats.
+        """
+        self.add_messages(30)
+        archived = archive_messages(datetime(2025, 5, 1, 9, 20), segment_size=7)
+        self.assertEqual(archived, 20)
+        self.assertEqual(Message.query.count(), 10)
+        self.assertEqual([s.message_count for s in MessageArchive.query.order_by(MessageArchive.first_id)],
+                         [7, 7, 6])
+
+        _, page = self.history_query_count('?limit=8')
+        seen = page['messages']
+        while page['before']:
+            _, page = self.history_query_count(f"?limit=8&before={page['before']}")
+            seen = page['messages'] + seen
+        self.assertEqual([m['content'] for m in seen], [f"message {i}" for i in range(30)])
+        self.assertEqual(seen[1]['sender_username'], "bob")
+
+        seen = page['messages']
+        while page['after']:
+            _, page = self.history_query_count(f"?limit=9&after={page['after']}")
+            seen = seen + page['messages']
+        self.assertEqual([m['content'] for m in seen], [f"message {i}" for i in range(30)])
+
+    def test_history_since_message_id(self):
+        """
+        Test that ?after_id= returns only the messages newer than the given id, in order.
+        """
+        self.add_messages(10)
+        last_seen = max(m.id for m in Message.query)
+        self.add_messages(3)
+        _, page = self.history_query_count(f'?after_id={last_seen}')
+        self.assertEqual([m['content'] for m in page['messages']], ["message 10", "message 11", "message 12"])
+        self.assertIsNone(page['after'])
+
+        _, page = self.history_query_count(f'?after_id={last_seen}&limit=2')
+        self.assertEqual(len(page['messages']), 2)
+        self.assertIsNotNone(page['after'])
+
+        response = self.client.get(f'/messages/{self.bob_id}?after_id=-1')
+        self.assertEqual(response.status_code, 400)
+
+    def socket_as(self, user_id):
+        """
+        Open a Socket.IO test connection logged in as the given user, or anonymous for None.
+        """
+        client = self.app.test_client()
+        if user_id is not None:
+            with client.session_transaction() as sess:
+                sess['_user_id'] = str(user_id)
+        g.pop('_login_user', None)
+        return app_socketio.test_client(self.app, flask_test_client=client)
+
+    def received(self, socket_client, name):
+        return [r['args'][0] for r in socket_client.get_received() if r['name'] == name]
+
+    def test_socket_message_is_stored_and_delivered(self):
+        """
+        Test that a message sent over Socket.IO is stored and delivered to the
+        recipient and to the sender's devices with the shared message shape.
+        """
+        alice_socket = self.socket_as(self.alice_id)
+        bob_socket = self.socket_as(self.bob_id)
+        alice_socket.emit('send_message', {'recipient_id': self.bob_id, 'message': 'hey'})
+        for socket_client in (alice_socket, bob_socket):
+            received = self.received(socket_client, 'receive_message')
+            socket_client.disconnect()
+            self.assertEqual([(m['sender_username'], m['recipient_username'], m['content']) for m in received],
+                             [("alice", "bob", "hey")])
+        self.assertEqual(Message.query.count(), 1)
+
+    def test_socket_ignores_malformed_messages(self):
+        """
+        Test that a message without a valid recipient id or content is dropped without an error.
+        """
+        socket_client = self.socket_as(self.alice_id)
+        for data in ({'message': 'hey'}, {'recipient_id': 'bob', 'message': 'hey'},
+                     {'recipient_id': self.bob_id}, {'recipient_id': self.bob_id, 'message': ['hey']}, 'hey'):
+            socket_client.emit('send_message', data)
+        self.assertEqual(self.received(socket_client, 'receive_message'), [])
+        self.assertTrue(socket_client.is_connected())
+        socket_client.disconnect()
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_presence_is_tracked_and_sent_to_friends_only(self):
+        """
+        Test that friends are told when a user's first connection opens and their
+        last one closes, that others are not, and that messages reach only the
+        sender's and recipient's connections.
+        """
+        carol = User(username="carol", email="carol@example.com")
+        db.session.add(carol)
+        db.session.add_all([
+            Friendship(user_id=self.alice_id, friend_id=self.bob_id, status='accepted'),
+            Friendship(user_id=self.bob_id, friend_id=self.alice_id, status='accepted'),
+        ])
+        db.session.commit()
+        carol_id = carol.id
+
+        alice_socket = self.socket_as(self.alice_id)
+        carol_socket = self.socket_as(carol_id)
+        bob_phone = self.socket_as(self.bob_id)
+        bob_laptop = self.socket_as(self.bob_id)
+        self.assertEqual(self.received(alice_socket, 'presence'), [{'user_id': self.bob_id, 'online': True}])
+        self.assertEqual(self.received(carol_socket, 'presence'), [])
+
+        self.send_as(self.alice_id, self.bob_id, "hi")
+        self.assertEqual(len(self.received(bob_phone, 'receive_message')), 1)
+        self.assertEqual(len(self.received(bob_laptop, 'receive_message')), 1)
+        self.assertEqual(self.received(carol_socket, 'receive_message'), [])
+
+        response = self.client.get(f'/api/presence?ids={self.bob_id},{carol_id}')
+        self.assertEqual(response.get_json(), {'online': {str(self.bob_id): True}})
+        bob_phone.disconnect()
+        self.assertEqual(self.received(alice_socket, 'presence'), [])
+        bob_laptop.disconnect()
+        self.assertEqual(self.received(alice_socket, 'presence'), [{'user_id': self.bob_id, 'online': False}])
+        self.assertEqual(self.client.get('/api/presence').get_json(), {'online': {str(self.bob_id): False}})
+        alice_socket.disconnect()
+        carol_socket.disconnect()
+
+    def test_socket_send_uses_connection_identity_without_selects(self):
+        """
+        Test that the sender is the user logged in when the socket connected, whatever
+        username the client sends, and that once the recipient is cached a message costs
+        one INSERT and no SELECT.
+        """
+        socket_client = self.socket_as(self.alice_id)
+        message = {'recipient_id': self.bob_id, 'username': 'bob', 'message': 'first'}
+        socket_client.emit('send_message', message)
+        with QueryCounter() as counter:
+            socket_client.emit('send_message', dict(message, message='second'))
+        socket_client.disconnect()
+        verbs = [statement.split()[0].upper() for statement in counter.statements]
+        self.assertEqual(verbs.count('INSERT'), 1)
+        self.assertNotIn('SELECT', verbs)
+        self.assertEqual({m.sender_id for m in Message.query}, {self.alice_id})
+
+        anonymous = self.socket_as(None)
+        anonymous.emit('send_message', {'recipient_id': self.bob_id, 'username': 'alice', 'message': 'spoofed'})
+        anonymous.disconnect()
+        self.assertEqual(Message.query.count(), 2)
+
+    def test_search_is_scoped_ranked_and_paginated(self):
+        """
+        Test that search only finds the user's own messages containing every word,
+        best matches first, a page at a time, and follows edits and deletions.
+        """
+        carol = User(username="carol", email="carol@example.com")
+        db.session.add(carol)
+        db.session.commit()
+        carol_id = carol.id
+        self.send_as(self.bob_id, self.alice_id, "lunch tomorrow at noon?")
+        self.send_as(self.alice_id, self.bob_id, "lunch lunch lunch, I am starving")
+        self.send_as(carol_id, self.alice_id, "Lunch with me instead")
+        self.send_as(carol_id, self.bob_id, "secret lunch plans")
+        self.send_as(self.alice_id, self.bob_id, "see you at dinner")
+        self.log_in(self.alice_id)
+
+        page = self.client.get('/messages/search?q=LUNCH').get_json()
+        found = [m['content'] for m in page['messages']]
+        self.assertEqual(found[0], "lunch lunch lunch, I am starving")
+        self.assertEqual(set(found[1:]), {"lunch tomorrow at noon?", "Lunch with me instead"})
+        self.assertIsNone(page['next_offset'])
+
+        page = self.client.get(f'/messages/search?q=lunch&peer_id={self.bob_id}&limit=1').get_json()
+        self.assertEqual([m['content'] for m in page['messages']], ["lunch lunch lunch, I am starving"])
+        page = self.client.get(f"/messages/search?q=lunch&peer_id={self.bob_id}&offset={page['next_offset']}")
+        self.assertEqual([m['content'] for m in page.get_json()['messages']], ["lunch tomorrow at noon?"])
+
+        page = self.client.get('/messages/search?q=lunch noon').get_json()
+        self.assertEqual([m['content'] for m in page['messages']], ["lunch tomorrow at noon?"])
+        page = self.client.get('/messages/search?q=noon" OR "secret').get_json()
+        self.assertEqual(page['messages'], [])
+        self.assertEqual(self.client.get('/messages/search?q=').status_code, 400)
+
+        Message.query.filter_by(content="see you at dinner").update({'content': "lunch after all"})
+        db.session.delete(Message.query.filter_by(content="Lunch with me instead").one())
+        db.session.commit()
+        page = self.client.get('/messages/search?q=lunch').get_json()
+        self.assertEqual(len(page['messages']), 3)
+        self.assertNotIn("Lunch with me instead", [m['content'] for m in page['messages']])
+
+    def test_sent_message_matches_history(self):
+        """
+        Test that sending a message stores it and that it is returned with the shared message shape.
+        """
+        response = self.client.post('/messages/send', json={'recipient_id': self.bob_id, 'content': 'hi'})
+        self.assertEqual(response.status_code, 200)
+        _, page = self.history_query_count()
+        messages = page['messages']
+        self.assertEqual(messages, [response.get_json()['message']])
+        self.assertEqual(set(messages[0]), {'id', 'sender_id', 'sender_username', 'recipient_id',
+                                            'recipient_username', 'content', 'timestamp'})
+        self.assertEqual((messages[0]['sender_username'], messages[0]['content']), ("alice", "hi"))
+
+        response = self.client.post('/messages/send', json={'recipient_id': str(self.bob_id), 'content': 'hi'})
+        self.assertEqual(response.get_json()['message']['recipient_id'], self.bob_id)
+
+        for data in ({'recipient_id': self.bob_id, 'content': {'a': 1}},
+                     {'recipient_id': self.bob_id, 'content': ['x']},
+                     {'recipient_id': self.bob_id, 'content': 123},
+                     {'recipient_id': True, 'content': 'hi'},
+                     {'recipient_id': [self.bob_id], 'content': 'hi'},
+                     {'recipient_id': 'bob', 'content': 'hi'},
+                     ['hi']):
+            self.assertEqual(self.client.post('/messages/send', json=data).status_code, 400)
+        self.assertEqual(Message.query.count(), 2)
+
+    def log_in(self, user_id):
+        """
+        Switch the test client to another user, dropping the user Flask-Login cached in the shared `g`.
+        """
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+        g.pop('_login_user', None)
+
+    def send_as(self, sender_id, recipient_id, content):
+        """
+        Send a message through POST /messages/send as the given user, and return it.
+        """
+        self.log_in(sender_id)
+        response = self.client.post('/messages/send', json={'recipient_id': recipient_id, 'content': content})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['message']
+
+    def test_inbox_tracks_latest_message_and_unread_counts(self):
+        """
+        Test that the inbox lists conversations newest first with their latest message
+        and unread count in a single query, and that marking messages read updates it.
+        """
+        carol = User(username="carol", email="carol@example.com")
+        db.session.add(carol)
+        db.session.commit()
+        carol_id = carol.id
+        first = self.send_as(self.bob_id, self.alice_id, "b1")
+        self.send_as(self.bob_id, self.alice_id, "b2")
+        self.send_as(carol_id, self.alice_id, "c1")
+        self.send_as(self.alice_id, self.bob_id, "a1")
+
+        db.session.expire_all()
+        with QueryCounter() as counter:
+            inbox = self.client.get('/messages/inbox').get_json()['conversations']
+        self.assertEqual(counter.count, 2)
+        self.assertEqual([(c['peer_username'], c['last_message']['content'], c['unread_count']) for c in inbox],
+                         [("bob", "a1", 2), ("carol", "c1", 1)])
+        self.assertEqual(inbox[0]['last_message']['sender_username'], "alice")
+
+        response = self.client.post(f'/messages/{self.bob_id}/read', json={'up_to_id': first['id']})
+        self.assertEqual(response.get_json()['unread_count'], 1)
+        for data in ({'up_to_id': True}, {'up_to_id': '3'}, [first['id']], 0):
+            self.assertEqual(self.client.post(f'/messages/{self.bob_id}/read', json=data).status_code, 400)
+        response = self.client.post(f'/messages/{self.bob_id}/read')
+        self.assertEqual(response.get_json()['unread_count'], 0)
+        db.session.expire_all()
+        self.assertEqual({m.content: m.read for m in Message.query.filter_by(sender_id=self.bob_id)},
+                         {"b1": True, "b2": True})
+
+        self.log_in(self.bob_id)
+        inbox = self.client.get('/messages/inbox').get_json()['conversations']
+        self.assertEqual([(c['peer_username'], c['unread_count']) for c in inbox], [("alice", 1)])
+
+class PresenceRegistryTests(unittest.TestCase):
+    def test_user_is_online_until_last_connection_closes(self):
+        """
+        Test that only the first connection of a user brings them online and only the last one takes them offline.
+        """
+        registry = PresenceRegistry()
+        self.assertTrue(registry.add(1, 'phone'))
+        self.assertFalse(registry.add(1, 'laptop'))
+        self.assertTrue(registry.add(2, 'tablet'))
+        self.assertEqual(registry.online([1, 2, 3]), {1, 2})
+        self.assertIsNone(registry.remove('phone'))
+        self.assertTrue(registry.is_online(1))
+        self.assertEqual(registry.remove('laptop'), 1)
+        self.assertFalse(registry.is_online(1))
+        self.assertIsNone(registry.remove('laptop'))
+
+    def test_presence_is_off_with_several_workers(self):
+        """
+        Test that no registry is kept when a message queue joins several workers.
+        """
+        app = Flask(__name__)
+        self.assertIsInstance(init_presence(app), PresenceRegistry)
+        app.config['SOCKETIO_MESSAGE_QUEUE'] = 'redis://localhost:6379/0'
+        self.assertIsNone(init_presence(app))
+        self.assertIsNone(app.extensions['presence'])
+
+class WriteBehindConfig(TestConfig):
+    CHAT_WRITE_BEHIND = True
+
+class WriteBehindTests(unittest.TestCase):
+    def setUp(self):
+        """
+        Set up two users, with alice logged in and the write-behind pipeline running.
+        """
+        testApp = create_app(WriteBehindConfig)
+        self.app_context = testApp.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.writer = testApp.extensions['message_writer']
+        self.client = testApp.test_client()
+        alice = User(username="alice", email="alice@example.com")
+        bob = User(username="bob", email="bob@example.com")
+        db.session.add_all([alice, bob])
+        db.session.commit()
+        self.alice_id, self.bob_id = alice.id, bob.id
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.alice_id)
+            sess['_fresh'] = True
+
+    def tearDown(self):
+        """
+        Stop the writer and clean up.
+        """
+        self.writer.close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_acknowledged_messages_are_written_in_order(self):
+        """
+        Test that queued messages get the ids they were acknowledged with and
+        read back in order from history once the writer has caught up.
+        """
+        db.session.add(Message(sender_id=self.bob_id, recipient_id=self.alice_id, content="before"))
+        db.session.commit()
+        acks = []
+        for i in range(20):
+            response = self.client.post('/messages/send', json={'recipient_id': self.bob_id, 'content': f"m{i}"})
+            self.assertEqual(response.status_code, 200)
+            acks.append(response.get_json()['message'])
+        self.writer.flush()
+
+        db.session.expire_all()
+        self.assertEqual(Message.query.count(), 21)
+        page = self.client.get(f'/messages/{self.bob_id}').get_json()
+        self.assertEqual(page['messages'][1:], acks)
+        ids = [m['id'] for m in page['messages']]
+        self.assertEqual(ids, sorted(set(ids)))
+
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.bob_id)
+        g.pop('_login_user', None)
+        inbox = self.client.get('/messages/inbox').get_json()['conversations']
+        self.assertEqual((inbox[0]['unread_count'], inbox[0]['last_message']), (20, acks[-1]))
+
+    def test_reserved_blocks_do_not_overlap(self):
+        """
+        Test that id blocks start above existing rows and never overlap.
+        """
+        db.session.add(Message(sender_id=self.bob_id, recipient_id=self.alice_id, content="existing"))
+        db.session.commit()
+        first = reserve_ids(Message, 10)
+        second = reserve_ids(Message, 10)
+        self.assertGreater(first[0], Message.query.one().id)
+        self.assertEqual(second[0], first[-1] + 1)
+
+    def test_full_queue_refuses_every_sender_within_the_timeout(self):
+        """
+        Test that senders waiting behind one another for room in a full queue all
+        give up after about one submit timeout, not one timeout each in turn.
+        """
+        stalled = threading.Event()
+        writer = MessageWriter(self.writer.app, queue_size=1, submit_timeout=0.3)
+        writer._write = lambda batch: stalled.wait(5)
+        row = {'sender_id': self.alice_id, 'recipient_id': self.bob_id, 'content': "hi", 'timestamp': datetime.now()}
+        writer.submit(row)
+        time.sleep(0.1)
+        writer.submit(row)
+
+        outcomes = queue.Queue()
+
+        def send():
+            started = time.monotonic()
+            try:
+                writer.submit(row)
+                outcomes.put(None)
+            except queue.Full:
+                outcomes.put(time.monotonic() - started)
+
+        senders = [threading.Thread(target=send) for _ in range(2)]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        waits = [outcomes.get_nowait() for _ in senders]
+        stalled.set()
+        writer.close()
+        self.assertNotIn(None, waits)
+        self.assertLess(max(waits), 0.5)
+
+    def test_refused_with_several_workers(self):
+        """
+        Test that write-behind does not start when a message queue joins several workers.
+        """
+        class SharedQueueConfig(WriteBehindConfig):
+            SOCKETIO_MESSAGE_QUEUE = 'unix:///tmp/whoisfree-test.sock'
+
+        with self.assertRaises(ValueError):
+            create_app(SharedQueueConfig)
+
+class UnixSocketQueueTests(unittest.TestCase):
+    def setUp(self):
+        """
+        Start a Unix socket broker in a temporary directory.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = 'unix://' + os.path.join(self.directory.name, 'socketio.sock')
+        self.broker = UnixSocketBroker(self.url[len('unix://'):])
+        threading.Thread(target=self.broker.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        """
+        Stop the broker and remove its socket.
+        """
+        self.broker.shutdown()
+        self.broker.server_close()
+        self.directory.cleanup()
+
+    def make_worker(self):
+        """
+        Create a Socket.IO server attached to the broker, recording the emits it receives from other workers.
+        """
+        manager = UnixSocketManager(self.url)
+        server = socketio.Server(client_manager=manager, async_mode='threading')
+        received = queue.Queue()
+        manager._handle_emit = received.put
+        manager.initialize()
+        return server, received
+
+    def test_emits_reach_other_workers_only(self):
+        """
+        Test that an emit in one worker is delivered to the other worker through the
+        broker, and that the sending worker handles it once, locally, with no echo from the broker.
+        """
+        first, first_received = self.make_worker()
+        second, second_received = self.make_worker()
+        deadline = time.time() + 5
+        while len(self.broker._subscribers.get('flask-socketio', ())) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+
+        first.emit('receive_message', {'content': 'hello'}, room='room_2')
+        message = second_received.get(timeout=5)
+        self.assertEqual((message['event'], message['data'], message['room']),
+                         ('receive_message', [{'content': 'hello'}], 'room_2'))
+        self.assertEqual(first_received.get(timeout=1)['room'], 'room_2')
+        with self.assertRaises(queue.Empty):
+            first_received.get(timeout=0.2)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
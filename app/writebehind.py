@@ -0,0 +1,216 @@
+"""
+Write-behind pipeline for chat messages.
+
+With `CHAT_WRITE_BEHIND` enabled, sending a message no longer waits for its own
+commit. The message is given an id from a block reserved in `id_sequences`,
+acknowledged and broadcast at once, and queued for a background writer thread.
+The writer inserts everything that arrived within `CHAT_WRITE_INTERVAL_MS`, up
+to `CHAT_WRITE_BATCH_SIZE` messages, in one transaction. On SQLite, where each
+commit is an fsync, a burst of messages then costs one fsync per batch instead
+of one per message.
+
+The queue holds at most `CHAT_WRITE_QUEUE_SIZE` messages. When it is full,
+senders wait up to `CHAT_WRITE_SUBMIT_TIMEOUT` seconds for room and then get
+`queue.Full`, so a stalled database pushes back on clients instead of growing
+memory. Pending messages are written when the process exits.
+
+The trade-offs: a message shows up in history queries only once its batch
+commits, a few milliseconds after it was acknowledged, and acknowledged
+messages still in the queue are lost if the process is killed.
+
+Clients catch up with `?after_id=`, which relies on ids being committed in
+increasing order. Ids are handed out and queued under one lock, and a single
+thread writes the queue in order, so that holds within a process. It does not
+hold across processes, each drawing ids from its own block: a message with a
+low id from one worker can commit after a higher id from another, and clients
+that already synced past it would never see it. Write-behind is therefore
+refused when `SOCKETIO_MESSAGE_QUEUE` is set, i.e. with several workers.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from . import db
+from .messages import insert_messages
+from .models import IdSequence, Message
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def reserve_ids(model, count):
+    """
+    Reserve `count` consecutive primary keys for `model`'s table.
+
+    The block starts above both the previous reservation and the largest id in
+    the table, and is taken with a single UPDATE, so concurrent processes never
+    receive overlapping blocks. Runs on its own connection and transaction,
+    leaving the session untouched.
+
+    Returns:
+        range: The reserved ids.
+    """
+    name = model.__tablename__
+    floor = select(func.coalesce(func.max(model.id), 0) + 1).scalar_subquery()
+    advance = update(IdSequence).where(IdSequence.name == name).values(
+        next_id=case((IdSequence.next_id > floor, IdSequence.next_id), else_=floor) + count
+    ).returning(IdSequence.next_id)
+    while True:
+        with db.engine.begin() as connection:
+            next_id = connection.execute(advance).scalar()
+        if next_id is not None:
+            return range(next_id - count, next_id)
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(insert(IdSequence).values(name=name, next_id=1))
+        except IntegrityError:
+            pass
+
+
+class MessageWriter:
+    """
+    Background thread writing queued messages in batches, one transaction per batch.
+
+    Attributes:
+        app (Flask): The application whose database the messages are written to.
+        batch_size (int): Most messages written in one transaction.
+        interval (float): Seconds to wait for more messages after the first one of a batch.
+        submit_timeout (float): Seconds `submit` waits for room in a full queue.
+        id_block (int): Number of message ids reserved at a time.
+    """
+
+    def __init__(self, app, batch_size=200, interval=0.005, queue_size=10000, submit_timeout=1.0, id_block=1000):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.submit_timeout = submit_timeout
+        self.id_block = id_block
+        self._queue = queue.Queue(queue_size)
+        self._ids = iter(())
+        self._ids_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _next_id(self):
+        message_id = next(self._ids, None)
+        if message_id is None:
+            self._ids = iter(reserve_ids(Message, self.id_block))
+            message_id = next(self._ids)
+        return message_id
+
+    def submit(self, row):
+        """
+        Give a message row (a dict of `Message` columns) the next id and queue it for writing.
+
+        The id is taken and the row queued under one lock, so rows are queued,
+        and therefore committed, in id order. Waiting for the lock counts towards
+        `submit_timeout`, so senders stuck behind one waiting for room give up
+        within the same time.
+
+        Returns:
+            int: The id of the message.
+
+        Raises:
+            queue.Full: If the queue stays full for `submit_timeout` seconds.
+        """
+        if self._closed:
+            raise RuntimeError('The message writer is closed')
+        deadline = time.monotonic() + self.submit_timeout
+        if not self._ids_lock.acquire(timeout=self.submit_timeout):
+            raise queue.Full
+        try:
+            message_id = self._next_id()
+            self._queue.put(dict(row, id=message_id), timeout=max(deadline - time.monotonic(), 0))
+            return message_id
+        finally:
+            self._ids_lock.release()
+
+    def flush(self):
+        """
+        Block until every message submitted so far has been written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Write the pending messages and stop the writer thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                insert_messages(batch)
+                db.session.commit()
+            except SQLAlchemyError:
+                db.session.rollback()
+                # Write the rows one at a time so that one bad row only loses itself.
+                for row in batch:
+                    try:
+                        insert_messages([row])
+                        db.session.commit()
+                    except SQLAlchemyError:
+                        db.session.rollback()
+                        logger.exception('Dropping chat message %s that could not be written', row.get('id'))
+            finally:
+                db.session.remove()
+
+
+def init_message_writer(app):
+    """
+    Start the write-behind pipeline for `app` if `CHAT_WRITE_BEHIND` is set.
+
+    Raises:
+        ValueError: If `SOCKETIO_MESSAGE_QUEUE` is set too, as message ids would
+            not follow commit order across worker processes.
+    """
+    if not app.config.get('CHAT_WRITE_BEHIND'):
+        return None
+    if app.config.get('SOCKETIO_MESSAGE_QUEUE'):
+        raise ValueError('CHAT_WRITE_BEHIND needs a single worker process; unset SOCKETIO_MESSAGE_QUEUE')
+    writer = MessageWriter(
+        app,
+        batch_size=app.config.get('CHAT_WRITE_BATCH_SIZE', 200),
+        interval=app.config.get('CHAT_WRITE_INTERVAL_MS', 5) / 1000,
+        queue_size=app.config.get('CHAT_WRITE_QUEUE_SIZE', 10000),
+        submit_timeout=app.config.get('CHAT_WRITE_SUBMIT_TIMEOUT', 1.0)
+    )
+    app.extensions['message_writer'] = writer
+    return writer
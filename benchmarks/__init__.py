@@ -0,0 +1,7 @@
+"""
+Benchmarks for the Flask application.
+
+Each module in this package is a standalone script that builds its own throwaway
+SQLite database, so none of them touch `app.db`. Run them from the project root,
+for example `python -m benchmarks.event_queries`.
+"""
@@ -0,0 +1,99 @@
+"""
+Benchmark for the group availability endpoint.
+
+Seeds one user with a set of accepted friends who all have several
+friend-visible events a day, then times `POST /api/availability` across all of
+them over a 30-day range.
+
+Usage:
+    python -m benchmarks.availability [--participants 50] [--days 30] [--events-per-day 6] [--runs 20]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.events import rebuild_busy_hours
+from app.models import User, Event, Friendship
+from benchmarks.common import make_config, percentiles, time_calls
+
+START = datetime(2025, 5, 1)
+
+
+def seed(participants, days, events_per_day):
+    """
+    Create the viewer (user 1) and `participants - 1` friends with busy calendars.
+    """
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'max_event_seconds': 4 * 3600}
+        for i in range(1, participants + 1)
+    ])
+    db.session.execute(insert(Friendship), [
+        {'user_id': a, 'friend_id': b, 'status': 'accepted'}
+        for i in range(2, participants + 1)
+        for a, b in ((1, i), (i, 1))
+    ])
+    rng = random.Random(3403)
+    rows = []
+    for user_id in range(1, participants + 1):
+        for day in range(days):
+            for _ in range(events_per_day):
+                start = START + timedelta(days=day, hours=8, minutes=15 * rng.randrange(40))
+                rows.append({
+                    'title': 'Busy',
+                    'start_time': start,
+                    'end_time': start + timedelta(minutes=15 * rng.randint(1, 8)),
+                    'privacy_level': 'friends',
+                    'user_id': user_id,
+                    'created_by': user_id,
+                })
+    db.session.execute(insert(Event), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--events-per-day', type=int, default=6)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db'), WTF_CSRF_ENABLED=False))
+        with app.app_context():
+            db.create_all()
+            seed(args.participants, args.days, args.events_per_day)
+            rebuild_busy_hours()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = '1'
+            sess['_fresh'] = True
+        body = {
+            'friend_ids': list(range(2, args.participants + 1)),
+            'start': START.strftime('%Y-%m-%d'),
+            'end': (START + timedelta(days=args.days - 1)).strftime('%Y-%m-%d'),
+            'slot_minutes': 15,
+            'min_minutes': 30,
+        }
+
+        def request():
+            response = client.post('/api/availability', json=body)
+            assert response.status_code == 200, response.get_data(as_text=True)
+            return response.get_json()
+
+        windows = len(request()['windows'])
+        p50, p99 = percentiles(time_calls(request, args.runs))
+        print(f'{args.participants} participants, {args.days} days, '
+              f'{args.participants * args.days * args.events_per_day} events: {windows} windows')
+        print(f'POST /api/availability   p50 {p50:.3f} ms   p99 {p99:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark for the NumPy busy-slot bitmaps in `app.availability`.
+
+Generates synthetic calendars in memory and compares the bitmap operations with
+the equivalent pure-Python loops over `datetime` intervals: finding common free
+time across users, and summing busy hours per day and per weekday.
+
+Usage:
+    python -m benchmarks.busy_bitmap [--users 50] [--days 30] [--events-per-day 6] [--runs 20]
+"""
+
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from app import availability
+from app.events import EventSnapshot, compute_daily_hours
+from benchmarks.common import percentiles, time_calls
+
+START = datetime(2025, 5, 5)
+
+
+def make_calendars(users, days, events_per_day):
+    rng = random.Random(3403)
+    calendars = []
+    for _ in range(users):
+        intervals = []
+        for day in range(days):
+            for _ in range(events_per_day):
+                start = START + timedelta(days=day, hours=8, minutes=15 * rng.randrange(40))
+                intervals.append((start, start + timedelta(minutes=15 * rng.randint(1, 8))))
+        calendars.append(intervals)
+    return calendars
+
+
+def python_free_windows(calendars, window_start, window_end, slot, min_length):
+    """
+    Sweep-line baseline: merge every interval in start order and walk the gaps.
+    """
+    merged = []
+    for start, end in sorted(interval for intervals in calendars for interval in intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    windows = []
+    cursor = window_start
+    for start, end in merged + [[window_end, window_end]]:
+        free_start = window_start + -((window_start - cursor) // slot) * slot
+        free_end = window_start + ((start - window_start) // slot) * slot
+        if free_end - free_start >= min_length:
+            windows.append((free_start, free_end))
+        cursor = max(cursor, end)
+    windows.sort(key=lambda w: (w[0] - w[1], w[0]))
+    return windows
+
+
+def bitmap_free_windows(calendars, window_start, window_end, slot, min_length):
+    bitmaps = [availability.busy_bitmap(intervals, window_start, window_end, slot) for intervals in calendars]
+    starts, ends = availability.free_runs(availability.union(bitmaps), -(-min_length // slot))
+    return list(zip(starts, ends))
+
+
+def python_weekday_hours(intervals, window_start, window_end):
+    snapshots = [EventSnapshot(None, 1, start, end, 'private') for start, end in intervals]
+    weekdays = [0.0] * 7
+    for (_, day, _), hours in compute_daily_hours(snapshots, window_start, window_end).items():
+        weekdays[day.weekday()] += hours
+    return weekdays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--events-per-day', type=int, default=6)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    calendars = make_calendars(args.users, args.days, args.events_per_day)
+    window = (START, START + timedelta(days=args.days))
+    slot = availability.SLOT
+    one_user = calendars[0]
+
+    bitmaps = [availability.busy_bitmap(intervals, *window, slot) for intervals in calendars]
+
+    cases = [
+        ('common free time, Python sweep',
+         lambda: python_free_windows(calendars, *window, slot, timedelta(minutes=30))),
+        ('common free time, bitmaps',
+         lambda: bitmap_free_windows(calendars, *window, slot, timedelta(minutes=30))),
+        ('  union + free runs only',
+         lambda: availability.free_runs(availability.union(bitmaps), 2)),
+        ('hours per day, Python loop',
+         lambda: compute_daily_hours([EventSnapshot(None, 1, s, e, 'private') for s, e in one_user], *window)),
+        ('hours per day, bitmap',
+         lambda: availability.daily_hours(availability.busy_bitmap(one_user, *window))),
+        ('hours per weekday, Python loop',
+         lambda: python_weekday_hours(one_user, *window)),
+        ('hours per weekday, bitmap',
+         lambda: availability.weekday_hours(availability.busy_bitmap(one_user, *window), window[0])),
+    ]
+    print(f'{args.users} users, {args.days} days, {args.events_per_day} events per user per day')
+    for name, fn in cases:
+        p50, p99 = percentiles(time_calls(fn, args.runs))
+        print(f'{name:<34} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
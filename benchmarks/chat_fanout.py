@@ -0,0 +1,173 @@
+"""
+Load test for chat delivery across several Socket.IO worker processes.
+
+For each worker count, starts a `unix://` Socket.IO broker and that many app
+processes sharing one SQLite database, each serving on its own port. Receivers
+connect, logged in, with Socket.IO clients spread over the workers, and sender processes
+POST to `/messages/send` on workers chosen so that most messages must cross
+the broker to reach their receiver. Prints the send throughput and the
+end-to-end delivery throughput, and checks that every message was delivered.
+
+Usage:
+    python -m benchmarks.chat_fanout [--workers 1 2 4] [--senders 8] [--messages 2000]
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+
+import flask.cli
+import socketio
+from sqlalchemy import insert, text
+
+from app import create_app, db, socketio as app_socketio
+from app.models import Friendship, User
+from app.pubsub import UnixSocketBroker
+from benchmarks.common import make_config, wait_for_port
+
+BASE_PORT = 5200
+
+
+def bench_config(db_path, queue_url):
+    return make_config(
+        db_path,
+        WTF_CSRF_ENABLED=False,
+        SOCKETIO_MESSAGE_QUEUE=queue_url,
+        SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}},
+    )
+
+
+def seed(n_pairs):
+    """
+    Create `n_pairs` pairs of friends: user 2i - 1 sends to user 2i.
+    """
+    db.session.execute(text('PRAGMA journal_mode=WAL'))
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com'}
+        for i in range(1, 2 * n_pairs + 1)
+    ])
+    db.session.execute(insert(Friendship), [
+        {'user_id': a, 'friend_id': b, 'status': 'accepted'}
+        for i in range(1, n_pairs + 1)
+        for a, b in ((2 * i - 1, 2 * i), (2 * i, 2 * i - 1))
+    ])
+    db.session.commit()
+
+
+def run_worker(db_path, queue_url, port):
+    logging.getLogger('werkzeug').disabled = True
+    flask.cli.show_server_banner = lambda *args: None
+    app = create_app(bench_config(db_path, queue_url))
+    app_socketio.run(app, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+
+def run_sender(port, cookie, recipient_id, count, start_event):
+    start_event.wait()
+    body = json.dumps({'recipient_id': recipient_id, 'content': 'load test'}).encode()
+    for _ in range(count):
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{port}/messages/send', data=body,
+            headers={'Content-Type': 'application/json', 'Cookie': cookie}
+        )
+        urllib.request.urlopen(request).read()
+
+
+def run_case(n_workers, n_senders, n_messages):
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'chat.db')
+    queue_url = 'unix://' + os.path.join(directory, 'socketio.sock')
+    app = create_app(bench_config(db_path, queue_url))
+    with app.app_context():
+        db.create_all()
+        seed(n_senders)
+    serializer = app.session_interface.get_signing_serializer(app)
+
+    broker = UnixSocketBroker(queue_url[len('unix://'):])
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(target=run_worker, args=(db_path, queue_url, BASE_PORT + i), daemon=True)
+        for i in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    clients = []
+    try:
+        for i in range(n_workers):
+            wait_for_port(BASE_PORT + i)
+
+        per_sender = n_messages // n_senders
+        expected = per_sender * n_senders
+        delivered = [0]
+        lock = threading.Lock()
+        all_delivered = threading.Event()
+
+        def on_message(data):
+            with lock:
+                delivered[0] += 1
+                if delivered[0] == expected:
+                    all_delivered.set()
+
+        for i in range(1, n_senders + 1):
+            client = socketio.Client()
+            client.on('receive_message', on_message)
+            cookie = 'session=' + serializer.dumps({'_user_id': str(2 * i), '_fresh': True})
+            client.connect(f'http://127.0.0.1:{BASE_PORT + i % n_workers}', headers={'Cookie': cookie},
+                           transports=['websocket'])
+            clients.append(client)
+        time.sleep(0.5)
+
+        start_event = context.Event()
+        senders = []
+        for i in range(1, n_senders + 1):
+            cookie = 'session=' + serializer.dumps({'_user_id': str(2 * i - 1), '_fresh': True})
+            port = BASE_PORT + (i + 1) % n_workers
+            senders.append(context.Process(
+                target=run_sender, args=(port, cookie, 2 * i, per_sender, start_event)
+            ))
+        for sender in senders:
+            sender.start()
+        time.sleep(0.5)
+
+        started = time.perf_counter()
+        start_event.set()
+        for sender in senders:
+            sender.join()
+        sent = time.perf_counter() - started
+        all_delivered.wait(timeout=60)
+        finished = time.perf_counter() - started
+        return expected, delivered[0], expected / sent, delivered[0] / finished
+    finally:
+        for client in clients:
+            client.disconnect()
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        broker.shutdown()
+        broker.server_close()
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f'{args.senders} senders, {args.messages} messages, {os.cpu_count()} CPUs')
+    for n_workers in args.workers:
+        expected, delivered, send_rate, delivery_rate = run_case(n_workers, args.senders, args.messages)
+        print(f'{n_workers} workers: sent {send_rate:8.1f} msg/s   delivered {delivered}/{expected} '
+              f'at {delivery_rate:8.1f} msg/s')
+
+
+if __name__ == '__main__':
+    main()
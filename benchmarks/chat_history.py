@@ -0,0 +1,132 @@
+"""
+Benchmark for loading and serializing chat history.
+
+Seeds a temporary SQLite database with one long conversation between two users
+and with messages sent to the first user by many other users, then serializes
+both with `serialize_message`: once relying on lazy loads of `Message.sender`
+and `Message.recipient`, and once with the participants joined in by
+`app.messages.with_participants`. It then times reading only the newest page and
+an old page of the conversation with `conversation_page`. Every run starts from
+an empty session, as a new request would. For each case the number of SQL
+statements and the p50/p99 latencies are printed.
+
+Usage:
+    python -m benchmarks.chat_history [--messages 5000] [--senders 500] [--runs 20]
+"""
+
+import argparse
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert
+
+from app import create_app, db
+from app.messages import conversation_page, serialize_message, with_participants
+from app.models import Message, User
+from benchmarks.common import make_config, percentiles, time_calls
+
+START = datetime(2025, 1, 1)
+
+
+def seed(n_messages, n_senders):
+    """
+    Insert a conversation of `n_messages` between users 1 and 2, and one message
+    to user 1 from each of `n_senders` other users.
+    """
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com'}
+        for i in range(1, n_senders + 3)
+    ])
+    rows = [
+        {'sender_id': 1 + i % 2, 'recipient_id': 2 - i % 2, 'content': f'Message {i}',
+         'timestamp': START + timedelta(seconds=i)}
+        for i in range(n_messages)
+    ]
+    rows += [
+        {'sender_id': sender_id, 'recipient_id': 1, 'content': f'Hello from {sender_id}',
+         'timestamp': START + timedelta(seconds=n_messages + sender_id)}
+        for sender_id in range(3, n_senders + 3)
+    ]
+    db.session.execute(insert(Message), rows)
+    db.session.commit()
+
+
+def serialize(query):
+    """
+    Serialize every message of `query` from an empty session, as a request would.
+    """
+    db.session.remove()
+    return [serialize_message(message) for message in query().order_by(Message.timestamp)]
+
+
+def conversation():
+    return Message.query.filter(
+        ((Message.sender_id == 1) & (Message.recipient_id == 2)) |
+        ((Message.sender_id == 2) & (Message.recipient_id == 1))
+    )
+
+
+def serialize_page(before=None):
+    db.session.remove()
+    messages, _ = conversation_page(1, 2, before=before)
+    return [serialize_message(message) for message in messages]
+
+
+def count_statements(fn):
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--senders', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_app(make_config(path))
+        with app.app_context():
+            db.create_all()
+            seed(args.messages, args.senders)
+
+            middle = conversation().order_by(Message.timestamp).offset(args.messages // 2).first()
+            middle_cursor = (middle.timestamp, middle.id)
+
+            cases = [
+                ('conversation, lazy loads',
+                 lambda: serialize(conversation)),
+                ('conversation, joined',
+                 lambda: serialize(lambda: with_participants(conversation()))),
+                ('newest page',
+                 lambda: serialize_page()),
+                ('page from the middle',
+                 lambda: serialize_page(middle_cursor)),
+                ('many senders, lazy loads',
+                 lambda: serialize(lambda: Message.query.filter(Message.sender_id > 2))),
+                ('many senders, joined',
+                 lambda: serialize(lambda: with_participants(Message.query).filter(Message.sender_id > 2))),
+            ]
+            print(f'{args.messages} messages in one conversation, {args.senders} other senders')
+            for name, fn in cases:
+                statements = count_statements(fn)
+                p50, p99 = percentiles(time_calls(fn, args.runs))
+                print(f'{name:<28} {statements:6d} statements   p50 {p50:9.2f} ms   p99 {p99:9.2f} ms')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Load test for the real-time chat path.
+
+For each requested `SOCKETIO_ASYNC_MODE`, seeds a temporary SQLite database,
+starts the app on a spare port in a separate process, and opens N logged-in
+`python-socketio` clients, paired up as friends. An open-loop scheduler has
+every client send `send_message` events to its partner at `--rate` messages per
+second for `--duration` seconds, while `--churners` extra clients, friends of
+the senders, keep disconnecting and reconnecting at `--churn` per second to
+exercise the connect, disconnect and presence events. Each message carries its
+send time, so the receiving client measures the end-to-end delivery latency.
+
+Prints, per mode, the messages delivered and lost, the delivered messages per
+second, the p50/p95/p99/max latency, and the server's resident memory and
+thread count when idle, connected and at the end of the run. Extra settings
+for the server, e.g. `--server-env CHAT_WRITE_BEHIND=1`, allow comparing
+changes to the send path. Modes whose library is not installed are skipped.
+
+Usage:
+    python -m benchmarks.chat_load [--modes threading gevent] [--clients 100] [--rate 1]
+        [--duration 20] [--churners 10] [--churn 5] [--server-env KEY=VALUE ...]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import socketio
+from sqlalchemy import insert, text
+
+from app import create_app, db
+from app.models import Friendship, User
+from benchmarks.common import make_config, process_status, wait_for_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 5400
+
+# Run in the server process: patch the standard library for the cooperative
+# modes before anything else is imported, as wsgi.py does.
+SERVER = '''
+import logging, os, sys
+mode = os.environ['SOCKETIO_ASYNC_MODE']
+if mode == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif mode == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+import flask.cli
+from app import create_app, socketio
+from benchmarks.common import make_config
+logging.getLogger('werkzeug').disabled = True
+flask.cli.show_server_banner = lambda *args: None
+app = create_app(make_config(sys.argv[1], SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}}))
+socketio.run(app, host='127.0.0.1', port=int(sys.argv[2]), allow_unsafe_werkzeug=mode == 'threading',
+             log_output=False)
+'''
+
+
+def seed(n_clients, n_churners):
+    """
+    Create `n_clients` users paired as friends (2i - 1 and 2i), and `n_churners`
+    more users, each a friend of one of the first ones.
+    """
+    db.session.execute(text('PRAGMA journal_mode=WAL'))
+    total = n_clients + n_churners
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com'}
+        for i in range(1, total + 1)
+    ])
+    pairs = [(2 * i - 1, 2 * i) for i in range(1, n_clients // 2 + 1)]
+    pairs += [(n_clients + i, (i - 1) % n_clients + 1) for i in range(1, n_churners + 1)]
+    db.session.execute(insert(Friendship), [
+        {'user_id': a, 'friend_id': b, 'status': 'accepted'}
+        for pair in pairs
+        for a, b in (pair, pair[::-1])
+    ])
+    db.session.commit()
+
+
+class LoadClient:
+    """
+    A logged-in Socket.IO client recording the latency of the messages addressed to its user.
+    """
+
+    def __init__(self, url, user_id, cookie, results):
+        self.url = url
+        self.user_id = user_id
+        self.cookie = cookie
+        self.results = results
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('receive_message', self.on_message)
+
+    def connect(self):
+        self.sio.connect(self.url, headers={'Cookie': self.cookie}, transports=['websocket'], wait_timeout=30)
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+    def send(self, recipient_id):
+        self.sio.emit('send_message', {'recipient_id': recipient_id, 'message': repr(time.perf_counter())})
+
+    def on_message(self, message):
+        if message['recipient_id'] == self.user_id:
+            self.results.record((time.perf_counter() - float(message['content'])) * 1000)
+
+
+class Results:
+    """
+    Delivery latencies in milliseconds, and the time the last message arrived.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.last_delivery = None
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.last_delivery = time.perf_counter()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.latencies)
+
+
+def churn(clients, rate, stop):
+    """
+    Disconnect and reconnect random clients `rate` times per second until `stop` is set.
+    """
+    rng = random.Random(5)
+    while not stop.wait(1 / rate):
+        client = rng.choice(clients)
+        client.disconnect()
+        client.connect()
+
+
+def sample_memory(pid, peak, stop):
+    while not stop.wait(0.2):
+        rss, threads = process_status(pid)
+        peak[0] = max(peak[0], rss)
+        peak[1] = max(peak[1], threads)
+
+
+def run_mode(mode, args):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'chat.db')
+        app = create_app(make_config(db_path))
+        with app.app_context():
+            db.create_all()
+            seed(args.clients, args.churners)
+        serializer = app.session_interface.get_signing_serializer(app)
+
+        env = dict(os.environ, SOCKETIO_ASYNC_MODE=mode, SECRET_KEY='benchmark')
+        env.update(setting.split('=', 1) for setting in args.server_env)
+        server = subprocess.Popen(
+            [sys.executable, '-c', SERVER, db_path, str(PORT)], cwd=ROOT, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        results = Results()
+        url = f'http://127.0.0.1:{PORT}'
+
+        def client(user_id):
+            cookie = 'session=' + serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+            return LoadClient(url, user_id, cookie, results)
+
+        senders = [client(user_id) for user_id in range(1, args.clients + 1)]
+        churners = [client(args.clients + i) for i in range(1, args.churners + 1)]
+        stop = threading.Event()
+        try:
+            wait_for_port(PORT)
+            idle = process_status(server.pid)
+            for load_client in senders + churners:
+                load_client.connect()
+            time.sleep(1)
+            connected = process_status(server.pid)
+            peak = list(connected)
+            threads = [threading.Thread(target=sample_memory, args=(server.pid, peak, stop), daemon=True)]
+            if churners and args.churn > 0:
+                threads.append(threading.Thread(target=churn, args=(churners, args.churn, stop), daemon=True))
+            for thread in threads:
+                thread.start()
+
+            total = int(args.clients * args.rate * args.duration)
+            interval = 1 / (args.clients * args.rate)
+            started = time.perf_counter()
+            for k in range(total):
+                delay = started + k * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sender = senders[k % args.clients]
+                sender.send(sender.user_id + 1 if sender.user_id % 2 else sender.user_id - 1)
+            deadline = time.perf_counter() + args.drain
+            while len(results) < total and time.perf_counter() < deadline:
+                time.sleep(0.05)
+            stop.set()
+            finished = process_status(server.pid)
+        finally:
+            stop.set()
+            for load_client in senders + churners:
+                if load_client.sio.connected:
+                    load_client.disconnect()
+            server.terminate()
+            server.wait()
+
+        elapsed = (results.last_delivery or time.perf_counter()) - started
+        return {
+            'sent': total, 'delivered': len(results.latencies), 'rate': len(results.latencies) / elapsed,
+            'latencies': results.latencies, 'idle': idle, 'connected': connected, 'peak': peak,
+            'finished': finished,
+        }
+
+
+def report(mode, result):
+    latencies = sorted(result['latencies'])
+    print(f'== {mode} ==')
+    print(f"delivered {result['delivered']}/{result['sent']} "
+          f"({result['sent'] - result['delivered']} lost) at {result['rate']:.1f} msg/s")
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        print(f'latency p50 {statistics.median(latencies):8.2f} ms   p95 {cuts[94]:8.2f} ms   '
+              f'p99 {cuts[98]:8.2f} ms   max {latencies[-1]:8.2f} ms')
+    for label in ('idle', 'connected', 'peak', 'finished'):
+        rss, threads = result[label]
+        print(f'server {label:<10} RSS {rss / 1024:7.1f} MiB   threads {threads:5d}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['threading', 'gevent'])
+    parser.add_argument('--clients', type=int, default=100, help='messaging clients, paired up (even number)')
+    parser.add_argument('--rate', type=float, default=1.0, help='messages per second sent by each client')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of sending')
+    parser.add_argument('--churners', type=int, default=10, help='extra clients that reconnect in a loop')
+    parser.add_argument('--churn', type=float, default=5.0, help='reconnections per second')
+    parser.add_argument('--drain', type=float, default=30.0, help='seconds to wait for late deliveries')
+    parser.add_argument('--server-env', nargs='*', default=[], metavar='KEY=VALUE',
+                        help='extra environment variables for the server, e.g. CHAT_WRITE_BEHIND=1')
+    args = parser.parse_args()
+    if args.clients < 2 or args.clients % 2:
+        parser.error('--clients must be an even number of at least 2')
+
+    print(f'{args.clients} clients at {args.rate} msg/s each for {args.duration} s, '
+          f'{args.churners} churners at {args.churn}/s, {os.cpu_count()} CPUs')
+    for mode in args.modes:
+        if mode != 'threading' and importlib.util.find_spec(mode) is None:
+            print(f'== {mode} ==\nskipped: {mode} is not installed')
+            continue
+        report(mode, run_mode(mode, args))
+
+
+if __name__ == '__main__':
+    main()
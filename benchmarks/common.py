@@ -0,0 +1,64 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+
+import socket
+import statistics
+import time
+
+from app.config import Config
+
+
+def make_config(path, **overrides):
+    """
+    Build a configuration class pointing at a throwaway SQLite file.
+
+    Any keyword arguments are set as extra configuration attributes.
+    """
+    attributes = {'SECRET_KEY': 'benchmark', 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path}
+    attributes.update(overrides)
+    return type('BenchmarkConfig', (Config,), attributes)
+
+
+def percentiles(timings):
+    """
+    Return the (p50, p99) of a list of timings.
+    """
+    return statistics.median(timings), statistics.quantiles(timings, n=100, method='inclusive')[98]
+
+
+def time_calls(fn, runs):
+    """
+    Call `fn` `runs` times and return the per-call timings in milliseconds.
+    """
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def process_status(pid):
+    """
+    Return the resident memory in KiB and the number of threads of a process.
+    """
+    fields = {}
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            key, _, value = line.partition(':')
+            fields[key] = value.split()
+    return int(fields['VmRSS'][0]), int(fields['Threads'][0])
+
+
+def wait_for_port(port, timeout=30):
+    """
+    Wait until a server accepts connections on a local port.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as probe:
+            if probe.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f'Server on port {port} did not start')
@@ -0,0 +1,93 @@
+"""
+Micro-benchmark for computing a month of per-day busy hours.
+
+Compares three ways of building a heatmap for one user with many events per month:
+hydrating every `Event` through the ORM and summing in Python, summing in the
+database with `aggregate_daily_hours`, and reading the `daily_busy_hours` rollup.
+
+Usage:
+    python -m benchmarks.duration_aggregation [--events-per-month 10000] [--users 5] [--runs 20]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.events import EventRepository, aggregate_daily_hours, compute_daily_hours, month_bounds, rebuild_busy_hours
+from app.models import User, Event
+from benchmarks.common import make_config, percentiles, time_calls
+
+MONTH = datetime(2025, 5, 1)
+
+
+def seed(n_users, events_per_month):
+    """
+    Give every user `events_per_month` events in the benchmark month and its neighbours.
+    """
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'max_event_seconds': 3 * 86400}
+        for i in range(1, n_users + 1)
+    ])
+    rng = random.Random(3403)
+    rows = []
+    for user_id in range(1, n_users + 1):
+        for _ in range(3 * events_per_month):
+            start = MONTH - timedelta(days=31) + timedelta(minutes=15 * rng.randrange(92 * 96))
+            length = timedelta(minutes=15 * rng.randint(1, 16))
+            if rng.random() < 0.01:
+                length = timedelta(hours=rng.randint(12, 72))
+            rows.append({
+                'title': 'Event',
+                'start_time': start,
+                'end_time': start + length,
+                'privacy_level': rng.choice(('private', 'friends')),
+                'user_id': user_id,
+                'created_by': user_id,
+            })
+    db.session.execute(insert(Event), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events-per-month', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db')))
+        with app.app_context():
+            db.create_all()
+            seed(args.users, args.events_per_month)
+            rebuild_busy_hours()
+            user = db.session.get(User, 1)
+            window = month_bounds(MONTH.date())
+            repository = EventRepository(user)
+
+            def orm_hydration():
+                db.session.expire_all()
+                return compute_daily_hours(repository.overlapping(*window), *window)
+
+            def sql_aggregation():
+                return aggregate_daily_hours(Event.user_id == user.id, window_start=window[0], window_end=window[1])
+
+            def rollup_read():
+                return repository.daily_hours(*window)
+
+            print(f'{args.events_per_month} events per month, {args.runs} runs each')
+            for name, fn in (('ORM hydration', orm_hydration),
+                             ('SQL aggregation', sql_aggregation),
+                             ('daily_busy_hours rollup', rollup_read)):
+                rows = len(fn())
+                p50, p99 = percentiles(time_calls(fn, args.runs))
+                print(f'{name:<26} {rows:>3} rows   p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark for importing a timetable of calendar events.
+
+Creates `--events` weekly timetable entries for one user on a temporary SQLite
+database, twice: one `EventForm` POST to `/dashboard` per event, as the
+dashboard does, and `POST /api/events/batch` requests of up to
+`MAX_BATCH_OPERATIONS` events each. Then deletes them all, once with one
+`DELETE /api/events/<id>` per event and once in batches. Prints the total time
+of each and the events per second.
+
+Usage:
+    python -m benchmarks.event_batch [--events 2000]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.batch import MAX_BATCH_OPERATIONS
+from app.models import Event, User
+from benchmarks.common import make_config
+
+START = datetime(2025, 2, 24, 8, 0)
+
+
+def timetable(count):
+    """
+    Return `count` one-hour entries spread over the weekday slots of consecutive weeks.
+    """
+    entries = []
+    for i in range(count):
+        week, slot = divmod(i, 50)
+        day, hour = divmod(slot, 10)
+        start = START + timedelta(weeks=week, days=day, hours=hour)
+        entries.append({'title': f'Lecture {slot}', 'start_time': start, 'end_time': start + timedelta(hours=1),
+                        'privacy_level': 'friends'})
+    return entries
+
+
+def timed(label, count, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f'{label:<40} {elapsed * 1000:10.1f} ms   {count / elapsed:9.1f} events/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    args = parser.parse_args()
+
+    entries = timetable(args.events)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db'), WTF_CSRF_ENABLED=False))
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(User), [{'id': 1, 'username': 'user1', 'email': 'user1@example.com'}])
+            db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = '1'
+            sess['_fresh'] = True
+
+        def event_ids():
+            with app.app_context():
+                return [event_id for (event_id,) in db.session.query(Event.id).order_by(Event.id)]
+
+        def post(path, **kwargs):
+            response = client.post(path, **kwargs)
+            assert response.status_code in (200, 302), response.get_data(as_text=True)
+
+        def batches(operations):
+            for first in range(0, len(operations), MAX_BATCH_OPERATIONS):
+                post('/api/events/batch', json={'operations': operations[first:first + MAX_BATCH_OPERATIONS]})
+
+        def create_one_by_one():
+            for entry in entries:
+                post('/dashboard', data=dict(entry, start_time=entry['start_time'].strftime('%Y-%m-%dT%H:%M'),
+                                             end_time=entry['end_time'].strftime('%Y-%m-%dT%H:%M')))
+
+        def delete_one_by_one():
+            # delete_event prints a line per event.
+            with contextlib.redirect_stdout(io.StringIO()):
+                for event_id in event_ids():
+                    assert client.delete(f'/api/events/{event_id}').status_code == 200
+
+        print(f'{args.events} timetable entries, batches of {MAX_BATCH_OPERATIONS}')
+        timed('create: POST /dashboard per event', args.events, create_one_by_one)
+        timed('delete: DELETE /api/events/<id> per event', args.events, delete_one_by_one)
+        timed('create: POST /api/events/batch', args.events, lambda: batches([
+            dict(entry, op='create', start_time=entry['start_time'].isoformat(),
+                 end_time=entry['end_time'].isoformat()) for entry in entries
+        ]))
+        timed('delete: POST /api/events/batch', args.events,
+              lambda: batches([{'op': 'delete', 'id': event_id} for event_id in event_ids()]))
+
+
+if __name__ == '__main__':
+    main()
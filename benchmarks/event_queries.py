@@ -0,0 +1,130 @@
+"""
+Benchmark for the calendar time-range queries on the `events` table.
+
+Seeds a temporary SQLite database with synthetic events, then times the queries
+issued by `dashboard`, `get_events_by_date`, `get_events`, `api_event_durations`
+and `friend_calendar`, first without and then with the composite indexes
+declared on `Event`. For each query the SQLite query plan and the p50/p99
+latencies are printed.
+
+Usage:
+    python -m benchmarks.event_queries [--events 1000000] [--users 1000] [--runs 200]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from app import create_app, db
+from app.models import User, Event
+from benchmarks.common import make_config, percentiles, time_calls
+
+SEED_START = datetime(2025, 1, 1)
+SEED_DAYS = 365
+
+
+def seed(n_events, n_users, batch_size=50000):
+    """
+    Insert `n_users` users and `n_events` events spread evenly over a year.
+    """
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com'}
+        for i in range(1, n_users + 1)
+    ])
+    rng = random.Random(3403)
+    rows = []
+    for i in range(n_events):
+        start = SEED_START + timedelta(minutes=15 * rng.randrange(SEED_DAYS * 96))
+        user_id = rng.randint(1, n_users)
+        rows.append({
+            'title': f'Event {i}',
+            'start_time': start,
+            'end_time': start + timedelta(minutes=15 * rng.randint(1, 16)),
+            'privacy_level': rng.choice(('private', 'friends')),
+            'user_id': user_id,
+            'created_by': user_id,
+        })
+        if len(rows) == batch_size:
+            db.session.execute(insert(Event), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(Event), rows)
+    db.session.commit()
+
+
+def queries():
+    """
+    The range queries issued by the calendar endpoints, as (label, sql) pairs.
+    """
+    day = "start_time >= :day_start AND start_time <= :day_end"
+    month = "start_time >= :month_start AND start_time <= :month_end"
+    return [
+        ('day (dashboard, get_events, get_events_by_date)',
+         f"SELECT * FROM events WHERE user_id = :uid AND {day} ORDER BY start_time"),
+        ('month (dashboard, api_event_durations)',
+         f"SELECT * FROM events WHERE user_id = :uid AND {month} ORDER BY start_time"),
+        ('friend month (friend_calendar)',
+         f"SELECT * FROM events WHERE user_id = :uid AND privacy_level = 'friends' AND {month}"),
+    ]
+
+
+def random_params(rng, n_users):
+    day = SEED_START + timedelta(days=rng.randrange(SEED_DAYS))
+    month_start = day.replace(day=1)
+    month_end = (month_start + timedelta(days=31)).replace(day=1) - timedelta(seconds=1)
+    return {
+        'uid': rng.randint(1, n_users),
+        'day_start': day,
+        'day_end': day + timedelta(days=1) - timedelta(microseconds=1),
+        'month_start': month_start,
+        'month_end': month_end,
+    }
+
+
+def run(label, n_users, runs):
+    print(f'\n== {label} ==')
+    rng = random.Random(91)
+    for name, sql in queries():
+        params = random_params(rng, n_users)
+        plan = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), params).all()
+        timings = time_calls(lambda: db.session.execute(text(sql), random_params(rng, n_users)).all(), runs)
+        p50, p99 = percentiles(timings)
+        print(f'{name}')
+        print('  plan: ' + '; '.join(row[-1] for row in plan))
+        print(f'  p50 {p50:.3f} ms   p99 {p99:.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db')))
+        with app.app_context():
+            db.create_all()
+            indexes = list(Event.__table__.indexes)
+            for index in indexes:
+                index.drop(db.engine)
+
+            started = time.perf_counter()
+            seed(args.events, args.users)
+            print(f'Seeded {args.events} events for {args.users} users '
+                  f'in {time.perf_counter() - started:.1f} s')
+
+            run('without indexes', args.users, args.runs)
+            for index in indexes:
+                index.create(db.engine)
+            db.session.execute(text('ANALYZE'))
+            run('with composite indexes', args.users, args.runs)
+
+
+if __name__ == '__main__':
+    main()
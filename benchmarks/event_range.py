@@ -0,0 +1,104 @@
+"""
+Benchmark for loading a month of calendar events.
+
+Seeds one user with several events a day over a year, then times what the
+calendar does to show every day of a month: one `GET /api/events/<date>`
+request per day, against a single `GET /api/events?start=&end=` range request
+for the month, and for the month with its neighbours as the calendar prefetches
+it. Then times the same month range request revalidated with the ETag of the
+previous response, as browsers do while the calendar is unchanged, and, after
+one event is edited, the `GET /api/events/changes` delta that replaces
+refetching the month. Prints the p50/p99 latency of each and the size of the
+range responses.
+
+Usage:
+    python -m benchmarks.event_range [--events-per-day 8] [--runs 20]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.models import User, Event
+from benchmarks.common import make_config, percentiles, time_calls
+
+START = datetime(2025, 1, 1)
+MONTH = datetime(2025, 5, 1)
+
+
+def seed(events_per_day, days=365):
+    """
+    Create user 1 with `events_per_day` events of up to two hours on each of `days` days.
+    """
+    db.session.execute(insert(User), [
+        {'id': 1, 'username': 'user1', 'email': 'user1@example.com', 'max_event_seconds': 2 * 3600}
+    ])
+    rng = random.Random(2105)
+    rows = []
+    for day in range(days):
+        for _ in range(events_per_day):
+            start = START + timedelta(days=day, hours=7, minutes=15 * rng.randrange(60))
+            rows.append({
+                'title': 'Meeting',
+                'description': 'Weekly sync with the team',
+                'start_time': start,
+                'end_time': start + timedelta(minutes=15 * rng.randint(1, 8)),
+                'privacy_level': 'private',
+                'user_id': 1,
+                'created_by': 1,
+            })
+    db.session.execute(insert(Event), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events-per-day', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db'), WTF_CSRF_ENABLED=False))
+        with app.app_context():
+            db.create_all()
+            seed(args.events_per_day)
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = '1'
+            sess['_fresh'] = True
+
+        def get(url, etag=None, status=200):
+            response = client.get(url, headers={'If-None-Match': etag} if etag else {})
+            assert response.status_code == status, response.get_data(as_text=True)
+            return response.get_data()
+
+        def per_day():
+            for offset in range(31):
+                get(f"/api/events/{(MONTH + timedelta(days=offset)).strftime('%Y-%m-%d')}")
+
+        month_url = '/api/events?start=2025-05-01&end=2025-06-01'
+        prefetch_url = '/api/events?start=2025-04-01&end=2025-07-01'
+        cursor = client.get('/api/events/changes').get_json()['cursor']
+        assert client.put('/api/events/1', json={'title': 'Moved'}).status_code == 200
+        changes_url = f'/api/events/changes?since={cursor}'
+        month_etag = client.get(month_url).headers['ETag']
+        print(f'{args.events_per_day} events a day over a year')
+        for label, fn in (
+            ('31 x GET /api/events/<date>', per_day),
+            (f'GET range, month ({len(get(month_url)) // 1024} KiB)', lambda: get(month_url)),
+            (f'GET range, 3 months ({len(get(prefetch_url)) // 1024} KiB)', lambda: get(prefetch_url)),
+            ('GET range, month, 304 Not Modified', lambda: get(month_url, month_etag, 304)),
+            ('GET changes since cursor, 1 edit', lambda: get(changes_url)),
+        ):
+            p50, p99 = percentiles(time_calls(fn, args.runs))
+            print(f'{label:<36} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
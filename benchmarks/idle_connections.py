@@ -0,0 +1,84 @@
+"""
+Benchmark for the memory held by idle Socket.IO connections in each server mode.
+
+For every requested `SOCKETIO_ASYNC_MODE`, starts `python wsgi.py` on a spare
+port, opens many WebSocket connections that complete the Socket.IO handshake
+and then stay idle, and reads the server's resident memory and thread count
+from /proc before and after. Prints the memory used per connection. Modes
+whose library is not installed are skipped.
+
+Usage:
+    python -m benchmarks.idle_connections [--modes threading gevent eventlet] [--connections 500]
+"""
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+import websocket
+
+from benchmarks.common import process_status, wait_for_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 5300
+
+
+def open_connection(port):
+    """
+    Open a WebSocket and complete the Engine.IO and Socket.IO handshakes.
+    """
+    connection = websocket.create_connection(
+        f'ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket', timeout=30
+    )
+    connection.recv()
+    connection.send('40')
+    connection.recv()
+    return connection
+
+
+def run_mode(mode, n_connections):
+    env = dict(os.environ, SOCKETIO_ASYNC_MODE=mode, PORT=str(PORT), SECRET_KEY='benchmark')
+    server = subprocess.Popen(
+        [sys.executable, 'wsgi.py'], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    connections = []
+    try:
+        wait_for_port(PORT)
+        connections.append(open_connection(PORT))
+        time.sleep(0.5)
+        rss_before, threads_before = process_status(server.pid)
+        for _ in range(n_connections):
+            connections.append(open_connection(PORT))
+        time.sleep(1)
+        rss_after, threads_after = process_status(server.pid)
+        return rss_before, rss_after, threads_before, threads_after
+    finally:
+        for connection in connections:
+            connection.close()
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['threading', 'gevent', 'eventlet'])
+    parser.add_argument('--connections', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f'{args.connections} idle connections')
+    for mode in args.modes:
+        if mode != 'threading' and importlib.util.find_spec(mode) is None:
+            print(f'{mode:<10} skipped: {mode} is not installed')
+            continue
+        rss_before, rss_after, threads_before, threads_after = run_mode(mode, args.connections)
+        per_connection = (rss_after - rss_before) / args.connections
+        print(f'{mode:<10} RSS {rss_before / 1024:7.1f} -> {rss_after / 1024:7.1f} MiB   '
+              f'threads {threads_before:5d} -> {threads_after:5d}   {per_connection:7.1f} KiB per connection')
+
+
+if __name__ == '__main__':
+    main()
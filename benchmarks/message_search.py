@@ -0,0 +1,139 @@
+"""
+Benchmark for searching chat messages.
+
+Seeds a temporary SQLite database with a synthetic corpus of messages between
+random pairs of users, with words drawn from a Zipf distribution so that some
+words are in most messages and others in very few. The `message_fts` index is
+filled by its triggers as the messages are inserted. Then times a search for a
+common word, a rare word and two words in one user's conversations, three ways:
+a `LIKE '%word%'` scan, an FTS5 match on the words filtered afterwards by
+participant, and the FTS5 match scoped by participant tokens that
+`app.search.search_messages` uses. Prints the p50/p99 latency of each.
+
+Usage:
+    python -m benchmarks.message_search [--messages 10000000] [--users 10000] [--runs 50]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert, text
+
+from app import create_app, db
+from app.models import User
+from app.search import fts5_query
+from benchmarks.common import make_config, percentiles, time_calls
+
+VOCABULARY_SIZE = 50000
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'do', 'fi', 'gu', 'he', 'ja', 'bo']
+START = datetime(2025, 1, 1)
+
+
+def vocabulary():
+    """
+    Return `VOCABULARY_SIZE` distinct made-up words, most frequent first.
+    """
+    words = []
+    for i in range(VOCABULARY_SIZE):
+        word, n = '', i
+        while True:
+            word += SYLLABLES[n % len(SYLLABLES)]
+            n //= len(SYLLABLES)
+            if not n:
+                break
+        words.append(word + 'n')
+    return words
+
+
+def seed(n_messages, n_users, batch_size=100000):
+    """
+    Insert `n_users` users and `n_messages` messages of 3 to 20 Zipf-distributed words between random users.
+    """
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com'}
+        for i in range(1, n_users + 1)
+    ])
+    db.session.commit()
+    words = np.array(vocabulary())
+    rng = np.random.default_rng(1809)
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for first in range(0, n_messages, batch_size):
+            count = min(batch_size, n_messages - first)
+            lengths = rng.integers(3, 21, count)
+            ranks = np.minimum(rng.zipf(1.1, lengths.sum()), VOCABULARY_SIZE) - 1
+            contents = (' '.join(chunk) for chunk in np.split(words[ranks], np.cumsum(lengths)[:-1]))
+            senders = rng.integers(1, n_users + 1, count)
+            recipients = (senders + rng.integers(1, n_users, count) - 1) % n_users + 1
+            cursor.executemany(
+                'INSERT INTO message (sender_id, recipient_id, content, timestamp, read) VALUES (?, ?, ?, ?, 0)',
+                zip(senders.tolist(), recipients.tolist(), contents,
+                    (str(START + timedelta(seconds=first + i)) for i in range(count)))
+            )
+            connection.commit()
+    finally:
+        connection.close()
+
+
+def strategies():
+    """
+    The ways of finding the newest or best 20 matches in a user's conversations, as (label, sql, params) builders.
+    """
+    def like(user_id, terms):
+        conditions = ' AND '.join(f'content LIKE :t{i}' for i in range(len(terms)))
+        params = {f't{i}': f'%{term}%' for i, term in enumerate(terms)}
+        return (f'SELECT id FROM message WHERE (sender_id = :uid OR recipient_id = :uid) AND {conditions} '
+                'ORDER BY id DESC LIMIT 20', dict(params, uid=user_id))
+
+    def fts_then_filter(user_id, terms):
+        return ('SELECT message.id FROM message_fts JOIN message ON message.id = message_fts.rowid '
+                'WHERE message_fts MATCH :match AND (message.sender_id = :uid OR message.recipient_id = :uid) '
+                'ORDER BY bm25(message_fts, 1.0, 0.0) LIMIT 20',
+                {'match': 'content : (' + ' '.join(f'"{term}"' for term in terms) + ')', 'uid': user_id})
+
+    def fts_scoped(user_id, terms):
+        return ('SELECT rowid FROM message_fts WHERE message_fts MATCH :match '
+                'ORDER BY bm25(message_fts, 1.0, 0.0), rowid DESC LIMIT 20',
+                {'match': fts5_query(terms, user_id)})
+
+    return [('LIKE scan', like), ('FTS5, then filter by user', fts_then_filter),
+            ('FTS5 scoped by participant tokens', fts_scoped)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+
+    words = vocabulary()
+    searches = [('common word', [words[2]]), ('rare word', [words[3000]]), ('two words', [words[5], words[60]])]
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db')))
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            seed(args.messages, args.users)
+            print(f'Seeded and indexed {args.messages} messages for {args.users} users '
+                  f'in {time.perf_counter() - started:.1f} s')
+
+            rng = random.Random(77)
+            for search_label, terms in searches:
+                print(f'\n== {search_label}: {" ".join(terms)} ==')
+                for label, build in strategies():
+                    def search():
+                        sql, params = build(rng.randint(1, args.users), terms)
+                        db.session.execute(text(sql), params).all()
+                    p50, p99 = percentiles(time_calls(search, args.runs))
+                    print(f'{label:<36} p50 {p50:9.3f} ms   p99 {p99:9.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark for chat message write throughput, with and without write-behind.
+
+Seeds a temporary SQLite database with pairs of users, then has one thread per
+sender POST messages to `/messages/send` as fast as it can: once with every
+message committed in its own transaction, and once with `CHAT_WRITE_BEHIND`,
+where messages are acknowledged at once and committed in batches by the writer
+thread. For each case prints the acknowledged messages per second, the p50/p99
+acknowledgement latency, and the throughput counted until the last message was
+committed.
+
+Usage:
+    python -m benchmarks.message_writes [--senders 8] [--messages 2000]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.models import Message, User
+from benchmarks.common import make_config, percentiles
+
+
+def seed(n_senders):
+    """
+    Create `2 * n_senders` users: user 2i - 1 sends to user 2i.
+    """
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com'}
+        for i in range(1, 2 * n_senders + 1)
+    ])
+    db.session.commit()
+
+
+def run_sender(app, sender_id, count, start_event, timings):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(sender_id)
+        session['_fresh'] = True
+    body = {'recipient_id': sender_id + 1, 'content': 'load test'}
+    start_event.wait()
+    for _ in range(count):
+        started = time.perf_counter()
+        response = client.post('/messages/send', json=body)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+
+def run_case(write_behind, n_senders, n_messages):
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_config(
+            os.path.join(directory, 'chat.db'),
+            WTF_CSRF_ENABLED=False,
+            CHAT_WRITE_BEHIND=write_behind,
+            SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}},
+        ))
+        with app.app_context():
+            db.create_all()
+            seed(n_senders)
+
+        per_sender = n_messages // n_senders
+        start_event = threading.Event()
+        timings = []
+        threads = [
+            threading.Thread(target=run_sender, args=(app, 2 * i - 1, per_sender, start_event, timings))
+            for i in range(1, n_senders + 1)
+        ]
+        for thread in threads:
+            thread.start()
+        started = time.perf_counter()
+        start_event.set()
+        for thread in threads:
+            thread.join()
+        acknowledged = time.perf_counter() - started
+        writer = app.extensions.get('message_writer')
+        if writer is not None:
+            writer.close()
+        committed = time.perf_counter() - started
+
+        with app.app_context():
+            stored = Message.query.count()
+            db.engine.dispose()
+        total = per_sender * n_senders
+        assert stored == total, f'{stored} of {total} messages were stored'
+        return total / acknowledged, total / committed, percentiles(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f'{args.senders} senders, {args.messages} messages')
+    for label, write_behind in (('commit per message', False), ('write-behind', True)):
+        acked_rate, committed_rate, (p50, p99) = run_case(write_behind, args.senders, args.messages)
+        print(f'{label:<20} acked {acked_rate:8.1f} msg/s   committed {committed_rate:8.1f} msg/s   '
+              f'ack p50 {p50:6.2f} ms   p99 {p99:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
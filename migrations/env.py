@@ -90,9 +90,20 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # the full-text search table and index are created by raw DDL (app/search.py),
+    # so autogenerate must not try to drop them
+    def include_object(object, name, type_, reflected, compare_to):
+        if type_ == 'table' and name.startswith('message_fts'):
+            return False
+        if type_ == 'index' and name == 'ix_message_content_fts':
+            return False
+        return True
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
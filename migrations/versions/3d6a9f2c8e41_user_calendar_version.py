@@ -0,0 +1,26 @@
+"""Add calendar_version to user for conditional calendar responses
+
+Revision ID: 3d6a9f2c8e41
+Revises: 8f7175bad047
+Create Date: 2025-05-28 10:12:37.804216
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d6a9f2c8e41'
+down_revision = '8f7175bad047'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('calendar_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('calendar_version')
@@ -0,0 +1,37 @@
+"""Add max_event_seconds to user for bounded event overlap queries
+
+Revision ID: 5e2b8c9d1f07
+Revises: c3f1a7d2e9b4
+Create Date: 2025-05-21 14:37:09.552318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b8c9d1f07'
+down_revision = 'c3f1a7d2e9b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('max_event_seconds', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill the bound from the events that already exist.
+    if op.get_bind().dialect.name == 'postgresql':
+        duration = 'EXTRACT(EPOCH FROM (end_time - start_time))'
+    else:
+        duration = '(julianday(end_time) - julianday(start_time)) * 86400'
+    op.execute(
+        'UPDATE "user" SET max_event_seconds = COALESCE(('
+        f'SELECT CAST(MAX({duration}) AS INTEGER) + 1 FROM events '
+        'WHERE events.user_id = "user".id), 0)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('max_event_seconds')
@@ -0,0 +1,40 @@
+"""Add a commit-ordered seq to event_changes for delta sync cursors
+
+Revision ID: 6b1e0d7c4a92
+Revises: 19d0fd9a5404
+Create Date: 2025-06-03 11:20:08.413905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1e0d7c4a92'
+down_revision = '19d0fd9a5404'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('event_changes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('seq', sa.Integer(), nullable=True))
+        batch_op.drop_index('ix_event_changes_user_id')
+        batch_op.create_index('ix_event_changes_user_seq', ['user_id', 'seq'], unique=False)
+
+    # Existing entries keep their id as sequence number, so the cursors clients
+    # hold stay valid, and versions move past them so new entries sort after.
+    op.execute('UPDATE event_changes SET seq = id')
+    op.execute(
+        'UPDATE "user" SET calendar_version = '
+        '(SELECT max(seq) FROM event_changes WHERE event_changes.user_id = "user".id) '
+        'WHERE calendar_version < '
+        '(SELECT max(seq) FROM event_changes WHERE event_changes.user_id = "user".id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('event_changes', schema=None) as batch_op:
+        batch_op.drop_index('ix_event_changes_user_seq')
+        batch_op.create_index('ix_event_changes_user_id', ['user_id', 'id'], unique=False)
+        batch_op.drop_column('seq')
@@ -0,0 +1,59 @@
+"""Add conversation_summary table for the inbox and unread counts
+
+Revision ID: 7c2e9f4a1b68
+Revises: 0b9e4d2c7a15
+Create Date: 2025-05-25 10:12:47.203561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9f4a1b68'
+down_revision = '0b9e4d2c7a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('peer_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('unread_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['last_message_id'], ['message.id'], ),
+    sa.ForeignKeyConstraint(['peer_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'peer_id')
+    )
+    with op.batch_alter_table('conversation_summary', schema=None) as batch_op:
+        batch_op.create_index('ix_conversation_summary_user_timestamp', ['user_id', 'last_timestamp'], unique=False)
+
+    # Summarize the existing messages: one row per participant of each conversation.
+    op.execute("""
+        INSERT INTO conversation_summary (user_id, peer_id, last_message_id, last_timestamp, unread_count)
+        SELECT pairs.user_id, pairs.peer_id, message.id, message.timestamp,
+               (SELECT count(*) FROM message AS unread
+                WHERE unread.sender_id = pairs.peer_id AND unread.recipient_id = pairs.user_id
+                  AND unread.sender_id != unread.recipient_id
+                  AND (unread.read IS NULL OR NOT unread.read))
+        FROM (
+            SELECT user_id, peer_id, max(id) AS last_id
+            FROM (
+                SELECT sender_id AS user_id, recipient_id AS peer_id, id FROM message
+                UNION ALL
+                SELECT recipient_id AS user_id, sender_id AS peer_id, id FROM message
+            ) AS sides
+            GROUP BY user_id, peer_id
+        ) AS pairs
+        JOIN message ON message.id = pairs.last_id
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('conversation_summary', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_summary_user_timestamp')
+
+    op.drop_table('conversation_summary')
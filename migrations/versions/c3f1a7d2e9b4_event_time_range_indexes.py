@@ -0,0 +1,28 @@
+"""Add composite indexes for event time-range queries
+
+Revision ID: c3f1a7d2e9b4
+Revises: 89d09e15a14b
+Create Date: 2025-05-20 19:02:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a7d2e9b4'
+down_revision = '89d09e15a14b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.create_index('ix_events_user_start', ['user_id', 'start_time'], unique=False)
+        batch_op.create_index('ix_events_user_privacy_start', ['user_id', 'privacy_level', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_index('ix_events_user_privacy_start')
+        batch_op.drop_index('ix_events_user_start')
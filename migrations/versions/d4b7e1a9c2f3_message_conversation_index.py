@@ -0,0 +1,26 @@
+"""Add composite index for paging through conversations
+
+Revision ID: d4b7e1a9c2f3
+Revises: a8d4e6f2b310
+Create Date: 2025-05-23 09:41:12.640275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b7e1a9c2f3'
+down_revision = 'a8d4e6f2b310'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_sender_recipient_timestamp', ['sender_id', 'recipient_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_sender_recipient_timestamp')
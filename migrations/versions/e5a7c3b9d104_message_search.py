@@ -0,0 +1,57 @@
+"""Add full-text search index for chat messages
+
+Revision ID: e5a7c3b9d104
+Revises: 7c2e9f4a1b68
+Create Date: 2025-05-26 16:40:09.582117
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c3b9d104'
+down_revision = '7c2e9f4a1b68'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(content, participants, content='')",
+    """CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts (rowid, content, participants)
+        VALUES (new.id, new.content, 'u' || new.sender_id || ' u' || new.recipient_id);
+    END""",
+    """CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.recipient_id);
+    END""",
+    """CREATE TRIGGER message_fts_update AFTER UPDATE OF content, sender_id, recipient_id ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.recipient_id);
+        INSERT INTO message_fts (rowid, content, participants)
+        VALUES (new.id, new.content, 'u' || new.sender_id || ' u' || new.recipient_id);
+    END""",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DDL:
+            op.execute(statement)
+        op.execute(
+            "INSERT INTO message_fts (rowid, content, participants) "
+            "SELECT id, content, 'u' || sender_id || ' u' || recipient_id FROM message"
+        )
+    elif dialect == 'postgresql':
+        op.execute("CREATE INDEX ix_message_content_fts ON message USING gin (to_tsvector('simple', content))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for trigger in ('message_fts_insert', 'message_fts_delete', 'message_fts_update'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS message_fts')
+    elif dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_message_content_fts')
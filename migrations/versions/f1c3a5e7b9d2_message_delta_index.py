@@ -0,0 +1,26 @@
+"""Add composite index for fetching new messages by id
+
+Revision ID: f1c3a5e7b9d2
+Revises: d4b7e1a9c2f3
+Create Date: 2025-05-23 15:27:08.915436
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c3a5e7b9d2'
+down_revision = 'd4b7e1a9c2f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_sender_recipient_id', ['sender_id', 'recipient_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_sender_recipient_id')
@@ -1,6 +1,42 @@
+"""
+WSGI entry point for production servers.
+
+The Socket.IO server mode is chosen with the `SOCKETIO_ASYNC_MODE` environment
+variable (see `Config`):
+
+- 'threading' (default): every connection holds an OS thread. Run with a
+  threaded server, e.g. `gunicorn -w 1 --threads 100 wsgi:app`.
+- 'gevent': every connection is a greenlet on one event loop per process, and
+  the Socket.IO handlers push database work to a thread pool. Needs
+  `pip install gevent`; run with `SOCKETIO_ASYNC_MODE=gevent python wsgi.py`, or
+  `gunicorn -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker -w 1 wsgi:app`
+  (with `pip install gevent-websocket`).
+- 'eventlet': the same with eventlet (`pip install eventlet`), e.g.
+  `SOCKETIO_ASYNC_MODE=eventlet gunicorn -k eventlet -w 1 wsgi:app`.
+
+The cooperative modes monkey-patch the standard library here, before the
+application (or anything else) is imported. `HOST` and `PORT` set the address
+used by `python wsgi.py`.
+"""
+
+import os
+
+ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
 from app import create_app, socketio
 
 app = create_app()
 
 if __name__ == "__main__":
-    socketio.run(app)
+    socketio.run(
+        app,
+        host=os.environ.get('HOST', '127.0.0.1'),
+        port=int(os.environ.get('PORT', 5000)),
+        allow_unsafe_werkzeug=ASYNC_MODE == 'threading'
+    )